@@ -1,31 +1,45 @@
 import os
 import uuid
 import threading
+import time
 import socket
 import subprocess
 import io
-import numpy as np
-from flask import Flask, request, jsonify, send_from_directory, send_file
+import math
+from flask import Flask, request, jsonify, send_from_directory, send_file, Response, stream_with_context
 from flask_cors import CORS
 import yt_dlp
 from gtts import gTTS
 from PIL import Image
 import re
 import zipfile
-# rembg and cv2 are loaded lazily to avoid startup timeout
-# Preload rembg session for faster background removal
-REMBG_SESSION = None
-def get_rembg_session():
-    global REMBG_SESSION
-    if REMBG_SESSION is None:
-        try:
-            from rembg import new_session
-            REMBG_SESSION = new_session("u2net")
-            print("Rembg model preloaded successfully")
-        except Exception as e:
-            print(f"Failed to preload rembg: {e}")
-    return REMBG_SESSION
-
+import glob
+import shutil
+import tempfile
+import functools
+import atexit
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from task_store import create_task_store, TERMINAL_STATES
+from scheduler import Scheduler, QueueFullError, ProcessPool
+from result_cache import ResultCache
+from pdf_render import (IMAGE_FORMATS, RENDER_MIN_DPI, RENDER_MAX_DPI, parse_page_ranges, pdf_page_count,
+                        render_pages, chunk_pages)
+from pdf_merge import merge_pdfs
+from pdf_pipeline import open_pdf, save_pdf, copy_pages, import_form, page_box, stamp
+from pdf_watermark import watermark_style, watermark_pdf
+from pdf_compress import (COMPRESSION_LEVELS, IMAGE_CODECS, analyse as analyse_pdf, recompress_images,
+                          rewrite as rewrite_pdf, subset_fonts as subset_pdf_fonts)
+from video_encoder import EncoderScheduler, target_video_bitrate, keyframe_times, plan_segments, encode_segmented
+from media_probe import probe, first_stream, run_ffmpeg, ProbeError, FFmpegError
+from file_serving import send_result_file, send_virtual_zip
+from zip_builder import write_zip, VirtualZips
+from uploads import StreamingUploadRequest, save_upload, known_hash
+from office_pool import OfficePool
+from bg_removal import BackgroundRemover, BackgroundRemovalError
+from image_convert import (OUTPUT_FORMATS, MIMETYPES, convert_options, convert_to_spool,
+                           convert_image as convert_image_file)
+from inpaint import (INPAINT_METHODS, box_regions, mask_regions, load_mask, inpaint_regions, inpaint_video,
+                     display_size)
 # --- DNS WORKAROUND FOR HUGGING FACE ---
 # Use Google DNS (8.8.8.8) to resolve hostnames
 original_getaddrinfo = socket.getaddrinfo
@@ -47,6 +61,7 @@ socket.getaddrinfo = patched_getaddrinfo
 # --- END DNS WORKAROUND ---
 
 app = Flask(__name__)
+app.request_class = StreamingUploadRequest  # Uploads are written straight to their final path
 CORS(app)  # Enable CORS for all routes
 
 # Configuration
@@ -57,6 +72,122 @@ if not os.path.exists(DOWNLOAD_FOLDER):
 
 app.config['UPLOAD_FOLDER'] = DOWNLOAD_FOLDER
 
+# Upload size limits (bytes per request); the default applies to every other endpoint
+MB = 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('UPLOAD_LIMIT_MB', 200)) * MB
+app.config['UPLOAD_LIMITS'] = {
+    'convert_video': 2048 * MB,
+    'compress_video': 2048 * MB,
+    'remove_watermark': 1024 * MB,
+    'remove_watermark_video': 2048 * MB,
+    'merge_pdf': 500 * MB,
+    'whatsapp_status_zip': 1024 * MB,
+    'batch_tool': 1024 * MB,
+    'convert_image': 100 * MB,
+    'remove_background': 50 * MB,
+}
+
+# How /files/ responses are sent: 'direct' (sendfile through gunicorn),
+# 'x-accel' (nginx internal location at X_ACCEL_PREFIX) or 'x-sendfile'
+FILE_SERVE_MODE = os.environ.get('FILE_SERVE_MODE', 'direct').strip().lower()
+X_ACCEL_PREFIX = os.environ.get('X_ACCEL_PREFIX', '/protected-downloads')
+
+# Bundles are either written to disk ('file') or only described by a manifest
+# and zipped on the fly while /files/ sends them ('stream')
+ZIP_MODE = os.environ.get('ZIP_MODE', 'file').strip().lower()
+virtual_zips = VirtualZips(DOWNLOAD_FOLDER)
+
+# Files accepted by one /api/batch/<tool> (or multi-image /api/img-to-pdf) request
+BATCH_MAX_FILES = int(os.environ.get('BATCH_MAX_FILES', 50))
+
+def publish_zip(zip_filename, members, task_id=None, start=10, end=95):
+    """Make `members` ([(path, arcname)]) downloadable as /files/<zip_filename>. False if cancelled"""
+    if ZIP_MODE == 'stream':
+        virtual_zips.create(zip_filename, members)
+        return True
+    if task_id is None:
+        return write_zip(os.path.join(DOWNLOAD_FOLDER, zip_filename), members)
+    last = [start]
+    def on_progress(fraction):
+        progress = start + int(fraction * (end - start))
+        if progress != last[0]:
+            last[0] = progress
+            task_store.update(task_id, progress=progress)
+    return write_zip(os.path.join(DOWNLOAD_FOLDER, zip_filename), members, on_progress,
+                     lambda: task_store.is_cancelled(task_id))
+
+def result_available(filename):
+    return os.path.exists(os.path.join(DOWNLOAD_FOLDER, filename)) or virtual_zips.exists(filename)
+
+# Outputs of deterministic tools, keyed by input hash + tool + parameters
+result_cache = ResultCache(
+    os.path.join(DOWNLOAD_FOLDER, '.cache'),
+    int(os.environ.get('RESULT_CACHE_MB', 1024)) * 1024 * 1024
+)
+
+# Task state shared by every gunicorn worker (SQLite by default, see TASK_STORE_URL)
+STATE_FOLDER = os.path.join(os.getcwd(), 'state')
+os.makedirs(STATE_FOLDER, exist_ok=True)
+task_store = create_task_store(STATE_FOLDER)
+
+CPU_COUNT = os.cpu_count() or 1
+# Warm LibreOffice instances per gunicorn worker (see office_pool.py)
+OFFICE_INSTANCES = max(1, int(os.environ.get('OFFICE_INSTANCES', 2)))
+# Concurrent x264 encodes per gunicorn worker; the 'encode' pool has exactly this many workers
+ENCODER_JOBS = max(1, int(os.environ.get('ENCODER_JOBS') or 0) or CPU_COUNT // 4)
+# Worker pools per class of tool: name -> (concurrent jobs, max waiting jobs)
+TOOL_POOLS = {
+    'download': (4, 50),                     # yt-dlp, network bound
+    'ffmpeg': (max(1, CPU_COUNT // 2), 20),  # audio extraction and other short ffmpeg runs
+    'encode': (ENCODER_JOBS, 20),            # x264 encodes, one per encoder slot
+    'office': (OFFICE_INSTANCES, 20),        # LibreOffice conversions
+    'pdf': (CPU_COUNT, 50),                  # PDF rendering and rewriting
+    'image': (max(1, CPU_COUNT // 2), 20),   # rembg / OpenCV
+    'archive': (2, 50),                      # zip bundles
+    'batch': (2, 10),                        # batch drivers feeding the pools above
+}
+
+def update_queue_positions(started_task_id, waiting_task_ids):
+    """Publish queue positions so status polls on any worker can show them"""
+    task_store.update(started_task_id, queue_position=0)
+    for position, waiting_id in enumerate(waiting_task_ids, start=1):
+        task_store.update(waiting_id, queue_position=position)
+
+scheduler = Scheduler(TOOL_POOLS, on_queue_change=update_queue_positions)
+
+# Warm worker processes for tasks that hold the GIL (PDF rendering, OpenCV, rembg...)
+cpu_pool = ProcessPool(
+    int(os.environ.get('CPU_WORKERS', CPU_COUNT)),
+    warm_modules=('fitz', 'pikepdf', 'reportlab.pdfgen.canvas', 'pdf2docx', 'cv2')
+)
+CPU_BOUND_TASKS = set()
+
+# One background-removal model process per host, shared by every worker (see bg_model_server.py)
+bg_remover = BackgroundRemover(
+    os.environ.get('BG_MODEL_SOCKET', os.path.join(STATE_FOLDER, 'bgremove.sock')),
+    threads=int(os.environ.get('BG_THREADS', CPU_COUNT)),
+    max_batch=int(os.environ.get('BG_MAX_BATCH', 8)),
+)
+BG_MODELS = ('u2net', 'u2netp', 'silueta')
+
+# Created on first use: process-pool children re-import this module and must not make their own
+office_pool = None
+office_pool_lock = threading.Lock()
+
+def get_office_pool():
+    global office_pool
+    with office_pool_lock:
+        if office_pool is None:
+            office_pool = OfficePool(OFFICE_INSTANCES, python=os.environ.get('OFFICE_PYTHON') or None,
+                                     timeout=int(os.environ.get('OFFICE_TIMEOUT', 120)))
+            atexit.register(office_pool.close)
+        return office_pool
+
+def cpu_bound(func):
+    """Mark a task to run in the process pool instead of a pool thread"""
+    CPU_BOUND_TASKS.add(func.__name__)
+    return func
+
 FFMPEG_BIN = os.path.join(os.getcwd(), 'bin', 'ffmpeg.exe') if os.name == 'nt' else os.path.join(os.getcwd(), 'bin', 'ffmpeg')
 if os.path.exists(FFMPEG_BIN):
     os.environ['IMAGEIO_FFMPEG_EXE'] = FFMPEG_BIN
@@ -112,16 +243,41 @@ def serve_static_root(filename):
     root_dir = os.path.dirname(os.path.abspath(__file__))
     return send_from_directory(root_dir, filename)
 
-# Global dictionary to store download tasks
-downloads = {}
+# Extracted info dicts hold signed media URLs, so they only live for a while;
+# the record of a finished download lives as long as the file stays on disk.
+YTDLP_INFO_TTL = int(os.environ.get('YTDLP_INFO_TTL', 1800))
+YTDLP_FILE_TTL = int(os.environ.get('YTDLP_FILE_TTL', 24 * 3600))
+TRACKING_PARAMS = {'si', 'feature', 'igshid', 'igsh', 'fbclid', 'gclid', 'is_from_webapp', 'sender_device', 'ref'}
+
+def normalize_media_url(url):
+    """Canonical form of a link so share-sheet variants hit the same cache entry"""
+    parts = urlsplit(url.strip())
+    host = parts.netloc.lower()
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    query = sorted(
+        (k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if not (k.startswith('utm_') or k in TRACKING_PARAMS)
+    )
+    return urlunsplit(('https', host, parts.path.rstrip('/') or '/', urlencode(query), ''))
 
 def download_worker(task_id, url, quality):
+    if task_store.is_cancelled(task_id):
+        task_store.update(task_id, status='cancelled')
+        return
     try:
-        downloads[task_id]['status'] = 'downloading'
-        downloads[task_id]['progress'] = 0
+        task_store.update(task_id, status='downloading', progress=0)
+        # yt-dlp calls the hook for every chunk; only write whole-percent changes to the store
+        last_progress = [-1]
+
+        def set_progress(value):
+            if int(value) != last_progress[0]:
+                last_progress[0] = int(value)
+                task_store.update(task_id, progress=value)
 
         def progress_hook(d):
-            if downloads[task_id].get('cancel_event'):
+            if task_store.is_cancelled(task_id):
                 raise Exception("Download cancelled by user")
             
             if d['status'] == 'downloading':
@@ -131,18 +287,18 @@ def download_worker(task_id, url, quality):
                     import re
                     ansi_escape = re.compile(r'\x1B(?:[@-Z\\-_]|\[[0-?]*[ -/]*[@-~])')
                     p = ansi_escape.sub('', p)
-                    downloads[task_id]['progress'] = float(p)
+                    set_progress(float(p))
                 except Exception:
                     # Fallback to calculating from bytes
                     try:
                         total = d.get('total_bytes') or d.get('total_bytes_estimate')
                         downloaded = d.get('downloaded_bytes')
                         if total and downloaded:
-                            downloads[task_id]['progress'] = (downloaded / total) * 100
+                            set_progress((downloaded / total) * 100)
                     except:
                         pass
             elif d['status'] == 'finished':
-                downloads[task_id]['progress'] = 100
+                set_progress(100)
 
         output_template = os.path.join(DOWNLOAD_FOLDER, '%(title).200s-%(id)s.%(ext)s')
 
@@ -203,12 +359,28 @@ def download_worker(task_id, url, quality):
              # Default fallback
             ydl_opts['format'] = 'best'
 
+        # Same link and quality already downloaded and still on disk: serve it directly
+        cache_key = f"{normalize_media_url(url)}|{quality}"
+        finished = task_store.cache_get('ytdlp-file', cache_key)
+        if finished and result_available(finished['filename']):
+            task_store.update(task_id, status='completed', progress=100, from_cache=True, result=finished)
+            return
+
+        # Extracted info (with resolved formats) is reused by repeat requests and the fallback below
+        extracted = task_store.cache_get('ytdlp-info', cache_key)
+
         try:
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
+                if extracted is None:
+                    extracted = ydl.extract_info(url, download=False)
+                    if extracted is None:
+                        raise Exception('No media found in this link or access denied')
+                    extracted = ydl.sanitize_info(extracted)
+                    task_store.cache_set('ytdlp-info', cache_key, extracted, YTDLP_INFO_TTL)
+                info = ydl.process_ie_result(extracted, download=True)
                 
                 # Check for cancellation again
-                if downloads[task_id].get('cancel_event'):
+                if task_store.is_cancelled(task_id):
                     raise Exception("Download cancelled by user")
 
                 if 'entries' in info:
@@ -241,18 +413,15 @@ def download_worker(task_id, url, quality):
                     # Zip them up
                     safe_title = re.sub(r'[<>:"/\\|?*]', '', info.get('title') or 'media_master_bundle')
                     zip_filename = f"{task_id}_{safe_title[:50]}.zip"
-                    zip_path = os.path.join(DOWNLOAD_FOLDER, zip_filename)
+                    publish_zip(zip_filename, [(f, os.path.basename(f)) for f in downloaded_files])
                     
-                    with zipfile.ZipFile(zip_path, 'w') as zf:
-                        for f in downloaded_files:
-                            zf.write(f, os.path.basename(f))
-                    
-                    downloads[task_id]['status'] = 'completed'
-                    downloads[task_id]['result'] = {
+                    result = {
                         'filename': zip_filename,
                         'title': info.get('title', 'Carousel Contents'),
                         'download_url': f'/files/{zip_filename}'
                     }
+                    task_store.update(task_id, status='completed', result=result)
+                    task_store.cache_set('ytdlp-file', cache_key, result, YTDLP_FILE_TTL)
                 else:
                     # Single file
                     filename = ydl.prepare_filename(info)
@@ -267,21 +436,26 @@ def download_worker(task_id, url, quality):
                     if not os.path.exists(filename):
                         raise Exception('Downloaded file not found on server')
 
-                    downloads[task_id]['status'] = 'completed'
-                    downloads[task_id]['result'] = {
+                    result = {
                         'filename': os.path.basename(filename),
                         'title': info.get('title', 'Media'),
                         'download_url': f"/files/{os.path.basename(filename)}"
                     }
+                    task_store.update(task_id, status='completed', result=result)
+                    task_store.cache_set('ytdlp-file', cache_key, result, YTDLP_FILE_TTL)
 
         except Exception as e:
              # Fallback to extremely basic download if complex format fails
              print(f"Retrying basic download for {url} due to: {e}")
-             if downloads[task_id].get('cancel_event'): raise e
+             if task_store.is_cancelled(task_id): raise e
              
              ydl_opts['format'] = 'best'
              with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                 info = ydl.extract_info(url, download=True)
+                 if extracted is not None:
+                     # Only format selection failed: no need to hit the extractor again
+                     info = ydl.process_ie_result(extracted, download=True)
+                 else:
+                     info = ydl.extract_info(url, download=True)
                  filename = ydl.prepare_filename(info)
                  if not os.path.exists(filename):
                      # Try to find it if it changed ext
@@ -292,22 +466,22 @@ def download_worker(task_id, url, quality):
                              break
                  
                  if os.path.exists(filename):
-                     downloads[task_id]['status'] = 'completed'
-                     downloads[task_id]['result'] = {
+                     result = {
                          'filename': os.path.basename(filename),
                          'title': info.get('title', 'Media'),
                          'download_url': f"/files/{os.path.basename(filename)}"
                      }
+                     task_store.update(task_id, status='completed', result=result)
+                     task_store.cache_set('ytdlp-file', cache_key, result, YTDLP_FILE_TTL)
                  else:
                      raise Exception("Final fallback failed. Media might be private or unsupported.")
 
     except Exception as e:
         print(f"Download Worker Error: {e}")
-        if str(e) == "Download cancelled by user" or downloads[task_id].get('cancel_event'):
-            downloads[task_id]['status'] = 'cancelled'
+        if str(e) == "Download cancelled by user" or task_store.is_cancelled(task_id):
+            task_store.update(task_id, status='cancelled')
         else:
-            downloads[task_id]['status'] = 'error'
-            downloads[task_id]['error'] = str(e)
+            task_store.update(task_id, status='error', error=str(e))
 
 
 @app.route('/api/download', methods=['POST'])
@@ -320,196 +494,464 @@ def start_download():
         return jsonify({'error': 'URL is required'}), 400
 
     task_id = str(uuid.uuid4())
-    downloads[task_id] = {
+    # Position written before the job is queued: once queued, update_queue_positions owns it
+    task_store.create(task_id, {
         'status': 'pending',
         'progress': 0,
-        'cancel_event': False
-    }
+        'cancel_event': False,
+        'pool': 'download',
+        'queue_position': scheduler.queued('download') + 1
+    })
 
-    thread = threading.Thread(target=download_worker, args=(task_id, url, quality))
-    thread.start()
+    try:
+        scheduler.submit('download', task_id, download_worker, task_id, url, quality)
+    except QueueFullError as e:
+        task_store.delete(task_id)
+        return queue_full_response(e.pool)
 
     return jsonify({'task_id': task_id})
 
+# Bookkeeping kept in task records but never sent to clients
+PRIVATE_TASK_FIELDS = ('input_hashes',)
+
+def public_task(task, **extra):
+    payload = {k: v for k, v in task.items() if k not in PRIVATE_TASK_FIELDS}
+    payload.update(extra)
+    return payload
+
+# SSE streams and long-polls each hold a gthread thread while they wait: cap them per worker
+# so uploads and ordinary requests always find a free thread
+MAX_TASK_WATCHERS = max(1, int(os.environ.get('MAX_TASK_WATCHERS', 4)))
+watcher_slots = threading.BoundedSemaphore(MAX_TASK_WATCHERS)
+
 @app.route('/api/download/status/<task_id>', methods=['GET'])
 def get_download_status(task_id):
-    task = downloads.get(task_id)
+    # Optional long-poll: ?since=<version> waits up to `timeout` seconds for a newer state.
+    # Without a free watcher slot it answers at once, like a plain poll.
+    since = request.args.get('since', type=int)
+    if since is not None and watcher_slots.acquire(blocking=False):
+        try:
+            timeout = min(request.args.get('timeout', 25, type=float), 30)
+            task_store.wait_for_changes([task_id], {task_id: since}, timeout=timeout)
+        finally:
+            watcher_slots.release()
+    version = task_store.get_versions([task_id]).get(task_id)
+    task = task_store.get(task_id)
     if not task:
         return jsonify({'error': 'Task not found'}), 404
-    return jsonify(task)
+    return jsonify(public_task(task, version=version))
+
+SSE_KEEPALIVE = 15  # seconds between comments that keep proxies from closing idle streams
+SSE_MAX_TASKS = 50
+
+def task_event_stream(task_ids):
+    """Yield one SSE `task` event per state change until every task has finished"""
+    versions = {}
+    pending = list(dict.fromkeys(task_ids))
+    yield 'retry: 3000\n\n'
+    while pending:
+        changes = task_store.wait_for_changes(pending, versions, timeout=SSE_KEEPALIVE)
+        if not changes:
+            yield ': keep-alive\n\n'
+            continue
+        for task_id, task in changes.items():
+            if task is None:
+                task = {'status': 'error', 'error': 'Task not found'}
+            payload = public_task(task, task_id=task_id, version=versions.get(task_id))
+            yield f"event: task\ndata: {json.dumps(payload)}\n\n"
+            if task.get('status') in TERMINAL_STATES:
+                pending.remove(task_id)
+    yield 'event: end\ndata: {}\n\n'
+
+def sse_response(task_ids):
+    if not watcher_slots.acquire(blocking=False):
+        # EventSource gives up on a non-200 answer and the page falls back to polling
+        return Response('retry: 10000\n\n', status=503, mimetype='text/event-stream',
+                        headers={'Retry-After': '10', 'Cache-Control': 'no-cache'})
+    response = Response(
+        stream_with_context(task_event_stream(task_ids)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+    # Runs when the stream ends or the client goes away, even if it never started
+    response.call_on_close(watcher_slots.release)
+    return response
+
+@app.route('/api/tasks/<task_id>/events', methods=['GET'])
+def task_events(task_id):
+    return sse_response([task_id])
+
+@app.route('/api/tasks/events', methods=['GET'])
+def multi_task_events():
+    task_ids = [t for t in request.args.get('ids', '').split(',') if t]
+    if not task_ids:
+        return jsonify({'error': 'ids is required'}), 400
+    if len(task_ids) > SSE_MAX_TASKS:
+        return jsonify({'error': f'At most {SSE_MAX_TASKS} tasks per stream'}), 400
+    return sse_response(task_ids)
 
 @app.route('/api/download/cancel/<task_id>', methods=['POST'])
 def cancel_download(task_id):
-    task = downloads.get(task_id)
+    task = task_store.get(task_id)
     if not task:
         return jsonify({'error': 'Task not found'}), 404
     
-    if task['status'] in ['pending', 'downloading']:
-        task['cancel_event'] = True
+    if task['status'] in ['pending', 'downloading', 'processing']:
+        task_store.request_cancel(task_id)
         return jsonify({'message': 'Cancellation requested'})
     
     return jsonify({'message': 'Task already completed or failed'}), 400
 
+# Inputs above either limit are converted as a background task instead of on the request thread
+IMAGE_SYNC_MAX_BYTES = int(float(os.environ.get('IMAGE_SYNC_MAX_MB', 10)) * MB)
+IMAGE_SYNC_MAX_PIXELS = 24_000_000
+
+def image_convert_params(form):
+    """`format`, `max_size` (longest side in pixels), `quality`, `strip_metadata` and `progressive`"""
+    def number(name):
+        value = form.get(name, '').strip()
+        if not value: return None
+        try:
+            return int(value)
+        except ValueError:
+            raise ValueError(f'Valeur invalide pour {name}')
+    def flag(name):
+        return form.get(name, '').lower() in ('1', 'true', 'yes', 'on')
+    return convert_options(form.get('format', 'png'), number('max_size'), number('quality'),
+                           flag('strip_metadata'), flag('progressive'))
+
+def image_needs_task(path):
+    """True for uploads too heavy to convert while the client waits on the request"""
+    if os.path.getsize(path) > IMAGE_SYNC_MAX_BYTES:
+        return True
+    with Image.open(path) as img:  # Reads the header only
+        return img.width * img.height > IMAGE_SYNC_MAX_PIXELS
+
 @app.route('/api/convert-image', methods=['POST'])
 def convert_image():
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
     
     file = request.files['file']
-    target_format = request.form.get('format', 'png').lower()
-    
     if file.filename == '':
         return jsonify({'error': 'No file selected'}), 400
+    try:
+        options = image_convert_params(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
+    task_id = str(uuid.uuid4())
+    input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_{secure_filename(file.filename)}")
+    save_upload(file, input_path)
+    original_name = os.path.splitext(secure_filename(file.filename))[0] or 'image'
     try:
-        from PIL import Image
-        import io
+        background = image_needs_task(input_path)
+    except (OSError, Image.DecompressionBombError):
+        os.remove(input_path)
+        return jsonify({'error': 'Image illisible ou trop grande'}), 400
 
-        # Open image
-        img = Image.open(file.stream)
-        
-        # Convert mode if necessary (e.g. RGBA to RGB for JPEG)
-        if target_format in ['jpeg', 'jpg', 'bmp'] and img.mode in ['RGBA', 'P']:
-            img = img.convert('RGB')
-        
-        # Save to buffer
-        output_buffer = io.BytesIO()
-        save_format = target_format
-        if target_format == 'jpg': save_format = 'jpeg'
-        
-        img.save(output_buffer, format=save_format.upper())
-        output_buffer.seek(0)
-        
-        # Generate filename
-        original_name = os.path.splitext(file.filename)[0]
-        new_filename = f"{original_name}.{target_format}"
-        
-        return send_file(
-            output_buffer,
-            mimetype=f'image/{target_format}',
-            as_attachment=True,
-            download_name=new_filename
-        )
+    if background:
+        output_filename = f"{original_name}_{task_id[:8]}.{options.format}"
+        try:
+            start_tool_task(task_id, 'image', convert_image_task, input_path, output_filename, options,
+                            inputs=[input_path], cache=('convert_image', output_filename, options._asdict()))
+        except QueueFullError:
+            if os.path.exists(input_path): os.remove(input_path)
+            return queue_full_response('image')
+        return jsonify({'success': True, 'task_id': task_id})
 
+    try:
+        # Stays in memory up to a few MB, then spills to a temporary file
+        output = convert_to_spool(input_path, options, DOWNLOAD_FOLDER)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    finally:
+        if os.path.exists(input_path): os.remove(input_path)
+    
+    return send_file(
+        output,
+        mimetype=MIMETYPES[OUTPUT_FORMATS[options.format]],
+        as_attachment=True,
+        download_name=f"{original_name}.{options.format}"
+    )
 
-def tool_worker_wrapper(task_id, func, *args, **kwargs):
+def convert_image_task(task_id, input_path, output_filename, options):
+    output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
+    try:
+        with open(output_path, 'wb') as out:
+            convert_image_file(input_path, out, options)
+    except Exception:
+        if os.path.exists(output_path): os.remove(output_path)
+        raise
+    if os.path.exists(input_path): os.remove(input_path)
+    return output_filename
+
+def tool_worker_wrapper(task_id, func, *args, cache_key=None, **kwargs):
     """Generic wrapper for background tool tasks"""
+    if task_store.is_cancelled(task_id):
+        # Cancelled while waiting in the queue
+        task_store.update(task_id, status='cancelled')
+        return
     try:
-        downloads[task_id]['status'] = 'processing'
-        downloads[task_id]['progress'] = 10  # Initial jump
+        task_store.update(task_id, status='processing', progress=10)  # Initial jump
         
-        result_filename = func(task_id, *args, **kwargs)
+        if func.__name__ in CPU_BOUND_TASKS:
+            # Progress and cancellation still go through task_store from the child process
+            result_filename = cpu_pool.run(func, task_id, *args, **kwargs)
+        else:
+            result_filename = func(task_id, *args, **kwargs)
         
         # Check for cancellation
-        if downloads[task_id].get('cancel_event'):
+        if task_store.is_cancelled(task_id):
             # Clean up result if produced
             if result_filename and os.path.exists(os.path.join(DOWNLOAD_FOLDER, result_filename)):
                 os.remove(os.path.join(DOWNLOAD_FOLDER, result_filename))
-            downloads[task_id]['status'] = 'cancelled'
+            task_store.update(task_id, status='cancelled')
             return
 
-        downloads[task_id]['status'] = 'completed'
-        downloads[task_id]['result'] = {
+        if cache_key:
+            try:
+                result_cache.store(cache_key, os.path.join(DOWNLOAD_FOLDER, result_filename))
+            except Exception as e:
+                print(f"Result cache store failed ({task_id}): {e}")
+
+        task_store.update(task_id, status='completed', result={
             'filename': result_filename,
             'download_url': f'/files/{result_filename}'
-        }
+        })
     except Exception as e:
         print(f"Tool Error ({task_id}): {e}")
-        downloads[task_id]['status'] = 'error'
-        downloads[task_id]['error'] = str(e)
+        task_store.update(task_id, status='error', error=str(e))
+
+# Pool serving each task-creating endpoint
+ENDPOINT_POOLS = {
+    'start_download': 'download',
+    'convert_video': 'ffmpeg',
+    'compress_video': 'encode',
+    'remove_background': 'image',
+    'remove_watermark': 'image',
+    'remove_watermark_video': 'encode',
+    'pdf_to_images': 'pdf',
+    'merge_pdf': 'pdf',
+    'extract_pages': 'pdf',
+    'compress_pdf': 'pdf',
+    'lock_pdf': 'pdf',
+    'unlock_pdf': 'pdf',
+    'pdf_to_word': 'pdf',
+    'add_watermark': 'pdf',
+    'add_signature': 'pdf',
+    'draw_pdf': 'pdf',
+    'edit_pdf': 'pdf',
+    'img_to_pdf': 'pdf',
+    'word_to_pdf': 'office',
+    'ppt_to_pdf': 'office',
+    'whatsapp_status_zip': 'archive',
+    'batch_tool': 'batch',
+}
+
+def queue_full_response(pool):
+    response = jsonify({
+        'error': 'Serveur occupé, trop de tâches en attente. Réessayez dans quelques instants.',
+        'queue_full': True,
+        'pool': pool
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = '30'
+    return response
+
+@app.before_request
+def reject_when_queue_full():
+    # Refuse before the upload body is read when the target pool cannot take more work
+    pool = ENDPOINT_POOLS.get(request.endpoint)
+    if pool and request.method == 'POST' and scheduler.is_full(pool):
+        return queue_full_response(pool)
+
+def start_tool_task(task_id, pool, func, *args, inputs=(), cache=None, create=True, input_hashes=None, **fields):
+    """Create the record of a tool task and queue it on `pool`
+
+    `cache` is an optional (tool, output_filename, params) tuple for deterministic
+    tools: a hit completes the task at once from the result cache. Extra `fields`
+    go into the record. Raises QueueFullError (record removed, inputs kept).
+    With `create=False` the record already exists (batch children): it is only
+    updated, keeping its cancel flag, and left in place when the queue is full.
+    `input_hashes` ({path: sha256}) must be given outside a request, where the
+    upload hashes of known_hash() are not available.
+    """
+    def save(record):
+        if create:
+            task_store.create(task_id, record)
+        else:
+            task_store.update(task_id, **record)
+
+    input_hashes = input_hashes or {p: known_hash(p) for p in inputs}
+    cache_key = None
+    if cache:
+        tool, output_filename, params = cache
+        cache_key = result_cache.make_key(tool, [input_hashes[p] for p in inputs], params)
+        if result_cache.lookup(cache_key, os.path.join(DOWNLOAD_FOLDER, output_filename)):
+            for path in inputs:
+                if os.path.exists(path): os.remove(path)
+            record = dict(fields, status='completed', progress=100, cached=True,
+                          result={'filename': output_filename, 'download_url': f'/files/{output_filename}'})
+            if create:
+                record['cancel_event'] = False
+            save(record)
+            return 0
+
+    # Expected position, written before the job is queued: once a worker can pick it up,
+    # only update_queue_positions may change it (writing it afterwards could undo a 0)
+    record = dict(fields, status='pending', progress=0, pool=pool, input_hashes=input_hashes,
+                  queue_position=scheduler.queued(pool) + 1)
+    if create:
+        record['cancel_event'] = False
+    save(record)
+    try:
+        return scheduler.submit(pool, task_id, functools.partial(tool_worker_wrapper, cache_key=cache_key),
+                                task_id, func, *args)
+    except QueueFullError:
+        if create:
+            task_store.delete(task_id)
+        raise
+
+def queue_tool_task(task_id, func, *args, inputs=(), cache=None):
+    """Register a tool task and queue it on the pool serving the current endpoint"""
+    pool = ENDPOINT_POOLS[request.endpoint]
+    try:
+        start_tool_task(task_id, pool, func, *args, inputs=inputs, cache=cache)
+    except QueueFullError:
+        for path in inputs:
+            if os.path.exists(path): os.remove(path)
+        return queue_full_response(pool)
+    return jsonify({'success': True, 'task_id': task_id})
 
-def video_to_audio_task(task_id, input_path, output_filename):
-    """Fast video to audio conversion using FFmpeg directly with cancellation support"""
-    import subprocess
-    import re
-    
+@app.route('/api/pools', methods=['GET'])
+def get_pool_stats():
+    return jsonify(scheduler.stats())
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    return jsonify(result_cache.stats())
+
+def probe_media(task_id, path):
+    """ffprobe summary of a task input, shared across tasks through its upload hash"""
+    digest = ((task_store.get(task_id) or {}).get('input_hashes') or {}).get(path)
+    try:
+        return probe(path, digest=digest, cache=task_store)
+    except (ProbeError, ValueError) as e:
+        print(f"ffprobe failed ({task_id}): {e}")
+        raise Exception("Fichier média illisible ou corrompu")
+
+def run_tool_ffmpeg(task_id, args, duration, start, end, error_message):
+    """Run ffmpeg for a tool task, mapping its progress onto start..end. False if cancelled."""
+    last = [start]
+    def on_progress(fraction):
+        progress = start + int(fraction * (end - start))
+        if progress != last[0]:
+            last[0] = progress
+            task_store.update(task_id, progress=progress)
+    try:
+        return run_ffmpeg(args, duration, on_progress, lambda: task_store.is_cancelled(task_id))
+    except FFmpegError as e:
+        print(f"ffmpeg failed ({task_id}): {e}")
+        raise Exception(error_message)
+
+# Output format -> (extension, source codec that can be copied as is, encoder arguments)
+AUDIO_FORMATS = {
+    'mp3': ('mp3', 'mp3', ['-c:a', 'libmp3lame', '-q:a', '4']),
+    'm4a': ('m4a', 'aac', ['-c:a', 'aac', '-b:a', '192k']),
+    'opus': ('opus', 'opus', ['-c:a', 'libopus', '-b:a', '128k']),
+    'wav': ('wav', None, ['-c:a', 'pcm_s16le']),
+}
+# 'auto' keeps the source track when one of the formats above can hold it
+AUDIO_COPY_FORMATS = {codec: fmt for fmt, (_, codec, _) in AUDIO_FORMATS.items() if codec}
+
+def video_to_audio_task(task_id, input_path, output_filename, audio_format='mp3'):
+    """Extract the audio track, remuxing it without re-encoding when the codec already fits"""
     # Check cancellation before starting
-    if downloads[task_id].get('cancel_event'):
+    if task_store.is_cancelled(task_id):
         if os.path.exists(input_path): os.remove(input_path)
         return None
     
     output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
-    ffmpeg_bin = FFMPEG_BIN if os.path.exists(FFMPEG_BIN) else 'ffmpeg'
-    
-    # Get video duration first for progress calculation
-    duration_cmd = [ffmpeg_bin, '-i', input_path]
-    try:
-        result = subprocess.run(duration_cmd, capture_output=True, text=True, stderr=subprocess.STDOUT)
-        duration_match = re.search(r'Duration: (\d+):(\d+):(\d+\.\d+)', result.stdout)
-        if duration_match:
-            hours, minutes, seconds = duration_match.groups()
-            total_duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
-        else:
-            total_duration = 0
-    except:
-        total_duration = 0
-    
-    downloads[task_id]['progress'] = 15
-    
-    # Fast audio extraction with FFmpeg (optimized settings)
-    cmd = [
-        ffmpeg_bin, '-i', input_path,
-        '-vn',  # No video
-        '-acodec', 'libmp3lame',  # MP3 codec
-        '-q:a', '4',  # Good quality, faster (was 2)
-        '-y',  # Overwrite
-        output_path
-    ]
-    
-    # Run with progress tracking
-    process = subprocess.Popen(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, text=True, universal_newlines=True)
-    downloads[task_id]['process'] = process  # Store for cancellation
-    
-    # Parse progress from FFmpeg output
-    for line in process.stderr:
-        # Check for cancellation during processing
-        if downloads[task_id].get('cancel_event'):
-            process.terminate()
-            process.wait()
-            if os.path.exists(input_path): os.remove(input_path)
-            if os.path.exists(output_path): os.remove(output_path)
-            return None
-        
-        if total_duration > 0:
-            time_match = re.search(r'time=(\d+):(\d+):(\d+\.\d+)', line)
-            if time_match:
-                h, m, s = time_match.groups()
-                current_time = int(h) * 3600 + int(m) * 60 + float(s)
-                progress = min(95, 15 + int((current_time / total_duration) * 80))
-                downloads[task_id]['progress'] = progress
-    
-    process.wait()
-    
-    if process.returncode != 0:
-        raise Exception("Erreur lors de l'extraction audio")
+    info = probe_media(task_id, input_path)
+    audio = first_stream(info, 'audio')
+    if not audio:
+        raise Exception("Cette vidéo ne contient pas de piste audio")
+    
+    _, copy_codec, encode_args = AUDIO_FORMATS[audio_format]
+    modes = ['transcode']
+    if copy_codec and audio['codec'] == copy_codec:
+        modes.insert(0, 'copy')
+    
+    container_args = ['-movflags', '+faststart'] if audio_format == 'm4a' else []
+    task_store.update(task_id, progress=15, source_codec=audio['codec'])
+    
+    for mode in modes:
+        codec_args = ['-c:a', 'copy'] if mode == 'copy' else encode_args
+        args = ['-i', input_path, '-map', f"0:{audio['index']}", '-vn', '-sn', '-dn'] + codec_args + container_args + [output_path]
+        task_store.update(task_id, audio_mode=mode)
+        try:
+            finished = run_tool_ffmpeg(task_id, args, info['duration'], 15, 95, "Erreur lors de l'extraction audio")
+            break
+        except Exception:
+            # Some containers carry streams the target muxer refuses as is: re-encode instead
+            if mode != 'copy':
+                raise
+            print(f"Stream copy failed ({task_id}), transcoding")
+    
+    if not finished:
+        if os.path.exists(input_path): os.remove(input_path)
+        if os.path.exists(output_path): os.remove(output_path)
+        return None
     
     if os.path.exists(input_path): 
         os.remove(input_path)
     
     return output_filename
 
+def audio_format_param(form):
+    """Requested audio format of convert-video: a key of AUDIO_FORMATS or 'auto'. ValueError carries the user message"""
+    requested = form.get('format', 'mp3').lower()
+    if requested not in AUDIO_FORMATS and requested != 'auto':
+        raise ValueError(f'Format non supporté: {requested}')
+    return requested
+
+def resolve_audio_format(input_path, requested):
+    """`requested`, or for 'auto' the container that holds the source track without re-encoding"""
+    if requested != 'auto':
+        return requested
+    try:
+        audio = first_stream(probe(input_path, digest=known_hash(input_path), cache=task_store), 'audio')
+    except (ProbeError, ValueError):
+        audio = None
+    return AUDIO_COPY_FORMATS.get(audio and audio['codec'], 'mp3')
+
 @app.route('/api/convert-video', methods=['POST'])
 def convert_video():
     if 'file' not in request.files: return jsonify({'error': 'No file uploaded'}), 400
     file = request.files['file']
     if file.filename == '': return jsonify({'error': 'No file selected'}), 400
+    try:
+        requested = audio_format_param(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     task_id = str(uuid.uuid4())
     original_name = os.path.splitext(secure_filename(file.filename))[0]
     input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_in_{secure_filename(file.filename)}")
-    file.save(input_path)
-    output_filename = f"{original_name}.mp3"
+    save_upload(file, input_path)
+
+    audio_format = resolve_audio_format(input_path, requested)
+    extension = AUDIO_FORMATS[audio_format][0]
+    output_filename = f"{original_name}.{extension}"
     
     # If file exists, append task_id to avoid conflict
     if os.path.exists(os.path.join(DOWNLOAD_FOLDER, output_filename)):
-        output_filename = f"{original_name}_{task_id[:8]}.mp3"
+        output_filename = f"{original_name}_{task_id[:8]}.{extension}"
     
-    downloads[task_id] = {'status': 'pending', 'progress': 0}
-    threading.Thread(target=tool_worker_wrapper, args=(task_id, video_to_audio_task, input_path, output_filename)).start()
-    
-    return jsonify({'success': True, 'task_id': task_id})
+    return queue_tool_task(task_id, video_to_audio_task, input_path, output_filename, audio_format,
+                           inputs=[input_path],
+                           cache=('video_to_audio', output_filename, {'format': audio_format}))
 
 @app.route('/api/convert-text', methods=['POST'])
 def convert_text():
@@ -551,343 +993,694 @@ def convert_text():
 
 @app.route('/files/<path:filename>')
 def serve_file(filename):
-    return send_from_directory(DOWNLOAD_FOLDER, filename, as_attachment=True)
+    # Hidden entries (result cache, indexes...) are internal
+    if any(part.startswith('.') for part in filename.replace('\\', '/').split('/')):
+        return jsonify({'error': 'Not Found'}), 404
+    response = send_result_file(DOWNLOAD_FOLDER, filename, FILE_SERVE_MODE, X_ACCEL_PREFIX)
+    if response is not None:
+        return response
+    members = virtual_zips.members(filename)
+    if members:
+        return send_virtual_zip(filename, members)
+    return jsonify({'error': 'Not Found'}), 404
 
 # --- VIDEO COMPRESSION ---
-def compress_video_task(task_id, input_path, output_filename, quality):
-    """Fast video compression with real-time progress"""
-    import subprocess
-    import re
-    
-    # Set compression parameters based on quality
-    if quality == 'low':
-        # ultrafast: extremely fast, larger file size
-        crf, scale, preset = 30, "640:-2", "ultrafast"
-    elif quality == 'high':
-        # superfast: very fast, better quality
-        crf, scale, preset = 23, "1920:-2", "superfast"
-    else: # medium
-        # ultrafast: balance default
-        crf, scale, preset = 26, "1280:-2", "ultrafast"
-    
-    output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
-    ffmpeg_bin = FFMPEG_BIN if os.path.exists(FFMPEG_BIN) else 'ffmpeg'
-    
-    # Get video duration for progress
-    duration_cmd = [ffmpeg_bin, '-i', input_path]
+# Concurrent x264 encodes share the cores; busy queues push new jobs to faster presets
+video_encoder = EncoderScheduler(
+    CPU_COUNT,
+    max_jobs=ENCODER_JOBS,
+    queue_depth=lambda: scheduler.pools['encode'].stats()['queued']
+)
+COMPRESS_AUDIO_BITRATE = 96_000
+# Inputs at least this long (seconds) are encoded in parallel segments of
+# SEGMENT_MIN_LENGTH seconds or more, SEGMENT_THREADS x264 threads each
+SEGMENT_ENCODE_MIN_SECONDS = float(os.environ.get('SEGMENT_ENCODE_MIN_SECONDS', 600))
+SEGMENT_MIN_LENGTH = 60
+SEGMENT_THREADS = 2
+
+# quality -> (crf, scale, preset used when the encoder is idle)
+VIDEO_QUALITIES = {
+    'low': (30, "640:-2", "veryfast"),
+    'medium': (26, "1280:-2", "veryfast"),
+    'high': (23, "1920:-2", "faster"),
+}
+
+def compress_video_segmented(task_id, input_path, output_path, info, count, video_args, audio_args, error_message):
+    """Encode keyframe-aligned segments in parallel ffmpeg processes. None if the input cannot be split."""
+    segments = plan_segments(keyframe_times(input_path), info['duration'], count)
+    if len(segments) < 2:
+        return None
+    task_store.update(task_id, segments=len(segments))
+    workdir = tempfile.mkdtemp(prefix=f".{task_id}_seg", dir=DOWNLOAD_FOLDER)
+    last = [20]
+    def on_progress(fraction):
+        progress = 20 + int(fraction * 72)
+        if progress != last[0]:
+            last[0] = progress
+            task_store.update(task_id, progress=progress)
     try:
-        result = subprocess.run(duration_cmd, capture_output=True, text=True, stderr=subprocess.STDOUT)
-        duration_match = re.search(r'Duration: (\d+):(\d+):(\d+\.\d+)', result.stdout)
-        if duration_match:
-            hours, minutes, seconds = duration_match.groups()
-            total_duration = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+        return encode_segmented(input_path, output_path, segments, video_args,
+                                audio_args if first_stream(info, 'audio') else None, workdir,
+                                on_progress, lambda: task_store.is_cancelled(task_id))
+    except FFmpegError as e:
+        print(f"Segmented encode failed ({task_id}): {e}")
+        raise Exception(error_message)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def compress_video_task(task_id, input_path, output_filename, quality, target_mb=None):
+    """Compress with libx264 under the encoder scheduler, by CRF or towards a target size"""
+    crf, scale, base_preset = VIDEO_QUALITIES[quality]
+    output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
+    info = probe_media(task_id, input_path)
+    duration = info['duration']
+    input_bytes = os.path.getsize(input_path)
+    
+    bitrate = None
+    if target_mb:
+        bitrate = target_video_bitrate(target_mb * MB, duration, COMPRESS_AUDIO_BITRATE)
+        if not bitrate:
+            raise Exception("Taille cible trop petite pour la durée de cette vidéo")
+    
+    passlog = os.path.join(DOWNLOAD_FOLDER, f".{task_id}_x264pass")
+    with video_encoder.slot(task_id, base_preset) as job:
+        task_store.update(task_id, progress=20, encoder={'preset': job.preset, 'threads': job.threads})
+        video_args = ['-vf', f'scale={scale}', '-c:v', 'libx264', '-preset', job.preset]
+        audio_args = ['-c:a', 'aac', '-b:a', str(COMPRESS_AUDIO_BITRATE)]
+        container_args = ['-movflags', '+faststart']
+        error = "Erreur lors de la compression"
+        if bitrate and job.load == 0:
+            mode = 'two-pass'
+        elif bitrate:
+            mode = 'capped'
+            rate_args = ['-b:v', str(bitrate), '-maxrate', str(bitrate), '-bufsize', str(2 * bitrate)]
         else:
-            total_duration = 0
-    except:
-        total_duration = 0
-    
-    downloads[task_id]['progress'] = 20
-    
-    cmd = [
-        ffmpeg_bin, '-y', '-i', input_path,
-        '-vf', f'scale={scale}',
-        '-c:v', 'libx264',
-        '-preset', preset,  # Faster encoding
-        '-crf', str(crf),
-        '-c:a', 'aac',
-        '-b:a', '96k',  # Reduced from 128k for speed
-        '-movflags', '+faststart',
-        output_path
-    ]
-    
-    # Run with progress tracking
-    process = subprocess.Popen(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE, text=True, universal_newlines=True)
-    downloads[task_id]['process'] = process  # Store for cancellation
-    
-    for line in process.stderr:
-        # Check for cancellation during processing
-        if downloads[task_id].get('cancel_event'):
-            process.terminate()
-            process.wait()
+            mode = 'crf'
+            rate_args = ['-crf', str(crf)]
+        
+        # Long single-pass encodes are cut at keyframes and encoded side by side
+        segments = 1
+        if mode != 'two-pass' and duration >= SEGMENT_ENCODE_MIN_SECONDS:
+            segments = min(job.threads // SEGMENT_THREADS, int(duration // SEGMENT_MIN_LENGTH))
+        
+        try:
+            if mode == 'two-pass':
+                # Idle: a two-pass encode hits the size while spending bits where they matter
+                rate_args = ['-b:v', str(bitrate), '-passlogfile', passlog, '-threads', str(job.threads)]
+                finished = run_tool_ffmpeg(task_id, ['-i', input_path] + video_args + rate_args +
+                                           ['-pass', '1', '-an', '-f', 'null', os.devnull],
+                                           duration, 20, 55, error)
+                if finished:
+                    finished = run_tool_ffmpeg(task_id, ['-i', input_path] + video_args + rate_args + ['-pass', '2'] +
+                                               audio_args + container_args + [output_path],
+                                               duration, 55, 95, error)
+            elif segments >= 2:
+                finished = compress_video_segmented(task_id, input_path, output_path, info, segments,
+                                                    video_args + rate_args + ['-threads', str(max(1, job.threads // segments))],
+                                                    audio_args, error)
+                if finished is None:
+                    segments = 1  # No usable keyframes: fall back to one process
+            if segments < 2 and mode != 'two-pass':
+                finished = run_tool_ffmpeg(task_id, ['-i', input_path] + video_args + rate_args +
+                                           ['-threads', str(job.threads)] + audio_args + container_args +
+                                           [output_path], duration, 20, 95, error)
+        finally:
+            for leftover in glob.glob(passlog + '*'):
+                os.remove(leftover)
+        
+        if not finished:
             if os.path.exists(input_path): os.remove(input_path)
             if os.path.exists(output_path): os.remove(output_path)
             return None
         
-        # Try standard time=HH:MM:SS.ms format
-        time_match = re.search(r'time=(\d+):(\d+):(\d+\.\d+)', line)
-        if time_match and total_duration > 0:
-            h, m, s = time_match.groups()
-            current_time = int(h) * 3600 + int(m) * 60 + float(s)
-            progress = min(95, 20 + int((current_time / total_duration) * 75))
-            downloads[task_id]['progress'] = progress
-        # Fallback for simpler format (seconds only)
-        elif 'time=' in line and total_duration > 0:
-            try:
-                sec_match = re.search(r'time=(\d+\.\d+)', line)
-                if sec_match:
-                    current_time = float(sec_match.group(1))
-                    progress = min(95, 20 + int((current_time / total_duration) * 75))
-                    downloads[task_id]['progress'] = progress
-            except:
-                pass
-    
-    process.wait()
-    
-    if process.returncode != 0:
-        raise Exception("Erreur lors de la compression")
+        summary = job.finish(duration, input_bytes, os.path.getsize(output_path), mode)
+    task_store.update(task_id, encode=summary)
     
     if os.path.exists(input_path): 
         os.remove(input_path)
     
     return output_filename
 
+def compress_video_params(form):
+    """(quality, target_mb) of a compress-video request. ValueError carries the user message"""
+    quality = form.get('quality', 'medium')
+    if quality not in VIDEO_QUALITIES:
+        raise ValueError(f'Qualité non supportée: {quality}')
+    target_mb = form.get('target_mb', type=float)
+    if target_mb is not None and target_mb <= 0:
+        raise ValueError('Taille cible invalide')
+    return quality, target_mb
+
 @app.route('/api/compress-video', methods=['POST'])
 def compress_video():
-    # DISABLED - Fonctionnalité à venir
-    return jsonify({
-        'error': 'Fonctionnalité temporairement désactivée - Bientôt disponible !',
-        'disabled': True
-    }), 503
+    if 'file' not in request.files: return jsonify({'error': 'No file uploaded'}), 400
+    file = request.files['file']
+    if file.filename == '': return jsonify({'error': 'No file selected'}), 400
+    try:
+        quality, target_mb = compress_video_params(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    task_id = str(uuid.uuid4())
+    original_name = os.path.splitext(secure_filename(file.filename))[0]
+    input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_in_{secure_filename(file.filename)}")
+    save_upload(file, input_path)
+    output_filename = f"{original_name}_compressed_{task_id[:8]}.mp4"
+
+    return queue_tool_task(task_id, compress_video_task, input_path, output_filename, quality, target_mb,
+                           inputs=[input_path])
+
+@app.route('/api/encoder/stats', methods=['GET'])
+def get_encoder_stats():
+    return jsonify(video_encoder.stats())
 
 
 # --- BACKGROUND REMOVAL ---
-def remove_bg_task(task_id, input_path, output_filename):
-    from rembg import remove
-    
+@cpu_bound
+def remove_bg_task(task_id, input_path, output_filename, model='u2net'):
     # Check cancellation before starting heavy work
-    if downloads[task_id].get('cancel_event'):
+    if task_store.is_cancelled(task_id):
         if os.path.exists(input_path): os.remove(input_path)
         return None
     
-    input_image = Image.open(input_path)
-    downloads[task_id]['progress'] = 20
-    
-    # Use preloaded session for 5-10x faster processing
-    session = get_rembg_session()
-    downloads[task_id]['progress'] = 40
+    task_store.update(task_id, progress=20)
     
-    if session:
-        output_image = remove(input_image, session=session)
-    else:
-        output_image = remove(input_image)  # Fallback
+    # Inference runs in the shared model process; only the mask comes back
+    output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
+    try:
+        bg_remover.remove_file(input_path, output_path, model)
+    except BackgroundRemovalError as e:
+        print(f"Background removal failed ({task_id}): {e}")
+        raise Exception(str(e))
     
     # Check cancellation after processing
-    if downloads[task_id].get('cancel_event'):
-        if os.path.exists(input_path): os.remove(input_path)
+    if task_store.is_cancelled(task_id):
+        for path in (input_path, output_path):
+            if os.path.exists(path): os.remove(path)
         return None
     
-    downloads[task_id]['progress'] = 90
-    output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
-    output_image.save(output_path, 'PNG')
+    task_store.update(task_id, progress=90)
     if os.path.exists(input_path): os.remove(input_path)
     return output_filename
 
+def bg_model_param(form):
+    model = form.get('model', 'u2net').lower()
+    if model not in BG_MODELS:
+        raise ValueError(f'Modèle non supporté: {model}')
+    return model
+
 @app.route('/api/remove-background', methods=['POST'])
 def remove_background():
-    # DISABLED - Fonctionnalité à venir
-    return jsonify({
-        'error': 'Fonctionnalité temporairement désactivée - Bientôt disponible !',
-        'disabled': True
-    }), 503
+    if 'file' not in request.files: return jsonify({'error': 'No file provided'}), 400
+    file = request.files['file']
+    if file.filename == '': return jsonify({'error': 'No file selected'}), 400
+    try:
+        model = bg_model_param(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e), 'models': list(BG_MODELS)}), 400
+    
+    task_id = str(uuid.uuid4())
+    input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_{secure_filename(file.filename)}")
+    save_upload(file, input_path)
+    output_filename = f"{task_id}_nobg.png"
+    
+    return queue_tool_task(task_id, remove_bg_task, input_path, output_filename, model, inputs=[input_path],
+                           cache=('remove_background', output_filename, {'model': model}))
+
+@app.route('/api/remove-background/stats', methods=['GET'])
+def get_bg_removal_stats():
+    if not os.path.exists(bg_remover.socket_path):
+        return jsonify({'running': False})
+    try:
+        return jsonify({'running': True, 'models': bg_remover.stats()})
+    except BackgroundRemovalError as e:
+        return jsonify({'running': False, 'error': str(e)})
 
 
 # --- WATERMARK REMOVAL ---
-def remove_watermark_task(task_id, input_path, output_filename, x, y, width, height):
+@cpu_bound
+def remove_watermark_task(task_id, input_path, output_filename, boxes, method='telea', radius=3, mask_path=None):
     import cv2
-    img = cv2.imread(input_path)
-    if img is None: raise Exception('Could not read image')
-    
-    ih, iw = img.shape[:2]
-    # Normalize if needed
-    if x <= 1.0 and y <= 1.0:
-        x, y = int(x * iw), int(y * ih)
-    if width <= 1.0 and height <= 1.0:
-        width, height = int(width * iw), int(height * ih)
-    
-    x, y, w, h = int(x), int(y), int(width), int(height)
-    x = max(0, min(iw - 1, x))
-    y = max(0, min(ih - 1, y))
-    x2 = max(0, min(iw, x + w))
-    y2 = max(0, min(ih, y + h))
-    
-    mask = np.zeros(img.shape[:2], dtype=np.uint8)
-    mask[y:y2, x:x2] = 255
-    
-    downloads[task_id]['progress'] = 50
-    result = cv2.inpaint(img, mask, 3, cv2.INPAINT_TELEA)
-    output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
-    cv2.imwrite(output_path, result)
-    if os.path.exists(input_path): os.remove(input_path)
+    try:
+        img = cv2.imread(input_path)
+        if img is None: raise Exception('Could not read image')
+        
+        # Only a padded crop around each area is inpainted, then pasted back in place
+        ih, iw = img.shape[:2]
+        regions = box_regions(boxes, iw, ih, radius)
+        if mask_path:
+            try:
+                regions += mask_regions(load_mask(mask_path, iw, ih), radius)
+            except ValueError as e:
+                raise Exception(str(e))
+        if not regions: raise Exception('Aucune zone à effacer dans cette image')
+        
+        task_store.update(task_id, progress=50, regions=len(regions))
+        inpaint_regions(img, regions, radius, method)
+        output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
+        cv2.imwrite(output_path, img)
+    finally:
+        for path in (input_path, mask_path):
+            if path and os.path.exists(path): os.remove(path)
     return output_filename
 
+INPAINT_MAX_RADIUS = 25
+INPAINT_MAX_REGIONS = 50
+
+def watermark_box(values):
+    """(x, y, width, height) of an area to erase, in pixels or as fractions of the frame"""
+    try:
+        box = tuple(float(v) for v in values)
+    except (TypeError, ValueError):
+        raise ValueError('Zone du filigrane invalide (x, y, width, height)')
+    if len(box) != 4 or not all(math.isfinite(v) for v in box) or min(box) < 0 or box[2] <= 0 or box[3] <= 0:
+        raise ValueError('Zone du filigrane invalide (x, y, width, height)')
+    return box
+
+def inpaint_params(form, has_mask):
+    """Areas (`regions` JSON list or x/y/width/height fields), `method` and `radius` of the watermark removal tools"""
+    method = form.get('method', 'telea').lower()
+    if method not in INPAINT_METHODS:
+        raise ValueError(f'Méthode non supportée: {method}')
+    try:
+        radius = int(form.get('radius', 3))
+    except ValueError:
+        raise ValueError('Rayon invalide')
+    if not 1 <= radius <= INPAINT_MAX_RADIUS:
+        raise ValueError(f'Le rayon doit être compris entre 1 et {INPAINT_MAX_RADIUS}')
+
+    if form.get('regions'):
+        try:
+            raw = json.loads(form['regions'])
+        except ValueError:
+            raise ValueError('Liste de zones invalide')
+        if not isinstance(raw, list):
+            raise ValueError('Liste de zones invalide')
+        if not all(isinstance(r, (dict, list)) for r in raw):
+            raise ValueError('Liste de zones invalide: chaque zone est [x, y, w, h] ou {x, y, width, height}')
+        boxes = [watermark_box([r.get(k) for k in ('x', 'y', 'width', 'height')] if isinstance(r, dict) else r)
+                 for r in raw]
+    elif form.get('x') is not None:
+        boxes = [watermark_box([form.get(k) for k in ('x', 'y', 'width', 'height')])]
+    else:
+        boxes = []
+    if not boxes and not has_mask:
+        raise ValueError('Indiquez au moins une zone ou un masque')
+    if len(boxes) > INPAINT_MAX_REGIONS:
+        raise ValueError(f'{INPAINT_MAX_REGIONS} zones maximum')
+    return boxes, method, radius
+
+def save_inpaint_mask(task_id):
+    """Brush mask PNG (white or opaque = erase) uploaded next to the file, if any"""
+    mask = request.files.get('mask')
+    if not mask or not mask.filename:
+        return None
+    mask_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_mask.png")
+    save_upload(mask, mask_path)
+    return mask_path
+
 @app.route('/api/remove-watermark', methods=['POST'])
 def remove_watermark():
-    # DISABLED - Fonctionnalité à venir
-    return jsonify({
-        'error': 'Fonctionnalité temporairement désactivée - Bientôt disponible !',
-        'disabled': True
-    }), 503
+    if 'file' not in request.files: return jsonify({'error': 'No file provided'}), 400
+    file = request.files['file']
+    if file.filename == '': return jsonify({'error': 'No file selected'}), 400
+    try:
+        boxes, method, radius = inpaint_params(request.form, bool(request.files.get('mask')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    task_id = str(uuid.uuid4())
+    input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_{secure_filename(file.filename)}")
+    save_upload(file, input_path)
+    mask_path = save_inpaint_mask(task_id)
+    extension = os.path.splitext(file.filename)[1].lower() or '.png'
+    output_filename = f"{task_id}_clean{extension}"
+    inputs = [input_path] + ([mask_path] if mask_path else [])
+    return queue_tool_task(task_id, remove_watermark_task, input_path, output_filename, boxes, method, radius,
+                           mask_path, inputs=inputs,
+                           cache=('remove_watermark', output_filename,
+                                  {'boxes': boxes, 'method': method, 'radius': radius}))
+
+# Crops are inpainted on these many threads next to each x264 encode
+VIDEO_INPAINT_WORKERS = max(1, int(os.environ.get('VIDEO_INPAINT_WORKERS', max(1, CPU_COUNT // 4))))
+
+def remove_video_watermark_task(task_id, input_path, output_filename, boxes, method='telea', radius=3,
+                                mask_path=None):
+    """Inpaint fixed areas on every frame, piping raw frames between two ffmpeg processes"""
+    info = probe_media(task_id, input_path)
+    video = first_stream(info, 'video')
+    if not video or not video['width'] or not video['height']:
+        raise Exception("Aucune piste vidéo dans ce fichier")
+    fps = video['fps'] or 25
+    size = display_size(video)
+    regions = box_regions(boxes, *size, radius)
+    if mask_path:
+        try:
+            regions += mask_regions(load_mask(mask_path, *size), radius)
+        except ValueError as e:
+            raise Exception(str(e))
+        finally:
+            if os.path.exists(mask_path): os.remove(mask_path)
+    if not regions: raise Exception('Aucune zone à effacer dans cette vidéo')
+    output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
+
+    with video_encoder.slot(task_id, 'veryfast') as job:
+        task_store.update(task_id, progress=15, encoder={'preset': job.preset, 'threads': job.threads})
+        # x264 needs even dimensions
+        encode_args = ['-vf', 'crop=trunc(iw/2)*2:trunc(ih/2)*2', '-c:v', 'libx264', '-preset', job.preset,
+                       '-crf', '20', '-pix_fmt', 'yuv420p', '-threads', str(job.threads),
+                       '-c:a', 'aac', '-b:a', str(COMPRESS_AUDIO_BITRATE), '-shortest', '-movflags', '+faststart']
+        last = [15]
+        def on_progress(fraction):
+            progress = 15 + int(fraction * 80)
+            if progress != last[0]:
+                last[0] = progress
+                task_store.update(task_id, progress=progress)
+        try:
+            counters = inpaint_video(input_path, output_path, size, fps, regions, encode_args,
+                                     workers=VIDEO_INPAINT_WORKERS, radius=radius, method=method,
+                                     total_frames=int(info['duration'] * fps),
+                                     on_progress=on_progress, should_cancel=lambda: task_store.is_cancelled(task_id))
+        except FFmpegError as e:
+            print(f"Video inpainting failed ({task_id}): {e}")
+            raise Exception("Erreur lors de la suppression du filigrane")
+
+        if counters is None:
+            if os.path.exists(input_path): os.remove(input_path)
+            if os.path.exists(output_path): os.remove(output_path)
+            return None
+        summary = job.finish(info['duration'], os.path.getsize(input_path), os.path.getsize(output_path), 'inpaint')
+    task_store.update(task_id, encode=summary, inpaint=counters)
+
+    if os.path.exists(input_path): os.remove(input_path)
+    return output_filename
+
+@app.route('/api/remove-watermark-video', methods=['POST'])
+def remove_watermark_video():
+    if 'file' not in request.files: return jsonify({'error': 'No file provided'}), 400
+    file = request.files['file']
+    if file.filename == '': return jsonify({'error': 'No file selected'}), 400
+    try:
+        boxes, method, radius = inpaint_params(request.form, bool(request.files.get('mask')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    task_id = str(uuid.uuid4())
+    original_name = os.path.splitext(secure_filename(file.filename))[0]
+    input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_in_{secure_filename(file.filename)}")
+    save_upload(file, input_path)
+    mask_path = save_inpaint_mask(task_id)
+    output_filename = f"{original_name}_clean_{task_id[:8]}.mp4"
+    inputs = [input_path] + ([mask_path] if mask_path else [])
+    return queue_tool_task(task_id, remove_video_watermark_task, input_path, output_filename, boxes, method, radius,
+                           mask_path, inputs=inputs,
+                           cache=('remove_watermark_video', output_filename,
+                                  {'boxes': boxes, 'method': method, 'radius': radius}))
 
 
 # --- PDF TOOLS ---
 
 from werkzeug.utils import secure_filename
 
+def wants_linearized():
+    """`linearize=1` asks for a web-optimised (linearized) PDF"""
+    return request.form.get('linearize', '').lower() in ('1', 'true', 'yes', 'on')
+
 # 1. PDF to Images
-def pdf_to_images_task(task_id, input_path, zip_filename):
-    from pdf2image import convert_from_path
-    import zipfile
-    import shutil
-    
-    file_id = os.path.basename(input_path).split('_')[0]
-    output_dir = os.path.join(DOWNLOAD_FOLDER, f"img_{task_id}")
-    os.makedirs(output_dir, exist_ok=True)
-    
-    downloads[task_id]['progress'] = 20
-    images = convert_from_path(input_path)
-    
-    image_paths = []
-    total = len(images)
-    for i, image in enumerate(images):
-        iname = f"page_{i+1}.png"
-        ipath = os.path.join(output_dir, iname)
-        image.save(ipath, "PNG")
-        image_paths.append(ipath)
-        downloads[task_id]['progress'] = 20 + (i / total) * 60
-        
+def pdf_to_images_task(task_id, input_path, zip_filename, dpi=200, fmt='png', pages_spec=''):
+    """Render pages in parallel chunks and write each one into the zip as it finishes"""
+    total_pages = pdf_page_count(input_path)
+    pages = parse_page_ranges(pages_spec, total_pages)
+    if not pages:
+        raise Exception("Aucune page à convertir dans cette plage")
+    task_store.update(task_id, progress=15, pages_total=len(pages), pages_done=0)
+    
+    ext = IMAGE_FORMATS[fmt]
     zip_path = os.path.join(DOWNLOAD_FOLDER, zip_filename)
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
-        for img_path in image_paths:
-            zipf.write(img_path, os.path.basename(img_path))
-            
+    jobs = [(input_path, chunk, dpi, fmt) for chunk in chunk_pages(pages, cpu_pool.workers)]
+    results = cpu_pool.imap_unordered(render_pages, jobs)
+    done = 0
+    try:
+        # Images are already compressed: store them as is
+        with zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zipf:
+            for rendered in results:
+                for index, data in rendered:
+                    zipf.writestr(f"page_{index + 1}.{ext}", data)
+                done += len(rendered)
+                if task_store.is_cancelled(task_id):
+                    break
+                task_store.update(task_id, progress=15 + int(done / len(pages) * 80), pages_done=done)
+    except BaseException:
+        # A failed render must not leave the partial zip and the upload behind
+        for path in (zip_path, input_path):
+            if os.path.exists(path): os.remove(path)
+        raise
+    finally:
+        results.close()
+    
     if os.path.exists(input_path): os.remove(input_path)
-    shutil.rmtree(output_dir)
+    if done < len(pages):
+        if os.path.exists(zip_path): os.remove(zip_path)
+        return None
     return zip_filename
 
+def pdf_to_images_params(form):
+    """(dpi, format, pages) of a pdf-to-images request. ValueError carries the user message"""
+    dpi = min(max(form.get('dpi', 200, type=int), RENDER_MIN_DPI), RENDER_MAX_DPI)
+    fmt = form.get('format', 'png').lower().replace('jpg', 'jpeg')
+    if fmt not in IMAGE_FORMATS:
+        raise ValueError(f'Format non supporté: {fmt}')
+    pages_spec = form.get('pages', '')
+    try:
+        parse_page_ranges(pages_spec)
+    except ValueError:
+        raise ValueError('Plage de pages invalide (ex: 1,3,5-7)')
+    return dpi, fmt, pages_spec
+
 @app.route('/api/pdf-to-images', methods=['POST'])
 def pdf_to_images():
     if 'file' not in request.files: return jsonify({'error': 'No file provided'}), 400
     file = request.files['file']
     if file.filename == '': return jsonify({'error': 'No file selected'}), 400
+    try:
+        dpi, fmt, pages_spec = pdf_to_images_params(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     task_id = str(uuid.uuid4())
     input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_in.pdf")
-    file.save(input_path)
+    save_upload(file, input_path)
     zip_filename = f"{task_id}_images.zip"
 
-    downloads[task_id] = {'status': 'pending', 'progress': 0}
-    threading.Thread(target=tool_worker_wrapper, args=(task_id, pdf_to_images_task, input_path, zip_filename)).start()
-    
-    return jsonify({'success': True, 'task_id': task_id})
+    return queue_tool_task(task_id, pdf_to_images_task, input_path, zip_filename, dpi, fmt, pages_spec,
+                           inputs=[input_path],
+                           cache=('pdf_to_images', zip_filename, {'dpi': dpi, 'format': fmt, 'pages': pages_spec}))
 
 # 2. Merge PDF
-def merge_pdf_task(task_id, temp_paths, output_filename):
-    from PyPDF2 import PdfMerger
-    merger = PdfMerger()
-    total = len(temp_paths)
-    for i, path in enumerate(temp_paths):
-        merger.append(path)
-        downloads[task_id]['progress'] = (i / total) * 80
+@cpu_bound
+def merge_pdf_task(task_id, temp_paths, output_filename, page_ranges=None):
+    """Append the inputs one at a time with pikepdf, sharing identical images and fonts"""
+    page_ranges = page_ranges or [''] * len(temp_paths)
+    inputs = [(path, parse_page_ranges(spec)) for path, spec in zip(temp_paths, page_ranges)]
+    
+    def on_progress(done, total):
+        task_store.update(task_id, progress=10 + int(done / total * 80), files_done=done, files_total=total)
     
     output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
-    merger.write(output_path)
-    merger.close()
+    summary = merge_pdfs(inputs, output_path, on_progress, lambda: task_store.is_cancelled(task_id))
     
     for path in temp_paths:
         if os.path.exists(path): os.remove(path)
+    if summary is None:
+        if os.path.exists(output_path): os.remove(output_path)
+        return None
+    task_store.update(task_id, merge=summary)
     return output_filename
 
 @app.route('/api/merge-pdf', methods=['POST'])
 def merge_pdf():
     files = request.files.getlist('files[]')
     if not files or files[0].filename == '': return jsonify({'error': 'No files provided'}), 400
+    # Optional per-file page ranges (same order as files[]) and a merge order such as "2,0,1"
+    page_ranges = request.form.getlist('pages[]') + [''] * len(files)
+    page_ranges = page_ranges[:len(files)]
+    try:
+        for spec in page_ranges:
+            parse_page_ranges(spec)
+        order = [int(i) for i in request.form.get('order', '').split(',') if i.strip()] or list(range(len(files)))
+    except ValueError:
+        return jsonify({'error': 'Plage de pages ou ordre invalide'}), 400
+    if sorted(set(order)) != sorted(order) or any(i < 0 or i >= len(files) for i in order):
+        return jsonify({'error': 'Ordre de fusion invalide'}), 400
     
     task_id = str(uuid.uuid4())
     temp_paths = []
     for i, file in enumerate(files):
         tpath = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_{i}.pdf")
-        file.save(tpath)
+        save_upload(file, tpath)
         temp_paths.append(tpath)
+    # Files left out of `order` are not merged
+    for i in set(range(len(files))) - set(order):
+        os.remove(temp_paths[i])
         
     output_filename = f"{task_id}_merged.pdf"
-    downloads[task_id] = {'status': 'pending', 'progress': 0}
-    threading.Thread(target=tool_worker_wrapper, args=(task_id, merge_pdf_task, temp_paths, output_filename)).start()
-    
-    return jsonify({'success': True, 'task_id': task_id})
+    return queue_tool_task(task_id, merge_pdf_task, [temp_paths[i] for i in order], output_filename,
+                           [page_ranges[i] for i in order], inputs=[temp_paths[i] for i in order])
 
 # 3. Extract Pages
-def extract_pages_task(task_id, input_path, output_filename, pages_arg):
-    from PyPDF2 import PdfReader, PdfWriter
-    reader = PdfReader(input_path)
-    writer = PdfWriter()
-    page_indices = set()
-    parts = pages_arg.split(',')
-    for part in parts:
-        part = part.strip()
-        if '-' in part:
-            s, e = map(int, part.split('-'))
-            for i in range(s-1, e): page_indices.add(i)
-        else:
-            page_indices.add(int(part) - 1)
-    for i in sorted(page_indices):
-        if 0 <= i < len(reader.pages):
-            writer.add_page(reader.pages[i])
+def extract_pages_task(task_id, input_path, output_filename, pages_arg, linearize=False):
     output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
-    with open(output_path, 'wb') as f:
-        writer.write(f)
+    with open_pdf(input_path) as src:
+        pages = parse_page_ranges(pages_arg, len(src.pages))
+        if not pages:
+            raise Exception("Aucune page valide à extraire")
+        task_store.update(task_id, progress=30)
+        with copy_pages(src, pages) as out:
+            save_pdf(out, output_path, linearize=linearize)
     if os.path.exists(input_path): os.remove(input_path)
     return output_filename
 
+def pages_param(form):
+    """Non-empty `pages` range list such as 1,3,5-7. ValueError carries the user message"""
+    pages_arg = form.get('pages', '')
+    try:
+        if not parse_page_ranges(pages_arg): raise ValueError(pages_arg)
+    except ValueError:
+        raise ValueError('Plage de pages invalide (ex: 1,3,5-7)')
+    return pages_arg
+
 @app.route('/api/extract-pages', methods=['POST'])
 def extract_pages():
     if 'file' not in request.files: return jsonify({'error': 'No file provided'}), 400
     file = request.files['file']
-    pages_arg = request.form.get('pages', '')
     if file.filename == '': return jsonify({'error': 'No file selected'}), 400
+    try:
+        pages_arg = pages_param(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     task_id = str(uuid.uuid4())
     input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_in.pdf")
-    file.save(input_path)
+    save_upload(file, input_path)
     output_filename = f"{task_id}_extracted.pdf"
 
-    downloads[task_id] = {'status': 'pending', 'progress': 0}
-    threading.Thread(target=tool_worker_wrapper, args=(task_id, extract_pages_task, input_path, output_filename, pages_arg)).start()
-    return jsonify({'success': True, 'task_id': task_id})
+    return queue_tool_task(task_id, extract_pages_task, input_path, output_filename, pages_arg,
+                           wants_linearized(), inputs=[input_path])
 
 # 4. Compress PDF
-def compress_pdf_task(task_id, input_path, output_filename):
-    import fitz
-    doc = fitz.open(input_path)
+COMPRESS_REPORT_OBJECTS = 50
+
+def compress_pdf_task(task_id, input_path, output_filename, level='medium', codec='jpeg', quality=None):
+    """Downsample/recompress images in the process pool, subset fonts, strip metadata"""
+    settings = COMPRESSION_LEVELS[level]
+    quality = quality or settings['quality']
     output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
-    doc.save(output_path, garbage=4, deflate=True)
-    doc.close()
+    rewritten = output_path + '.images.pdf'
+
+    def cancelled():
+        if not task_store.is_cancelled(task_id):
+            return False
+        for path in (input_path, output_path, rewritten):
+            if os.path.exists(path): os.remove(path)
+        return True
+
+    before = os.path.getsize(input_path)
+    # PyMuPDF and pikepdf hold the GIL: every step runs in the process pool
+    found = cpu_pool.run(analyse_pdf, input_path, settings['dpi'])
+    report = {'level': level, 'before': before, 'objects': []}
+    task_store.update(task_id, progress=15, images_total=len(found['images']), images_done=0)
+
+    if not (found['images'] or found['fonts'] or found['metadata']):
+        shutil.copyfile(input_path, output_path)
+        report.update(after=before, skipped='already_optimal')
+    else:
+        jobs = [(xref, min(1.0, settings['dpi'] / info['dpi'])) for xref, info in found['images'].items()]
+        chunks = chunk_pages(jobs, cpu_pool.workers, max_chunk=8)
+        results = cpu_pool.imap_unordered(recompress_images, [(input_path, chunk, quality, codec) for chunk in chunks])
+        recompressed, done = [], 0
+        try:
+            for chunk_results in results:
+                recompressed += chunk_results
+                done += 1
+                if task_store.is_cancelled(task_id):
+                    break
+                task_store.update(task_id, progress=15 + int(done / len(chunks) * 60),
+                                  images_done=len(recompressed))
+        finally:
+            results.close()
+        if cancelled():
+            return None
+
+        scales = dict(jobs)
+        for xref, data, width, height, _, old_size in recompressed:
+            info = found['images'][xref]
+            report['objects'].append({'object': xref, 'kind': 'image', 'filter': info['filter'],
+                                      'dpi': info['dpi'], 'dpi_after': round(info['dpi'] * scales[xref]),
+                                      'before': old_size, 'after': len(data)})
+        report['objects'].sort(key=lambda o: o['after'] - o['before'])
+        report['objects'] = report['objects'][:COMPRESS_REPORT_OBJECTS]
+        report['objects'] += [{'object': xref, 'kind': 'font', 'name': name} for xref, name in found['fonts'].items()]
+
+        cpu_pool.run(rewrite_pdf, input_path, rewritten if found['fonts'] else output_path, recompressed, codec)
+        if cancelled():
+            return None
+        task_store.update(task_id, progress=85)
+        if found['fonts']:
+            try:
+                cpu_pool.run(subset_pdf_fonts, rewritten, output_path)
+            finally:
+                os.remove(rewritten)
+            if cancelled():
+                return None
+
+        after = os.path.getsize(output_path)
+        if after >= before:
+            shutil.copyfile(input_path, output_path)
+            report.update(after=before, skipped='no_gain')
+        else:
+            report['after'] = after
+    report['saved_percent'] = round((1 - report['after'] / before) * 100, 1) if before else 0
+    task_store.update(task_id, compression=report)
     if os.path.exists(input_path): os.remove(input_path)
     return output_filename
 
+def compress_pdf_params(form):
+    """(level, codec, quality) of a compress request. ValueError carries the user message"""
+    level = form.get('level', 'medium').lower()
+    codec = form.get('codec', 'jpeg').lower().replace('jpeg2000', 'jpx')
+    quality = form.get('quality', type=int)
+    if level not in COMPRESSION_LEVELS:
+        raise ValueError(f'Niveau de compression non supporté: {level}')
+    if codec not in IMAGE_CODECS:
+        raise ValueError(f'Format d\'image non supporté: {codec}')
+    if quality is not None:
+        quality = min(max(quality, 10), 95)
+    return level, codec, quality
+
 @app.route('/api/compress-pdf', methods=['POST'])
 def compress_pdf():
     if 'file' not in request.files: return jsonify({'error': 'No file provided'}), 400
     file = request.files['file']
     if file.filename == '': return jsonify({'error': 'No file selected'}), 400
+    try:
+        level, codec, quality = compress_pdf_params(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
     task_id = str(uuid.uuid4())
     input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_in.pdf")
-    file.save(input_path)
+    save_upload(file, input_path)
     output_filename = f"{task_id}_compressed.pdf"
     
-    downloads[task_id] = {'status': 'pending', 'progress': 0}
-    threading.Thread(target=tool_worker_wrapper, args=(task_id, compress_pdf_task, input_path, output_filename)).start()
-    return jsonify({'success': True, 'task_id': task_id})
+    return queue_tool_task(task_id, compress_pdf_task, input_path, output_filename, level, codec, quality,
+                           inputs=[input_path],
+                           cache=('compress_pdf', output_filename, {'level': level, 'codec': codec, 'quality': quality}))
 
 # 5. Lock PDF
-def lock_pdf_task(task_id, input_path, output_filename, password):
-    from PyPDF2 import PdfReader, PdfWriter
-    reader = PdfReader(input_path)
-    writer = PdfWriter()
-    for page in reader.pages: writer.add_page(page)
-    writer.encrypt(password)
+def lock_pdf_task(task_id, input_path, output_filename, password, linearize=False):
     output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
-    with open(output_path, 'wb') as f: writer.write(f)
+    with open_pdf(input_path) as pdf:
+        save_pdf(pdf, output_path, linearize=linearize, password=password)
     if os.path.exists(input_path): os.remove(input_path)
     return output_filename
 
@@ -901,19 +1694,19 @@ def lock_pdf():
     
     task_id = str(uuid.uuid4())
     input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_in.pdf")
-    file.save(input_path)
+    save_upload(file, input_path)
     output_filename = f"{task_id}_locked.pdf"
     
-    downloads[task_id] = {'status': 'pending', 'progress': 0}
-    threading.Thread(target=tool_worker_wrapper, args=(task_id, lock_pdf_task, input_path, output_filename, password)).start()
-    return jsonify({'success': True, 'task_id': task_id})
+    return queue_tool_task(task_id, lock_pdf_task, input_path, output_filename, password, wants_linearized(),
+                           inputs=[input_path])
 
 # 6. PDF to Word
+@cpu_bound
 def pdf_to_word_task(task_id, input_path, output_filename):
     from pdf2docx import Converter
     output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
     cv = Converter(input_path)
-    downloads[task_id]['progress'] = 20
+    task_store.update(task_id, progress=20)
     cv.convert(output_path)
     cv.close()
     if os.path.exists(input_path): os.remove(input_path)
@@ -927,110 +1720,94 @@ def pdf_to_word():
     
     task_id = str(uuid.uuid4())
     input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_in.pdf")
-    file.save(input_path)
+    save_upload(file, input_path)
     original_name = os.path.splitext(secure_filename(file.filename))[0]
     output_filename = f"{task_id}_{original_name}.docx"
 
-    downloads[task_id] = {'status': 'pending', 'progress': 0}
-    threading.Thread(target=tool_worker_wrapper, args=(task_id, pdf_to_word_task, input_path, output_filename)).start()
-    
-    return jsonify({'success': True, 'task_id': task_id})
+    return queue_tool_task(task_id, pdf_to_word_task, input_path, output_filename, inputs=[input_path],
+                           cache=('pdf_to_word', output_filename, {}))
 
 # 7. Add Watermark
-def add_watermark_task(task_id, input_path, output_filename, text):
-    from PyPDF2 import PdfReader, PdfWriter
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import letter
-    import io
-
-    packet = io.BytesIO()
-    can = canvas.Canvas(packet, pagesize=letter)
-    can.setFont("Helvetica", 40)
-    can.setFillColorRGB(0.5, 0.5, 0.5, 0.5)
-    can.saveState()
-    can.translate(300, 400)
-    can.rotate(45)
-    can.drawCentredString(0, 0, text)
-    can.restoreState()
-    can.save()
-    packet.seek(0)
-    
-    watermark_pdf = PdfReader(packet)
-    watermark_page = watermark_pdf.pages[0]
-    reader = PdfReader(input_path)
-    writer = PdfWriter()
-
-    for i, page in enumerate(reader.pages):
-        page.merge_page(watermark_page)
-        writer.add_page(page)
-        downloads[task_id]['progress'] = (i / len(reader.pages)) * 90
+@cpu_bound
+def add_watermark_task(task_id, input_path, output_filename, style, linearize=False):
+    import contextlib
 
     output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
-    with open(output_path, 'wb') as f:
-        writer.write(f)
+    with contextlib.ExitStack() as overlays, open_pdf(input_path) as pdf:
+        overlay_count = watermark_pdf(pdf, style, overlays,
+                                      on_progress=lambda f: task_store.update(task_id, progress=10 + int(f * 70)))
+        task_store.update(task_id, progress=80, overlays=overlay_count)
+        save_pdf(pdf, output_path, linearize=linearize)
     if os.path.exists(input_path): os.remove(input_path)
     return output_filename
 
+def watermark_params(form):
+    try:
+        return watermark_style(form.get('text', 'Watermark'),
+                               size=form.get('size', 40),
+                               opacity=float(form.get('opacity', 50)) / 100,
+                               angle=form.get('angle', 45),
+                               color=form.get('color', '#808080'),
+                               font=form.get('font', 'Helvetica'),
+                               count=form.get('count', 1))
+    except ValueError:
+        raise ValueError('Paramètres de filigrane invalides')
+
 @app.route('/api/add-watermark', methods=['POST'])
 def add_watermark():
     if 'file' not in request.files: return jsonify({'error': 'No file provided'}), 400
     file = request.files['file']
-    text = request.form.get('text', 'Watermark')
     if file.filename == '': return jsonify({'error': 'No file selected'}), 400
+    try:
+        style = watermark_params(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     task_id = str(uuid.uuid4())
     input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_wm_in.pdf")
-    file.save(input_path)
+    save_upload(file, input_path)
     output_filename = f"{task_id}_watermarked.pdf"
+    linearize = wants_linearized()
 
-    downloads[task_id] = {'status': 'pending', 'progress': 0}
-    threading.Thread(target=tool_worker_wrapper, args=(task_id, add_watermark_task, input_path, output_filename, text)).start()
-    
-    return jsonify({'success': True, 'task_id': task_id})
+    return queue_tool_task(task_id, add_watermark_task, input_path, output_filename, style, linearize,
+                           inputs=[input_path],
+                           cache=('add_watermark', output_filename, dict(style._asdict(), linearize=linearize)))
 
 # 8. Add Signature
-def add_signature_task(task_id, input_path, sig_path, output_filename, x, y, width, height, page_num):
-    from PyPDF2 import PdfReader, PdfWriter
+@cpu_bound
+def add_signature_task(task_id, input_path, sig_path, output_filename, x, y, width, height, page_num, linearize=False):
     from reportlab.pdfgen import canvas
     import io
-    from PIL import Image
-    
-    reader = PdfReader(input_path)
-    writer = PdfWriter()
-    
-    if not (0 <= page_num < len(reader.pages)):
-        raise Exception('Invalid page index')
-        
-    page_width = float(reader.pages[page_num].mediabox.width)
-    page_height = float(reader.pages[page_num].mediabox.height)
-    
-    def norm(v, size):
-        return float(v) * size if float(v) <= 1.0 else float(v)
     
-    x = norm(x, page_width)
-    y = norm(y, page_height)
-    w = norm(width, page_width)
-    h = norm(height, page_height)
-    y_pdf = page_height - y - h
-    
-    packet = io.BytesIO()
-    can = canvas.Canvas(packet, pagesize=(page_width, page_height))
-    can.drawImage(sig_path, x, y_pdf, width=w, height=h, mask='auto')
-    can.save()
-    packet.seek(0)
-    
-    sig_pdf = PdfReader(packet)
-    sig_page = sig_pdf.pages[0]
-    
-    for i, page in enumerate(reader.pages):
-        if i == page_num:
-            page.merge_page(sig_page)
-        writer.add_page(page)
-        downloads[task_id]['progress'] = (i / len(reader.pages)) * 90
-
     output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
-    with open(output_path, 'wb') as f:
-        writer.write(f)
+    with open_pdf(input_path) as pdf:
+        if not (0 <= page_num < len(pdf.pages)):
+            raise Exception('Invalid page index')
+        
+        # Only the signed page is loaded and rewritten
+        page = pdf.pages[page_num]
+        box = page_box(page)
+        page_width = box[2] - box[0]
+        page_height = box[3] - box[1]
+        
+        def norm(v, size):
+            return float(v) * size if float(v) <= 1.0 else float(v)
+        
+        x = norm(x, page_width)
+        y = norm(y, page_height)
+        w = norm(width, page_width)
+        h = norm(height, page_height)
+        y_pdf = page_height - y - h
+        
+        packet = io.BytesIO()
+        can = canvas.Canvas(packet, pagesize=(page_width, page_height))
+        can.drawImage(sig_path, x, y_pdf, width=w, height=h, mask='auto')
+        can.save()
+        task_store.update(task_id, progress=50)
+        
+        with open_pdf(packet.getvalue()) as overlay:
+            stamp(page, import_form(pdf, overlay), box)
+            save_pdf(pdf, output_path, linearize=linearize)
         
     if os.path.exists(input_path): os.remove(input_path)
     if os.path.exists(sig_path): os.remove(sig_path)
@@ -1052,14 +1829,12 @@ def add_signature():
     task_id = str(uuid.uuid4())
     input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_in.pdf")
     sig_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_sig.png")
-    file.save(input_path)
-    signature.save(sig_path)
+    save_upload(file, input_path)
+    save_upload(signature, sig_path)
     output_filename = f"{task_id}_signed.pdf"
 
-    downloads[task_id] = {'status': 'pending', 'progress': 0}
-    threading.Thread(target=tool_worker_wrapper, args=(task_id, add_signature_task, input_path, sig_path, output_filename, x, y, width, height, page_num)).start()
-    
-    return jsonify({'success': True, 'task_id': task_id})
+    return queue_tool_task(task_id, add_signature_task, input_path, sig_path, output_filename, x, y, width, height, page_num,
+                           wants_linearized(), inputs=[input_path, sig_path])
 
 # 9. Edit PDF (Add Text Annotation)
 def edit_pdf_task(task_id, input_path, output_filename, text, x, y, page_num, fontsize, color):
@@ -1093,12 +1868,10 @@ def edit_pdf():
     
     task_id = str(uuid.uuid4())
     input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_in.pdf")
-    file.save(input_path)
+    save_upload(file, input_path)
     output_filename = f"{task_id}_edited.pdf"
     
-    downloads[task_id] = {'status': 'pending', 'progress': 0}
-    threading.Thread(target=tool_worker_wrapper, args=(task_id, edit_pdf_task, input_path, output_filename, text, x, y, page_num, fontsize, color)).start()
-    return jsonify({'success': True, 'task_id': task_id})
+    return queue_tool_task(task_id, edit_pdf_task, input_path, output_filename, text, x, y, page_num, fontsize, color, inputs=[input_path])
 
 import json
 from datetime import datetime
@@ -1230,28 +2003,34 @@ def get_history():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-def img_to_pdf_task(task_id, input_path, output_filename):
+def img_to_pdf_task(task_id, input_paths, output_filename):
+    """One PDF page per image, in order, in a single img2pdf pass (no re-encoding of JPEGs)"""
     import img2pdf
     output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
     with open(output_path, "wb") as f:
-        f.write(img2pdf.convert(input_path))
-    if os.path.exists(input_path): os.remove(input_path)
+        img2pdf.convert(input_paths, outputstream=f)
+    for path in input_paths:
+        if os.path.exists(path): os.remove(path)
     return output_filename
 
 @app.route('/api/img-to-pdf', methods=['POST'])
 def img_to_pdf():
-    if 'file' not in request.files: return jsonify({'error': 'No file provided'}), 400
-    file = request.files['file']
-    if file.filename == '': return jsonify({'error': 'No file selected'}), 400
+    # 'files[]' (in page order) or a single 'file'
+    files = [f for f in request.files.getlist('files[]') or request.files.getlist('file') if f.filename]
+    if not files: return jsonify({'error': 'No file provided'}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({'error': f'{BATCH_MAX_FILES} images maximum'}), 400
     
     task_id = str(uuid.uuid4())
-    input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_{secure_filename(file.filename)}")
-    file.save(input_path)
+    input_paths = []
+    for index, file in enumerate(files):
+        input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_{index}_{secure_filename(file.filename)}")
+        save_upload(file, input_path)
+        input_paths.append(input_path)
     output_filename = f"{task_id}_converted.pdf"
 
-    downloads[task_id] = {'status': 'pending', 'progress': 0}
-    threading.Thread(target=tool_worker_wrapper, args=(task_id, img_to_pdf_task, input_path, output_filename)).start()
-    return jsonify({'success': True, 'task_id': task_id})
+    return queue_tool_task(task_id, img_to_pdf_task, input_paths, output_filename, inputs=input_paths,
+                           cache=('img_to_pdf', output_filename, {}))
 
 def word_to_pdf_task(task_id, input_path, output_filename):
     output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
@@ -1262,11 +2041,7 @@ def word_to_pdf_task(task_id, input_path, output_filename):
         from docx2pdf import convert
         convert(input_path_abs, output_path_abs)
     else:
-        import subprocess
-        cmd = ['libreoffice', '--headless', '--convert-to', 'pdf', '--outdir', DOWNLOAD_FOLDER, input_path]
-        subprocess.run(cmd, check=True)
-        lo_output = os.path.splitext(input_path)[0] + ".pdf"
-        if os.path.exists(lo_output): os.rename(lo_output, output_path)
+        get_office_pool().convert(input_path_abs, output_path_abs)
         
     if os.path.exists(input_path): os.remove(input_path)
     return output_filename
@@ -1279,12 +2054,11 @@ def word_to_pdf():
     
     task_id = str(uuid.uuid4())
     input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_{secure_filename(file.filename)}")
-    file.save(input_path)
+    save_upload(file, input_path)
     output_filename = f"{task_id}_converted.pdf"
 
-    downloads[task_id] = {'status': 'pending', 'progress': 0}
-    threading.Thread(target=tool_worker_wrapper, args=(task_id, word_to_pdf_task, input_path, output_filename)).start()
-    return jsonify({'success': True, 'task_id': task_id})
+    return queue_tool_task(task_id, word_to_pdf_task, input_path, output_filename, inputs=[input_path],
+                           cache=('word_to_pdf', output_filename, {}))
 
 def ppt_to_pdf_task(task_id, input_path, output_filename):
     output_path = os.path.abspath(os.path.join(DOWNLOAD_FOLDER, output_filename))
@@ -1296,15 +2070,15 @@ def ppt_to_pdf_task(task_id, input_path, output_filename):
         deck.Close()
         powerpoint.Quit()
     else:
-        import subprocess
-        cmd = ['libreoffice', '--headless', '--convert-to', 'pdf', '--outdir', DOWNLOAD_FOLDER, input_path]
-        subprocess.run(cmd, check=True)
-        lo_output = os.path.splitext(input_path)[0] + ".pdf"
-        if os.path.exists(lo_output): os.rename(lo_output, output_path)
+        get_office_pool().convert(os.path.abspath(input_path), output_path)
         
     if os.path.exists(input_path): os.remove(input_path)
     return output_filename
 
+@app.route('/api/office/stats', methods=['GET'])
+def get_office_stats():
+    return jsonify(get_office_pool().stats())
+
 @app.route('/api/ppt-to-pdf', methods=['POST'])
 def ppt_to_pdf():
     if 'file' not in request.files: return jsonify({'error': 'No file provided'}), 400
@@ -1312,18 +2086,15 @@ def ppt_to_pdf():
     
     task_id = str(uuid.uuid4())
     input_path = os.path.abspath(os.path.join(DOWNLOAD_FOLDER, f"{task_id}_{secure_filename(file.filename)}"))
-    file.save(input_path)
+    save_upload(file, input_path)
     output_filename = f"{task_id}_converted.pdf"
 
-    downloads[task_id] = {'status': 'pending', 'progress': 0}
-    threading.Thread(target=tool_worker_wrapper, args=(task_id, ppt_to_pdf_task, input_path, output_filename)).start()
-    return jsonify({'success': True, 'task_id': task_id})
+    return queue_tool_task(task_id, ppt_to_pdf_task, input_path, output_filename, inputs=[input_path])
 
-def unlock_pdf_task(task_id, input_path, output_filename, password):
-    import pikepdf
+def unlock_pdf_task(task_id, input_path, output_filename, password, linearize=False):
     output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
-    with pikepdf.open(input_path, password=password) as pdf:
-        pdf.save(output_path)
+    with open_pdf(input_path, password=password) as pdf:
+        save_pdf(pdf, output_path, linearize=linearize)
     if os.path.exists(input_path): os.remove(input_path)
     return output_filename
 
@@ -1335,12 +2106,230 @@ def unlock_pdf():
     
     task_id = str(uuid.uuid4())
     input_path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_in.pdf")
-    file.save(input_path)
+    save_upload(file, input_path)
     output_filename = f"{task_id}_unlocked.pdf"
 
-    downloads[task_id] = {'status': 'pending', 'progress': 0}
-    threading.Thread(target=tool_worker_wrapper, args=(task_id, unlock_pdf_task, input_path, output_filename, password)).start()
-    return jsonify({'success': True, 'task_id': task_id})
+    return queue_tool_task(task_id, unlock_pdf_task, input_path, output_filename, password, wants_linearized(),
+                           inputs=[input_path])
+
+# --- BATCH MODE ---
+# tool -> (pool, parse(form) -> params, build(child_id, input_path, params) -> (output, (func, *args), cache))
+def password_param(form):
+    password = form.get('password')
+    if not password: raise ValueError('No password provided')
+    return password
+
+def batch_compress_pdf(child_id, input_path, params):
+    level, codec, quality = params
+    output = f"{child_id}_compressed.pdf"
+    return output, (compress_pdf_task, input_path, output, level, codec, quality), \
+        ('compress_pdf', output, {'level': level, 'codec': codec, 'quality': quality})
+
+def batch_lock_pdf(child_id, input_path, params):
+    output = f"{child_id}_locked.pdf"
+    return output, (lock_pdf_task, input_path, output, *params), None
+
+def batch_unlock_pdf(child_id, input_path, params):
+    output = f"{child_id}_unlocked.pdf"
+    return output, (unlock_pdf_task, input_path, output, *params), None
+
+def batch_pdf_to_word(child_id, input_path, params):
+    output = f"{child_id}_converted.docx"
+    return output, (pdf_to_word_task, input_path, output), ('pdf_to_word', output, {})
+
+def batch_add_watermark(child_id, input_path, params):
+    style, linearize = params
+    output = f"{child_id}_watermarked.pdf"
+    return output, (add_watermark_task, input_path, output, style, linearize), \
+        ('add_watermark', output, dict(style._asdict(), linearize=linearize))
+
+def batch_word_to_pdf(child_id, input_path, params):
+    output = f"{child_id}_converted.pdf"
+    return output, (word_to_pdf_task, input_path, output), ('word_to_pdf', output, {})
+
+def batch_ppt_to_pdf(child_id, input_path, params):
+    output = f"{child_id}_converted.pdf"
+    return output, (ppt_to_pdf_task, input_path, output), None
+
+def batch_convert_image(child_id, input_path, params):
+    output = f"{child_id}_converted.{params.format}"
+    return output, (convert_image_task, input_path, output, params), ('convert_image', output, params._asdict())
+
+def batch_pdf_to_images(child_id, input_path, params):
+    dpi, fmt, pages_spec = params
+    output = f"{child_id}_images.zip"
+    return output, (pdf_to_images_task, input_path, output, dpi, fmt, pages_spec), \
+        ('pdf_to_images', output, {'dpi': dpi, 'format': fmt, 'pages': pages_spec})
+
+def batch_extract_pages(child_id, input_path, params):
+    pages_arg, linearize = params
+    output = f"{child_id}_extracted.pdf"
+    return output, (extract_pages_task, input_path, output, pages_arg, linearize), None
+
+def batch_convert_video(child_id, input_path, requested):
+    # Runs during the batch request: 'auto' is resolved per file, as the single route does
+    audio_format = resolve_audio_format(input_path, requested)
+    output = f"{child_id}_audio.{AUDIO_FORMATS[audio_format][0]}"
+    return output, (video_to_audio_task, input_path, output, audio_format), \
+        ('video_to_audio', output, {'format': audio_format})
+
+def batch_compress_video(child_id, input_path, params):
+    quality, target_mb = params
+    output = f"{child_id}_compressed.mp4"
+    return output, (compress_video_task, input_path, output, quality, target_mb), None
+
+def batch_remove_background(child_id, input_path, model):
+    output = f"{child_id}_nobg.png"
+    return output, (remove_bg_task, input_path, output, model), ('remove_background', output, {'model': model})
+
+def batch_remove_watermark(child_id, input_path, params):
+    boxes, method, radius = params
+    output = f"{child_id}_clean{os.path.splitext(input_path)[1] or '.png'}"
+    return output, (remove_watermark_task, input_path, output, boxes, method, radius), \
+        ('remove_watermark', output, {'boxes': boxes, 'method': method, 'radius': radius})
+
+def batch_remove_watermark_video(child_id, input_path, params):
+    boxes, method, radius = params
+    output = f"{child_id}_clean.mp4"
+    return output, (remove_video_watermark_task, input_path, output, boxes, method, radius), \
+        ('remove_watermark_video', output, {'boxes': boxes, 'method': method, 'radius': radius})
+
+BATCH_TOOLS = {
+    'compress-pdf': ('pdf', compress_pdf_params, batch_compress_pdf),
+    'lock-pdf': ('pdf', lambda form: (password_param(form), wants_linearized()), batch_lock_pdf),
+    'unlock-pdf': ('pdf', lambda form: (password_param(form), wants_linearized()), batch_unlock_pdf),
+    'pdf-to-word': ('pdf', lambda form: None, batch_pdf_to_word),
+    'add-watermark': ('pdf', lambda form: (watermark_params(form), wants_linearized()), batch_add_watermark),
+    'word-to-pdf': ('office', lambda form: None, batch_word_to_pdf),
+    'ppt-to-pdf': ('office', lambda form: None, batch_ppt_to_pdf),
+    'convert-image': ('image', image_convert_params, batch_convert_image),
+    'pdf-to-images': ('pdf', pdf_to_images_params, batch_pdf_to_images),
+    'extract-pages': ('pdf', lambda form: (pages_param(form), wants_linearized()), batch_extract_pages),
+    'convert-video': ('ffmpeg', audio_format_param, batch_convert_video),
+    'compress-video': ('encode', compress_video_params, batch_compress_video),
+    'remove-background': ('image', bg_model_param, batch_remove_background),
+    # One set of areas for every file (fractions of the frame fit any size); brush masks are per image, so not here
+    'remove-watermark': ('image', lambda form: inpaint_params(form, False), batch_remove_watermark),
+    'remove-watermark-video': ('encode', lambda form: inpaint_params(form, False), batch_remove_watermark_video),
+}
+
+def batch_arcnames(children):
+    """Zip member names: original file name with the extension of its result"""
+    used = set()
+    for child in children:
+        stem = os.path.splitext(os.path.basename(child['name']))[0] or 'file'
+        ext = os.path.splitext(child['output'])[1]
+        arcname, n = f"{stem}{ext}", 2
+        while arcname in used:
+            arcname, n = f"{stem} ({n}){ext}", n + 1
+        used.add(arcname)
+        yield arcname
+
+# Seconds between attempts to queue children on a full pool
+BATCH_RETRY_DELAY = 1
+
+def batch_task(task_id, pool, jobs, zip_filename):
+    """Feed the child tasks of a batch to their pool, aggregate their progress, zip the results"""
+    children = [job['task_id'] for job in jobs]
+    waiting = list(jobs)
+    versions = {}
+    while True:
+        cancelled = task_store.is_cancelled(task_id)
+        if cancelled:
+            for job in waiting:
+                task_store.update(job['task_id'], status='cancelled')
+                for path in job['inputs']:
+                    if os.path.exists(path): os.remove(path)
+            waiting = []
+            for child_id in children:
+                task_store.request_cancel(child_id)
+        # Submit as many children as the pool queue accepts, the rest on the next round
+        while waiting:
+            job = waiting[0]
+            if task_store.is_cancelled(job['task_id']):
+                # Cancelled on its own before it was queued
+                task_store.update(job['task_id'], status='cancelled')
+                for path in job['inputs']:
+                    if os.path.exists(path): os.remove(path)
+                waiting.pop(0)
+                continue
+            try:
+                start_tool_task(job['task_id'], pool, *job['call'], inputs=job['inputs'], cache=job['cache'],
+                                create=False, input_hashes=job['input_hashes'], parent=task_id)
+            except QueueFullError:
+                break
+            waiting.pop(0)
+
+        # A child whose record is gone (expired, deleted) will never finish: count it as failed
+        records = [task_store.get(child_id) or {'status': 'error', 'error': 'Tâche introuvable'}
+                   for child_id in children]
+        finished = [r for r in records if r.get('status') in TERMINAL_STATES]
+        done = sum(1 for r in finished if r['status'] == 'completed')
+        progress = sum(100 if r.get('status') in TERMINAL_STATES else r.get('progress', 0) for r in records)
+        task_store.update(task_id, progress=10 + int(progress / len(children) * 0.85),
+                          children_done=done, children_failed=len(finished) - done)
+        if len(finished) == len(children):
+            break
+        if waiting:
+            # The pool refused the next child: give its queue time to drain before resubmitting
+            time.sleep(BATCH_RETRY_DELAY)
+        active = [c for c, r in zip(children, records) if r.get('status') not in TERMINAL_STATES]
+        task_store.wait_for_changes(active, versions, timeout=2)
+
+    if cancelled or task_store.is_cancelled(task_id):
+        return None
+    summary, members = [], []
+    for job, record, arcname in zip(jobs, records, batch_arcnames(jobs)):
+        summary.append({'task_id': job['task_id'], 'name': job['name'], 'status': record.get('status'),
+                        'error': record.get('error')})
+        if record.get('status') == 'completed':
+            members.append((os.path.join(DOWNLOAD_FOLDER, record['result']['filename']), arcname))
+    task_store.update(task_id, children=summary)
+    if not members:
+        raise Exception("Aucun fichier du lot n'a pu être traité")
+    # The zip is streamed from the child results when downloaded
+    virtual_zips.create(zip_filename, members)
+    return zip_filename
+
+@app.route('/api/batch/<tool>', methods=['POST'])
+def batch_tool(tool):
+    if tool not in BATCH_TOOLS:
+        return jsonify({'error': f'Outil non disponible en lot: {tool}', 'tools': sorted(BATCH_TOOLS)}), 404
+    files = [f for f in request.files.getlist('files[]') if f.filename]
+    if not files: return jsonify({'error': 'No file provided'}), 400
+    if len(files) > BATCH_MAX_FILES:
+        return jsonify({'error': f'{BATCH_MAX_FILES} fichiers maximum par lot'}), 400
+    pool, parse, build = BATCH_TOOLS[tool]
+    try:
+        params = parse(request.form)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    task_id = str(uuid.uuid4())
+    jobs = []
+    for file in files:
+        child_id = str(uuid.uuid4())
+        ext = os.path.splitext(secure_filename(file.filename))[1].lower()
+        input_path = os.path.join(DOWNLOAD_FOLDER, f"{child_id}_in{ext}")
+        digest = save_upload(file, input_path)
+        output, call, cache = build(child_id, input_path, params)
+        # The driver runs on a pool thread, outside this request: hand it the upload hashes
+        jobs.append({'task_id': child_id, 'name': file.filename, 'output': output, 'call': call,
+                     'inputs': [input_path], 'input_hashes': {input_path: digest}, 'cache': cache})
+        # Visible (and cancellable) right away, even before the driver queues it
+        task_store.create(child_id, {'status': 'pending', 'progress': 0, 'cancel_event': False, 'pool': pool,
+                                     'parent': task_id})
+
+    response = queue_tool_task(task_id, batch_task, pool, jobs, f"{task_id}_batch.zip")
+    if response.status_code == 200:
+        task_store.update(task_id, batch=tool,
+                          children=[{'task_id': job['task_id'], 'name': job['name']} for job in jobs])
+    else:
+        for job in jobs:
+            task_store.delete(job['task_id'])
+            for path in job['inputs']:
+                if os.path.exists(path): os.remove(path)
+    return response
 
 @app.route('/api/whatsapp-status-zip', methods=['POST'])
 def whatsapp_status_zip():
@@ -1353,12 +2342,10 @@ def whatsapp_status_zip():
         fname = f.filename or f"status_{idx}"
         safe_name = re.sub(r'[^A-Za-z0-9._-]', '_', fname)
         path = os.path.join(DOWNLOAD_FOLDER, f"{task_id}_{idx}_{safe_name}")
-        f.save(path)
+        save_upload(f, path)
         input_paths.append(path)
     output_filename = f"{task_id}_wa_status.zip"
-    downloads[task_id] = {'status': 'pending', 'progress': 0, 'cancel_event': False}
-    threading.Thread(target=tool_worker_wrapper, args=(task_id, zip_files_task, input_paths, output_filename)).start()
-    return jsonify({'success': True, 'task_id': task_id})
+    return queue_tool_task(task_id, zip_files_task, input_paths, output_filename, inputs=input_paths)
 
 @app.route('/api/draw-pdf', methods=['POST'])
 def draw_pdf():
@@ -1373,23 +2360,24 @@ def handle_500_error(e):
 def handle_404_error(e):
     return jsonify({'error': 'Not Found'}), 404
 
+@app.errorhandler(413)
+def handle_413_error(e):
+    limit_mb = (request.upload_limit() or 0) // MB
+    return jsonify({'error': f'Fichier trop volumineux (maximum {limit_mb} Mo)'}), 413
+
 def zip_files_task(task_id, input_paths, output_filename):
-    output_path = os.path.join(DOWNLOAD_FOLDER, output_filename)
-    downloads[task_id]['progress'] = 10
-    with zipfile.ZipFile(output_path, 'w') as zf:
-        total = len(input_paths)
-        for i, p in enumerate(input_paths):
-            if downloads[task_id].get('cancel_event'):
-                raise Exception('Cancelled')
-            zf.write(p, os.path.basename(p))
-            downloads[task_id]['progress'] = 10 + int(((i + 1) / max(1, total)) * 80)
-    for p in input_paths:
-        try:
-            if os.path.exists(p):
-                os.remove(p)
-        except:
-            pass
-    downloads[task_id]['progress'] = 95
+    task_store.update(task_id, progress=10)
+    if not publish_zip(output_filename, [(p, os.path.basename(p)) for p in input_paths], task_id):
+        raise Exception('Cancelled')
+    if ZIP_MODE != 'stream':
+        # A streamed bundle is read from its members at download time
+        for p in input_paths:
+            try:
+                if os.path.exists(p):
+                    os.remove(p)
+            except:
+                pass
+    task_store.update(task_id, progress=95)
     return output_filename
 
 def check_dependencies():
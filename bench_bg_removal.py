@@ -0,0 +1,77 @@
+"""Throughput of the background-removal service, in images per second per core.
+
+    python bench_bg_removal.py [images...] [--model u2net] [--requests 64]
+                               [--concurrency 1,4,8] [--threads N] [--max-batch 8]
+
+Starts a private bg_model_server.py on a temporary socket, then sends
+`--requests` images from 1, 4, 8... client threads, once with micro-batching
+disabled (--max-batch 1) and once enabled. Without input images, random
+1024x768 noise images are used (inference cost does not depend on
+content).
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from bg_removal import BackgroundRemover
+
+
+def load_images(paths):
+    if paths:
+        return [Image.open(p).convert('RGB') for p in paths]
+    return [Image.effect_noise((1024, 768), 64).convert('RGB') for _ in range(4)]
+
+
+def run(remover, images, model, requests, concurrency):
+    jobs = [images[i % len(images)] for i in range(requests)]
+    started = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(lambda image: remover.mask(image, model), jobs))
+    return time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('images', nargs='*')
+    parser.add_argument('--model', default='u2net')
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--concurrency', default='1,4,8')
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-batch', type=int, default=8)
+    args = parser.parse_args()
+
+    images = load_images(args.images)
+    levels = [int(c) for c in args.concurrency.split(',')]
+    workdir = tempfile.mkdtemp(prefix='bench_bg_')
+    results = []
+    try:
+        for max_batch in (1, args.max_batch):
+            remover = BackgroundRemover(os.path.join(workdir, f'bg_{max_batch}.sock'), threads=args.threads,
+                                        max_batch=max_batch, idle_exit=0)
+            # Warm-up: starts the server and loads the model
+            remover.mask(images[0], args.model)
+            for concurrency in levels:
+                before = remover.stats()[args.model]
+                wall = run(remover, images, args.model, args.requests, concurrency)
+                after = remover.stats()[args.model]
+                avg_batch = (after['images'] - before['images']) / max(1, after['batches'] - before['batches'])
+                results.append((max_batch, concurrency, wall, avg_batch))
+            remover.shutdown()
+
+        print(f"\nModel {args.model}, {args.threads} ORT threads, {args.requests} requests")
+        print(f"{'max batch':>9} {'clients':>8} {'wall s':>8} {'img/s':>8} {'img/s/core':>11} {'avg batch':>10}")
+        for max_batch, concurrency, wall, avg_batch in results:
+            rate = args.requests / wall
+            print(f"{max_batch:>9} {concurrency:>8} {wall:>8.2f} {rate:>8.2f} {rate / args.threads:>11.3f} "
+                  f"{avg_batch:>10.2f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
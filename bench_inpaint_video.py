@@ -0,0 +1,77 @@
+"""Speed of video watermark removal (inpaint.py) against real time.
+
+    python bench_inpaint_video.py [input.mp4] [--box 0.75,0.85,0.2,0.1] [--workers 1,2,4]
+                                  [--preset veryfast] [--static]
+
+Without an input a synthetic 1920x1080 30 fps clip with a burnt-in box as
+"watermark" is generated first (--duration seconds; --static uses a still
+background, where most crops are reused). Prints wall time, speed (x
+realtime, 1.0 = real time) and how many crops were inpainted or reused for
+each worker count.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from inpaint import box_regions, display_size, inpaint_video
+from media_probe import probe, first_stream, run_ffmpeg
+
+
+def make_sample(path, duration, static):
+    source = 'color=c=steelblue' if static else 'testsrc2'
+    run_ffmpeg(['-f', 'lavfi', '-i', f'{source}=size=1920x1080:rate=30:duration={duration}',
+                '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+                '-vf', 'drawbox=x=1440:y=918:w=384:h=108:color=white@0.6:t=fill',
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-c:a', 'aac', '-shortest', path])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', nargs='?')
+    parser.add_argument('--box', default='0.75,0.85,0.2,0.1', help='x,y,width,height (pixels or fractions)')
+    parser.add_argument('--workers', default='1,2,4')
+    parser.add_argument('--preset', default='veryfast')
+    parser.add_argument('--radius', type=int, default=3)
+    parser.add_argument('--duration', type=int, default=20, help='length of the generated clip')
+    parser.add_argument('--static', action='store_true', help='generate a still background')
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    box = tuple(float(v) for v in args.box.split(','))
+    workdir = tempfile.mkdtemp(prefix='bench_inpaint_')
+    try:
+        source = args.input
+        if not source:
+            source = os.path.join(workdir, 'sample.mp4')
+            print(f"Generating a {args.duration}s 1080p sample clip...")
+            make_sample(source, args.duration, args.static)
+
+        info = probe(source)
+        video = first_stream(info, 'video')
+        fps = video['fps'] or 25
+        size = display_size(video)
+        regions = box_regions([box], *size, args.radius)
+        encode_args = ['-vf', 'crop=trunc(iw/2)*2:trunc(ih/2)*2', '-c:v', 'libx264', '-preset', args.preset,
+                       '-crf', '20', '-pix_fmt', 'yuv420p', '-threads', str(cores), '-c:a', 'aac', '-shortest']
+        results = []
+        for workers in (int(w) for w in args.workers.split(',')):
+            output = os.path.join(workdir, f'out_{workers}.mp4')
+            started = time.monotonic()
+            counters = inpaint_video(source, output, size, fps, regions, encode_args, workers=workers,
+                                     radius=args.radius, total_frames=int(info['duration'] * fps))
+            results.append((workers, time.monotonic() - started, counters))
+
+        print(f"\nInput: {size[0]}x{size[1]} {fps} fps, {info['duration']:.1f}s, {cores} cores, "
+              f"preset {args.preset}, crop {regions[0][0]}")
+        print(f"{'workers':>7} {'wall s':>8} {'speed':>7} {'frames':>7} {'inpainted':>9} {'reused':>7}")
+        for workers, wall, c in results:
+            print(f"{workers:>7} {wall:>8.1f} {info['duration'] / wall:>6.2f}x {c['frames']:>7} "
+                  f"{c['inpainted']:>9} {c['reused']:>7}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
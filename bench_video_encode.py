@@ -0,0 +1,72 @@
+"""Compare single-process and segmented x264 encodes of the same input.
+
+    python bench_video_encode.py [input.mp4] [--preset veryfast] [--crf 26] [--segments N]
+
+Without an input a synthetic 1280x720 clip is generated first (--duration
+seconds). Prints wall time, speed (x realtime) and output size of each path.
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+from media_probe import probe, first_stream, run_ffmpeg
+from video_encoder import keyframe_times, plan_segments, encode_segmented
+
+
+def make_sample(path, duration):
+    run_ffmpeg(['-f', 'lavfi', '-i', f'testsrc2=size=1280x720:rate=30:duration={duration}',
+                '-f', 'lavfi', '-i', f'sine=frequency=440:duration={duration}',
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-g', '60', '-c:a', 'aac', '-shortest', path])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', nargs='?')
+    parser.add_argument('--preset', default='veryfast')
+    parser.add_argument('--crf', type=int, default=26)
+    parser.add_argument('--segments', type=int, default=max(2, (os.cpu_count() or 2) // 2))
+    parser.add_argument('--duration', type=int, default=300, help='length of the generated clip')
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    workdir = tempfile.mkdtemp(prefix='bench_encode_')
+    try:
+        source = args.input
+        if not source:
+            source = os.path.join(workdir, 'sample.mp4')
+            print(f"Generating a {args.duration}s sample clip...")
+            make_sample(source, args.duration)
+
+        info = probe(source)
+        duration = info['duration']
+        video_args = ['-c:v', 'libx264', '-preset', args.preset, '-crf', str(args.crf)]
+        audio_args = ['-c:a', 'aac', '-b:a', '96k'] if first_stream(info, 'audio') else None
+        results = []
+
+        single = os.path.join(workdir, 'single.mp4')
+        started = time.monotonic()
+        run_ffmpeg(['-i', source] + video_args + ['-threads', str(cores)] + (audio_args or ['-an']) + [single])
+        results.append(('single', 1, time.monotonic() - started, os.path.getsize(single)))
+
+        segments = plan_segments(keyframe_times(source), duration, args.segments)
+        seg_dir = os.path.join(workdir, 'segments')
+        os.makedirs(seg_dir)
+        segmented = os.path.join(workdir, 'segmented.mp4')
+        started = time.monotonic()
+        encode_segmented(source, segmented, segments,
+                         video_args + ['-threads', str(max(1, cores // len(segments)))], audio_args, seg_dir)
+        results.append(('segmented', len(segments), time.monotonic() - started, os.path.getsize(segmented)))
+
+        print(f"\nInput: {duration:.1f}s, {cores} cores, preset {args.preset}, crf {args.crf}")
+        print(f"{'path':<10} {'segments':>8} {'wall s':>8} {'speed':>7} {'size MB':>8}")
+        for name, count, wall, size in results:
+            print(f"{name:<10} {count:>8} {wall:>8.1f} {duration / wall:>6.1f}x {size / 1e6:>8.1f}")
+        print(f"\nSpeed-up: {results[0][2] / results[1][2]:.2f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
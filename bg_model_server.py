@@ -0,0 +1,234 @@
+"""Shared background-removal inference process.
+
+    python bg_model_server.py --socket state/bgremove.sock [--threads N] [--max-batch 8]
+
+One process per host holds the ONNX Runtime sessions (u2net, u2netp,
+silueta...), loaded on first use, instead of one u2net copy per gunicorn
+worker. Clients send images already resized to the model input (see
+bg_removal.py); requests that arrive within `--window-ms` of each other are
+stacked into a single `session.run` call. The process exits after
+`--idle-exit` seconds without requests.
+
+Wire format, both directions: 4-byte big-endian header length, JSON header,
+then `header['length']` bytes of payload.
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import queue
+import socketserver
+import struct
+import threading
+import time
+
+import numpy as np
+
+MODEL_SIZE = 320
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+MODELS = ('u2net', 'u2netp', 'silueta', 'u2net_human_seg')
+
+
+def read_message(sock_file):
+    raw = sock_file.read(4)
+    if len(raw) < 4:
+        return None, None
+    header = json.loads(sock_file.read(struct.unpack('>I', raw)[0]))
+    payload = sock_file.read(header.get('length', 0)) if header.get('length') else b''
+    return header, payload
+
+
+def write_message(sock_file, header, payload=b''):
+    header = dict(header, length=len(payload))
+    data = json.dumps(header).encode('utf-8')
+    sock_file.write(struct.pack('>I', len(data)) + data + payload)
+    sock_file.flush()
+
+
+def model_path(name):
+    """Local .onnx file of a rembg model, downloaded on first use."""
+    from rembg.sessions import sessions_class
+    for cls in sessions_class:
+        if cls.name() == name:
+            return cls.download_models()
+    raise ValueError(f'Unknown model: {name}')
+
+
+class Model:
+    """One ONNX Runtime session and the micro-batcher in front of it."""
+
+    def __init__(self, name, threads, max_batch, window):
+        import onnxruntime as ort
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = threads
+        # Requests are batched, not run side by side: one inter-op thread is enough
+        opts.inter_op_num_threads = 1
+        opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        started = time.monotonic()
+        self.session = ort.InferenceSession(model_path(name), sess_options=opts,
+                                            providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+        batch_dim = self.session.get_inputs()[0].shape[0]
+        # Some exports have a fixed batch of 1: those run request by request
+        self.max_batch = max_batch if not isinstance(batch_dim, int) else 1
+        self.window = window
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.images = 0
+        print(f"Model {name} loaded in {time.monotonic() - started:.1f}s "
+              f"(batch up to {self.max_batch}, {threads} threads)", flush=True)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def infer(self, image):
+        """Mask (uint8, MODEL_SIZE x MODEL_SIZE) of an RGB uint8 image of the same size."""
+        done = threading.Event()
+        slot = {'image': image, 'done': done}
+        self.requests.put(slot)
+        done.wait()
+        if 'error' in slot:
+            raise slot['error']
+        return slot['mask']
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def predict(self, images):
+        """Masks (N x MODEL_SIZE x MODEL_SIZE uint8) of a list of RGB uint8 images, in one session run."""
+        x = np.stack(images).astype(np.float32)
+        # Same normalisation as rembg: scale by the brightest pixel, then ImageNet mean/std
+        x /= np.maximum(x.reshape(len(images), -1).max(axis=1), 1e-6)[:, None, None, None]
+        x -= MEAN
+        x /= STD
+        pred = self.session.run(None, {self.input_name: np.ascontiguousarray(x.transpose(0, 3, 1, 2))})[0][:, 0]
+        lo = pred.reshape(len(images), -1).min(axis=1)[:, None, None]
+        hi = pred.reshape(len(images), -1).max(axis=1)[:, None, None]
+        return ((pred - lo) / np.maximum(hi - lo, 1e-6) * 255).astype(np.uint8)
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                masks = self.predict([slot['image'] for slot in batch])
+                for slot, mask in zip(batch, masks):
+                    slot['mask'] = mask
+                self.batches += 1
+                self.images += len(batch)
+            except Exception as e:
+                for slot in batch:
+                    slot['error'] = e
+            for slot in batch:
+                slot['done'].set()
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, threads, max_batch, window):
+        self.threads = threads
+        self.max_batch = max_batch
+        self.window = window
+        self.models = {}  # name -> Future of its Model
+        self.models_lock = threading.Lock()
+        self.last_request = time.monotonic()
+        super().__init__(path, Handler)
+
+    def model(self, name):
+        if name not in MODELS:
+            raise ValueError(f'Unknown model: {name}')
+        with self.models_lock:
+            future = self.models.get(name)
+            loading = future is None
+            if loading:
+                future = self.models[name] = concurrent.futures.Future()
+        if loading:
+            # Loaded outside the lock: requests for models already loaded are not held up
+            try:
+                future.set_result(Model(name, self.threads, self.max_batch, self.window))
+            except Exception as e:
+                with self.models_lock:
+                    del self.models[name]  # the next request tries again
+                future.set_exception(e)
+        return future.result()
+
+    def stats(self):
+        with self.models_lock:
+            loaded = {name: future.result() for name, future in self.models.items()
+                      if future.done() and future.exception() is None}
+        return {name: {'batches': m.batches, 'images': m.images,
+                       'avg_batch': round(m.images / m.batches, 2) if m.batches else 0}
+                for name, m in loaded.items()}
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                header, payload = read_message(self.rfile)
+            except (OSError, ValueError):
+                return
+            if header is None:
+                return
+            self.server.last_request = time.monotonic()
+            try:
+                if header.get('op') == 'stats':
+                    write_message(self.wfile, {'ok': True, 'stats': self.server.stats()})
+                    continue
+                if header.get('op') == 'shutdown':
+                    write_message(self.wfile, {'ok': True})
+                    threading.Thread(target=self.server.shutdown).start()
+                    return
+                image = np.frombuffer(payload, dtype=np.uint8).reshape(MODEL_SIZE, MODEL_SIZE, 3)
+                mask = self.server.model(header.get('model', 'u2net')).infer(image)
+                write_message(self.wfile, {'ok': True}, mask.tobytes())
+            except Exception as e:
+                write_message(self.wfile, {'ok': False, 'error': str(e)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--socket', required=True)
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 1, help='ONNX Runtime intra-op threads')
+    parser.add_argument('--max-batch', type=int, default=8)
+    parser.add_argument('--window-ms', type=float, default=15, help='how long a batch waits for more requests')
+    parser.add_argument('--idle-exit', type=float, default=600, help='exit after this many idle seconds (0: never)')
+    parser.add_argument('--preload', default='', help='comma-separated models to load at start')
+    args = parser.parse_args()
+
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    server = Server(args.socket, args.threads, args.max_batch, args.window_ms / 1000)
+    for name in filter(None, args.preload.split(',')):
+        server.model(name)
+
+    def watch_idle():
+        while True:
+            time.sleep(10)
+            if args.idle_exit and time.monotonic() - server.last_request > args.idle_exit:
+                print("Idle, shutting down", flush=True)
+                server.shutdown()
+                return
+
+    threading.Thread(target=watch_idle, daemon=True).start()
+    print(f"READY {args.socket}", flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+"""Client side of the background-removal service (bg_model_server.py).
+
+Images are decoded and resized to the model input here, so only a 320x320 RGB
+tile travels over the Unix socket and only the small mask comes back. The
+server process is started on demand by whichever worker first finds it
+missing; a lock file keeps concurrent workers from starting two.
+
+Large photos never go through the model or any float pipeline at full size:
+the 320x320 tile is decoded at reduced scale (JPEG draft mode), the mask is
+upsampled once into the alpha buffer, and only the soft edge band of that
+alpha is refined against the full-resolution image, strip by strip.
+"""
+import fcntl
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from bg_model_server import MODEL_SIZE, MODELS, read_message, write_message
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bg_model_server.py')
+START_TIMEOUT = 60
+# Above this many pixels, remove_file() switches to the upsample + edge-band refinement path
+LARGE_IMAGE_PIXELS = 4_000_000
+# Alpha values strictly between these are the edge band that gets refined
+BAND_LOW, BAND_HIGH = 4, 251
+REFINE_STRIP = 256
+
+
+class BackgroundRemovalError(Exception):
+    pass
+
+
+def guided_filter(guide, src, radius, eps):
+    """Edge-preserving smoothing of `src` following the edges of `guide` (He et al.), float32 in [0, 1]."""
+    import cv2
+    size = (2 * radius + 1, 2 * radius + 1)
+
+    def box(a):
+        return cv2.boxFilter(a, cv2.CV_32F, size, borderType=cv2.BORDER_REFLECT)
+
+    mean_i = box(guide)
+    mean_p = box(src)
+    a = (box(guide * src) - mean_i * mean_p) / (box(guide * guide) - mean_i * mean_i + eps)
+    b = mean_p - a * mean_i
+    return box(a) * guide + box(b)
+
+
+def refine_edges(image, alpha, radius, eps=1e-3, strip=REFINE_STRIP):
+    """Snap the soft band of an upsampled `alpha` (uint8, modified in place) to the edges of `image`.
+
+    Works strip by strip on the columns that contain band pixels, so the float
+    buffers are bounded by the strip and fully opaque/transparent areas cost one
+    comparison per pixel.
+    """
+    h, w = alpha.shape
+    for y0 in range(0, h, strip):
+        y1 = min(h, y0 + strip)
+        rows = alpha[y0:y1]
+        band = (rows > BAND_LOW) & (rows < BAND_HIGH)
+        cols = np.flatnonzero(band.any(axis=0))
+        if not cols.size:
+            continue
+        x0, x1 = max(0, cols[0] - radius), min(w, cols[-1] + radius + 1)
+        top, bottom = max(0, y0 - radius), min(h, y1 + radius)
+        guide = np.asarray(image.crop((x0, top, x1, bottom)).convert('L'), dtype=np.float32)
+        guide *= 1 / 255
+        src = alpha[top:bottom, x0:x1].astype(np.float32)
+        src *= 1 / 255
+        refined = guided_filter(guide, src, radius, eps)[y0 - top:y1 - top]
+        refined *= 255
+        refined += 0.5
+        np.clip(refined, 0, 255, out=refined)
+        band = band[:, x0:x1]
+        rows[:, x0:x1][band] = refined[band]
+
+
+def apply_mask(image, mask, refine=False):
+    """RGBA version of `image` with the model-resolution `mask` upsampled as its alpha channel.
+
+    With `refine`, the mask is upsampled bilinearly straight into the alpha
+    buffer and only its edge band is refined (see refine_edges); the alpha is
+    then handed to PIL without a copy.
+    """
+    from PIL import Image
+    if not refine:
+        out = image.convert('RGBA')
+        out.putalpha(mask.resize(image.size, Image.LANCZOS))
+        return out
+    import cv2
+    alpha = cv2.resize(np.asarray(mask), image.size, interpolation=cv2.INTER_LINEAR)
+    image = image.convert('RGB') if image.mode not in ('RGB', 'RGBA') else image
+    # The upsampled transition is about `scale` pixels wide; the filter window follows it
+    scale = max(image.size) / MODEL_SIZE
+    refine_edges(image, alpha, radius=max(2, min(32, round(scale))))
+    out = image.convert('RGBA') if image.mode != 'RGBA' else image
+    out.putalpha(Image.frombuffer('L', image.size, alpha, 'raw', 'L', 0, 1))
+    return out
+
+
+class BackgroundRemover:
+    def __init__(self, socket_path, threads=None, max_batch=8, window_ms=15, idle_exit=600, python=None):
+        self.socket_path = socket_path
+        self.threads = threads or os.cpu_count() or 1
+        self.max_batch = max_batch
+        self.window_ms = window_ms
+        self.idle_exit = idle_exit
+        self.python = python or sys.executable
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def _start_server(self):
+        with open(self.socket_path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Another worker may have started it while we waited for the lock
+                self._connect().close()
+                return
+            except OSError:
+                pass
+            subprocess.Popen(
+                [self.python, SERVER_SCRIPT, '--socket', self.socket_path, '--threads', str(self.threads),
+                 '--max-batch', str(self.max_batch), '--window-ms', str(self.window_ms),
+                 '--idle-exit', str(self.idle_exit)],
+                stdin=subprocess.DEVNULL, start_new_session=True)
+            deadline = time.monotonic() + START_TIMEOUT
+            while time.monotonic() < deadline:
+                try:
+                    self._connect().close()
+                    return
+                except OSError:
+                    time.sleep(0.1)
+            raise BackgroundRemovalError("Le service de détourage n'a pas démarré")
+
+    def request(self, header, payload=b''):
+        for attempt in (1, 2):
+            try:
+                with self._connect() as sock, sock.makefile('rwb') as f:
+                    write_message(f, header, payload)
+                    response, data = read_message(f)
+                break
+            except OSError:
+                if attempt == 2:
+                    raise BackgroundRemovalError('Service de détourage injoignable')
+                self._start_server()
+        if not response or not response.get('ok'):
+            raise BackgroundRemovalError((response or {}).get('error', 'Réponse invalide du service de détourage'))
+        return response, data
+
+    def mask(self, image, model='u2net'):
+        """Model-resolution mask (PIL 'L', MODEL_SIZE square) of a PIL image."""
+        from PIL import Image
+        if model not in MODELS:
+            raise ValueError(model)
+        if image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGB')
+        # reducing_gap: box-reduce first, so the LANCZOS pass only sees ~3x the tile size
+        tile = image.resize((MODEL_SIZE, MODEL_SIZE), Image.LANCZOS, reducing_gap=3.0).convert('RGB')
+        _, data = self.request({'op': 'infer', 'model': model}, tile.tobytes())
+        return Image.frombytes('L', (MODEL_SIZE, MODEL_SIZE), data)
+
+    def remove(self, image, model='u2net'):
+        """RGBA copy of `image` with the background made transparent."""
+        return apply_mask(image, self.mask(image, model))
+
+    def remove_file(self, path, output_path, model='u2net'):
+        """Like remove() from an image file to a PNG, with bounded extra memory for large photos."""
+        from PIL import Image
+        with Image.open(path) as im:
+            # JPEG: let libjpeg decode at 1/2..1/8 scale, enough for the model tile
+            im.draft('RGB', (MODEL_SIZE * 2, MODEL_SIZE * 2))
+            mask = self.mask(im, model)
+        # The result can share the source's pixels (RGBA input): keep the file open until it is saved
+        with Image.open(path) as image:
+            large = image.width * image.height > LARGE_IMAGE_PIXELS
+            # zlib level 6 on a 48 MP RGBA frame takes longer than the whole removal
+            apply_mask(image, mask, refine=large).save(output_path, 'PNG', compress_level=1 if large else 6)
+
+    def stats(self):
+        return self.request({'op': 'stats'})[0]['stats']
+
+    def shutdown(self):
+        self.request({'op': 'shutdown'})
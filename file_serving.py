@@ -0,0 +1,111 @@
+"""Download responses for result files: ETag revalidation, resumable single
+ranges and zero-copy transfer.
+
+Under gunicorn the body is the server's `wsgi.file_wrapper`, positioned at the
+start of the requested range with an exact Content-Length, so gunicorn pushes
+the bytes with sendfile(2). FILE_SERVE_MODE can instead hand the transfer to a
+front proxy: `x-accel` (nginx X-Accel-Redirect) or `x-sendfile`
+(Apache/lighttpd). Multi-range requests fall back to the whole file (RFC 9110).
+Virtual zips (see zip_builder) are generated while they are sent, so they have
+no length up front and no Range support.
+"""
+import mimetypes
+import os
+import unicodedata
+from urllib.parse import quote
+
+from flask import Response, request
+from werkzeug.http import http_date, quote_etag
+from werkzeug.security import safe_join
+
+from zip_builder import iter_zip
+
+READ_CHUNK = 256 * 1024
+
+
+def _content_disposition(name):
+    try:
+        name.encode('ascii')
+        return f'attachment; filename="{name}"'
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode('ascii')
+        return f"attachment; filename=\"{simple}\"; filename*=UTF-8''{quote(name, safe='')}"
+
+
+def _iter_range(path, start, length):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(READ_CHUNK, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _file_body(path, start, length):
+    wrapper = request.environ.get('wsgi.file_wrapper')
+    if wrapper and request.environ.get('SERVER_SOFTWARE', '').startswith('gunicorn'):
+        # gunicorn sendfile()s from the current offset and stops at Content-Length
+        f = open(path, 'rb')
+        f.seek(start)
+        return wrapper(f, READ_CHUNK)
+    return _iter_range(path, start, length)
+
+
+def send_result_file(folder, filename, mode='direct', accel_prefix='/protected-downloads'):
+    path = safe_join(folder, filename)
+    if path is None or not os.path.isfile(path):
+        return None
+
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = f'{stat.st_ino:x}-{stat.st_mtime_ns:x}-{size:x}'
+    headers = {
+        'ETag': quote_etag(etag),
+        'Last-Modified': http_date(stat.st_mtime),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, no-cache',
+        'Content-Disposition': _content_disposition(os.path.basename(filename)),
+    }
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+
+    if mode == 'x-accel':
+        headers['X-Accel-Redirect'] = f"{accel_prefix.rstrip('/')}/{quote(filename)}"
+        return Response(status=200, headers=headers, mimetype=mimetype)
+    if mode == 'x-sendfile':
+        headers['X-Sendfile'] = os.path.abspath(path)
+        return Response(status=200, headers=headers, mimetype=mimetype)
+
+    start, length, status = 0, size, 200
+    byte_range = request.range
+    if byte_range is not None and len(byte_range.ranges) == 1:
+        if_range = request.if_range
+        stale = (if_range.etag is not None and if_range.etag != etag) or \
+                (if_range.date is not None and if_range.date.timestamp() < int(stat.st_mtime))
+        if not stale:
+            bounds = byte_range.range_for_length(size)
+            if bounds is None:
+                headers['Content-Range'] = f'bytes */{size}'
+                return Response(status=416, headers=headers)
+            start, stop = bounds
+            length, status = stop - start, 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+    response = Response(_file_body(path, start, length), status=status, headers=headers,
+                        mimetype=mimetype, direct_passthrough=True)
+    response.content_length = length
+    return response
+
+
+def send_virtual_zip(filename, members):
+    headers = {
+        'Cache-Control': 'private, no-cache',
+        'Content-Disposition': _content_disposition(os.path.basename(filename)),
+        # Let nginx pass chunks through instead of spooling the whole archive
+        'X-Accel-Buffering': 'no',
+    }
+    return Response(iter_zip(members), headers=headers, mimetype='application/zip', direct_passthrough=True)
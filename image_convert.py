@@ -0,0 +1,184 @@
+"""Image format conversion with bounded memory.
+
+When the output is smaller than the source, resolution is reduced while
+decoding: JPEG through draft mode (libjpeg scales by 1/2..1/8 inside the
+decoder), other formats through an integer Image.reduce() before the final
+LANCZOS pass, so the full-size frame is never resampled. Outputs go through
+a SpooledTemporaryFile: small results stay in memory, larger ones are
+written to disk as they are encoded.
+"""
+import collections
+import tempfile
+
+from PIL import Image
+
+# Extension -> Pillow format
+OUTPUT_FORMATS = {
+    'png': 'PNG', 'jpg': 'JPEG', 'jpeg': 'JPEG', 'webp': 'WEBP', 'avif': 'AVIF',
+    'bmp': 'BMP', 'gif': 'GIF', 'tiff': 'TIFF', 'ico': 'ICO',
+}
+MIMETYPES = {
+    'PNG': 'image/png', 'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'AVIF': 'image/avif',
+    'BMP': 'image/bmp', 'GIF': 'image/gif', 'TIFF': 'image/tiff', 'ICO': 'image/x-icon',
+}
+# Lossy formats and the quality used when none is given
+DEFAULT_QUALITY = {'JPEG': 90, 'WEBP': 85, 'AVIF': 70}
+# Modes each format can store as is; anything else is converted first
+NATIVE_MODES = {
+    'JPEG': ('L', 'RGB', 'CMYK'),
+    'WEBP': ('RGB', 'RGBA'),
+    'AVIF': ('RGB', 'RGBA'),
+    'BMP': ('1', 'L', 'P', 'RGB'),
+    'ICO': ('RGB', 'RGBA'),
+}
+# 16/32-bit grayscale and float modes: few encoders and resamplers take them
+DEEP_MODES = ('I;16', 'I;16L', 'I;16B', 'I;16N', 'I', 'F')
+# Deep modes each format can store as is
+NATIVE_DEEP_MODES = {
+    'PNG': ('I;16', 'I;16L', 'I;16B', 'I;16N', 'I'),
+    'TIFF': DEEP_MODES,
+}
+ICO_MAX_SIZE = 256
+SPOOL_BYTES = 8 * 1024 * 1024
+
+# EXIF orientation -> transpose that makes the pixels upright
+ORIENTATION_TRANSPOSE = {
+    2: Image.Transpose.FLIP_LEFT_RIGHT, 3: Image.Transpose.ROTATE_180, 4: Image.Transpose.FLIP_TOP_BOTTOM,
+    5: Image.Transpose.TRANSPOSE, 6: Image.Transpose.ROTATE_270, 7: Image.Transpose.TRANSVERSE,
+    8: Image.Transpose.ROTATE_90,
+}
+
+ConvertOptions = collections.namedtuple('ConvertOptions', 'format max_size quality strip_metadata progressive')
+
+
+def can_save(fmt):
+    Image.init()
+    return fmt in Image.SAVE
+
+
+def convert_options(target_format, max_size=None, quality=None, strip_metadata=False, progressive=False):
+    """Validated ConvertOptions. Raises ValueError with a message for the user."""
+    target_format = (target_format or 'png').lower()
+    if target_format not in OUTPUT_FORMATS:
+        raise ValueError(f'Format non supporté: {target_format}')
+    if not can_save(OUTPUT_FORMATS[target_format]):
+        raise ValueError(f'Le format {target_format.upper()} n\'est pas disponible sur ce serveur')
+    if max_size is not None and not 16 <= max_size <= 20000:
+        raise ValueError('La taille maximale doit être comprise entre 16 et 20000 pixels')
+    if quality is not None and not 1 <= quality <= 100:
+        raise ValueError('La qualité doit être comprise entre 1 et 100')
+    return ConvertOptions(target_format, max_size, quality, bool(strip_metadata), bool(progressive))
+
+
+def fit(size, max_size):
+    """`size` scaled down to fit in a `max_size` square, or unchanged if it already does."""
+    width, height = size
+    if not max_size or max(width, height) <= max_size:
+        return size
+    scale = max_size / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _to_8bit(im):
+    """`im` (a deep mode) as 'L', stretched to 0..255 when its values go beyond that range."""
+    if im.mode != 'F':
+        im = im.convert('I').convert('F')
+    low, high = im.getextrema()
+    if high > 255:
+        scale = 255 / high
+    elif 0 < high <= 1 and low >= 0:
+        # Float images usually hold 0..1
+        scale = 255
+    else:
+        scale = 1
+    if scale != 1:
+        im = im.point(lambda v: v * scale)
+    return im.convert('L')
+
+
+def _reduced(im, target):
+    """`im` resampled to `target`, reducing as much as possible before the LANCZOS pass."""
+    if target == im.size:
+        return im
+    if im.mode in ('P', '1'):
+        im = im.convert('RGBA' if 'transparency' in im.info else 'RGB')
+    elif im.mode in DEEP_MODES:
+        im = _to_8bit(im)
+    # JPEG: decode at the largest 1/2^n scale that is still >= target (no-op for other formats)
+    im.draft(None, target)
+    factor = min(im.size[0] // target[0], im.size[1] // target[1])
+    if factor >= 2:
+        im = im.reduce(factor)
+    return im.resize(target, Image.LANCZOS)
+
+
+def _target_mode(im, fmt):
+    modes = NATIVE_MODES.get(fmt)
+    if modes is None:
+        # PNG, TIFF and GIF take most modes; only print-oriented ones need RGB
+        return 'RGB' if im.mode in ('CMYK', 'YCbCr', 'LAB', 'HSV') else None
+    if im.mode in modes:
+        return None
+    has_alpha = im.mode in ('RGBA', 'LA', 'PA') or 'transparency' in im.info
+    return 'RGBA' if has_alpha and 'RGBA' in modes else 'RGB'
+
+
+def _save_args(im, fmt, options, exif, icc_profile):
+    args = {}
+    if fmt in DEFAULT_QUALITY:
+        args['quality'] = options.quality or DEFAULT_QUALITY[fmt]
+    if fmt == 'JPEG':
+        args.update(optimize=True, progressive=options.progressive)
+    elif fmt == 'WEBP':
+        args['method'] = 4
+    elif fmt == 'PNG':
+        args['compress_level'] = 6
+    elif fmt == 'GIF':
+        args['interlace'] = options.progressive
+    elif fmt == 'TIFF':
+        args['compression'] = 'tiff_deflate'
+    elif fmt == 'ICO':
+        args['sizes'] = [s for s in ((16, 16), (32, 32), (48, 48), (64, 64), (128, 128), (256, 256))
+                         if s[0] <= max(im.size)] or [im.size]
+    if exif and fmt in ('JPEG', 'WEBP', 'AVIF', 'PNG', 'TIFF'):
+        args['exif'] = exif
+    if icc_profile and fmt in ('JPEG', 'WEBP', 'AVIF', 'PNG', 'TIFF'):
+        args['icc_profile'] = icc_profile
+    return args
+
+
+def convert_image(source, out, options):
+    """Convert `source` (path or file object) into the binary file object `out`. Returns the output size."""
+    fmt = OUTPUT_FORMATS[options.format]
+    with Image.open(source) as im:
+        exif = im.getexif()
+        icc_profile = im.info.get('icc_profile')
+        orientation = exif.get(0x0112, 1)
+        max_size = min(options.max_size or ICO_MAX_SIZE, ICO_MAX_SIZE) if fmt == 'ICO' else options.max_size
+        target = fit(im.size, max_size)
+        image = _reduced(im, target)
+        if options.strip_metadata:
+            # Without EXIF the orientation tag is gone: apply it to the pixels instead
+            if orientation in ORIENTATION_TRANSPOSE:
+                image = image.transpose(ORIENTATION_TRANSPOSE[orientation])
+            exif = None
+        if image.mode in DEEP_MODES and image.mode not in NATIVE_DEEP_MODES.get(fmt, ()):
+            image = _to_8bit(image)
+        mode = _target_mode(image, fmt)
+        if mode:
+            image = image.convert(mode)
+        image.save(out, format=fmt, **_save_args(image, fmt, options, exif.tobytes() if exif else None,
+                                                 icc_profile))
+    return out.tell()
+
+
+def convert_to_spool(source, options, folder=None):
+    """convert_image() into a SpooledTemporaryFile rewound for reading; the caller closes it."""
+    out = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES, dir=folder)
+    try:
+        convert_image(source, out, options)
+    except BaseException:
+        out.close()
+        raise
+    out.seek(0)
+    return out
@@ -0,0 +1,250 @@
+"""Watermark inpainting restricted to the masked regions.
+
+Every region is inpainted on a padded crop around it and written back into
+the frame in place, so the cost follows the size of the watermark rather than
+the size of the frame. Regions come from rectangles (box_regions) or from a
+brush mask, where strokes close to each other share one crop (mask_regions).
+
+Videos are decoded by one ffmpeg process into raw BGR frames and encoded by a
+second one reading from a pipe (audio is taken straight from the source).
+Crops are inpainted by a thread pool (OpenCV releases the GIL) while frames are
+written back in order. A crop that barely changed since the last inpainted
+one reuses its result instead, which skips most of the work on static shots.
+"""
+import collections
+import concurrent.futures
+import subprocess
+import tempfile
+
+import numpy as np
+
+from media_probe import find_binary, FFmpegError
+
+INPAINT_METHODS = ('telea', 'ns')
+# A crop is static when fewer than this share of its pixels moved by more than STATIC_DIFF
+STATIC_DIFF = 10
+STATIC_SHARE = 0.005
+# Frames decoded ahead of the encoder, per inpainting thread
+FRAMES_AHEAD = 4
+CANCEL_CHECK_FRAMES = 30
+
+
+def inpaint_flag(method):
+    import cv2
+    return cv2.INPAINT_NS if method == 'ns' else cv2.INPAINT_TELEA
+
+
+def clip_box(box, width, height):
+    """Pixel (x0, y0, x1, y1) of an (x, y, w, h) box given in pixels or as fractions of the frame."""
+    x, y, w, h = box
+    if x <= 1.0 and y <= 1.0:
+        x, y = x * width, y * height
+    if w <= 1.0 and h <= 1.0:
+        w, h = w * width, h * height
+    x0 = max(0, min(width - 1, int(x)))
+    y0 = max(0, min(height - 1, int(y)))
+    return x0, y0, max(0, min(width, int(x + w))), max(0, min(height, int(y + h)))
+
+
+def box_regions(boxes, width, height, radius):
+    """(roi, mask) pairs for `boxes`: one padded crop per group of boxes whose padded areas touch.
+
+    Like mask_regions, overlapping or nearby boxes share one crop and one
+    mask, so no crop is inpainted from pixels another region is about to
+    replace, and the crops of different groups never overlap.
+    """
+    pad = 2 * radius + 8
+    groups = []  # [padded roi, clipped boxes]
+    for box in boxes:
+        x0, y0, x1, y1 = clip_box(box, width, height)
+        if x1 <= x0 or y1 <= y0:
+            continue
+        roi = [max(0, x0 - pad), max(0, y0 - pad), min(width, x1 + pad), min(height, y1 + pad)]
+        members = [(x0, y0, x1, y1)]
+        # Absorb every group this one touches, until nothing else does
+        merged = True
+        while merged:
+            merged = False
+            for group in groups:
+                other = group[0]
+                if roi[0] < other[2] and other[0] < roi[2] and roi[1] < other[3] and other[1] < roi[3]:
+                    roi = [min(roi[0], other[0]), min(roi[1], other[1]), max(roi[2], other[2]), max(roi[3], other[3])]
+                    members += group[1]
+                    groups.remove(group)
+                    merged = True
+                    break
+        groups.append((roi, members))
+
+    regions = []
+    for (rx0, ry0, rx1, ry1), members in groups:
+        mask = np.zeros((ry1 - ry0, rx1 - rx0), dtype=np.uint8)
+        for x0, y0, x1, y1 in members:
+            mask[y0 - ry0:y1 - ry0, x0 - rx0:x1 - rx0] = 255
+        regions.append(((rx0, ry0, rx1, ry1), mask))
+    return regions
+
+
+def load_mask(path, width, height):
+    """Brush mask of a PNG as uint8 0/255 at the frame size: its alpha channel if it has one, else its gray levels."""
+    import cv2
+    raw = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if raw is None:
+        raise ValueError('Masque illisible')
+    if raw.ndim == 3:
+        raw = raw[..., 3] if raw.shape[2] == 4 else cv2.cvtColor(raw, cv2.COLOR_BGR2GRAY)
+    if raw.dtype != np.uint8:
+        raw = (raw >> 8).astype(np.uint8)
+    if raw.shape != (height, width):
+        raw = cv2.resize(raw, (width, height), interpolation=cv2.INTER_NEAREST)
+    return cv2.threshold(raw, 127, 255, cv2.THRESH_BINARY)[1]
+
+
+def mask_regions(mask, radius):
+    """(roi, mask) pairs covering a full-frame mask: one padded crop per group of nearby strokes."""
+    import cv2
+    pad = 2 * radius + 8
+    # Strokes closer than the padding share a crop
+    grown = cv2.dilate(mask, cv2.getStructuringElement(cv2.MORPH_RECT, (2 * pad + 1, 2 * pad + 1)))
+    count, _, stats, _ = cv2.connectedComponentsWithStats(grown, connectivity=8)
+    regions = []
+    for x, y, w, h, _ in stats[1:count]:
+        crop = mask[y:y + h, x:x + w]
+        if crop.any():
+            regions.append(((int(x), int(y), int(x + w), int(y + h)), np.ascontiguousarray(crop)))
+    return regions
+
+
+def inpaint_regions(image, regions, radius=3, method='telea'):
+    """Inpaint `regions` of `image` (BGR array) in place, one padded crop at a time."""
+    flag = inpaint_flag(method)
+    for (x0, y0, x1, y1), mask in regions:
+        crop = image[y0:y1, x0:x1]
+        paste(crop, inpaint_crop(crop, mask, radius, flag), mask)
+    return image
+
+
+def inpaint_crop(crop, mask, radius, flag):
+    import cv2
+    return cv2.inpaint(crop, mask, radius, flag)
+
+
+def paste(crop, result, mask):
+    """Copy the masked pixels of `result` into `crop` (a view into the frame)."""
+    np.copyto(crop, result, where=(mask > 0)[..., None])
+
+
+def is_static(crop, reference):
+    import cv2
+    moved = np.count_nonzero(cv2.absdiff(crop, reference).max(axis=2) > STATIC_DIFF)
+    return moved < STATIC_SHARE * crop.shape[0] * crop.shape[1]
+
+
+def display_size(video):
+    """Frame size ffmpeg decodes a probed video stream to, once it has applied its rotation metadata."""
+    width, height = video['width'], video['height']
+    return (height, width) if abs(video.get('rotation') or 0) % 180 == 90 else (width, height)
+
+
+def _read_frame(stream, size):
+    frame = bytearray(size)
+    view = memoryview(frame)
+    filled = 0
+    while filled < size:
+        n = stream.readinto(view[filled:])
+        if not n:
+            return None
+        filled += n
+    return frame
+
+
+def _stderr_tail(errors, returncode):
+    errors.seek(0)
+    tail = errors.read().decode('utf-8', 'replace').strip().splitlines()[-5:]
+    return '\n'.join(tail) or f'ffmpeg exited with {returncode}'
+
+
+def inpaint_video(input_path, output_path, size, fps, regions, encode_args, workers=2, radius=3, method='telea',
+                  total_frames=0, on_progress=None, should_cancel=None):
+    """Inpaint `regions` (see box_regions) on every frame of the first video stream and encode the result.
+
+    `size` is the decoded (display) frame size and `encode_args` the output
+    options (codecs, rate control...). The source audio, if any, is mapped as
+    the second input. Returns a dict of counters, or None if cancelled; raises
+    FFmpegError if either ffmpeg fails.
+    """
+    width, height = size
+    frame_bytes = width * height * 3
+    flag = inpaint_flag(method)
+    ffmpeg = [find_binary('ffmpeg'), '-hide_banner', '-nostdin', '-loglevel', 'error']
+    decode_cmd = ffmpeg + ['-i', input_path, '-map', '0:v:0', '-r', str(fps),
+                           '-f', 'rawvideo', '-pix_fmt', 'bgr24', 'pipe:1']
+    encode_cmd = ffmpeg + ['-y', '-f', 'rawvideo', '-pix_fmt', 'bgr24', '-s', f'{width}x{height}', '-r', str(fps),
+                           '-i', 'pipe:0', '-i', input_path, '-map', '0:v:0', '-map', '1:a:0?'] + \
+        list(encode_args) + [output_path]
+    counters = {'frames': 0, 'inpainted': 0, 'reused': 0}
+
+    with tempfile.TemporaryFile() as decode_errors, tempfile.TemporaryFile() as encode_errors, \
+            concurrent.futures.ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        decoder = subprocess.Popen(decode_cmd, stdout=subprocess.PIPE, stderr=decode_errors, bufsize=frame_bytes)
+        encoder = subprocess.Popen(encode_cmd, stdin=subprocess.PIPE, stderr=encode_errors)
+        # Per region: the crop last sent to inpainting and the future of its result
+        references = [None] * len(regions)
+        pending = collections.deque()
+
+        def write_oldest():
+            frame, results = pending.popleft()
+            pixels = np.frombuffer(frame, dtype=np.uint8).reshape(height, width, 3)
+            for ((x0, y0, x1, y1), mask), future in zip(regions, results):
+                paste(pixels[y0:y1, x0:x1], future.result(), mask)
+            try:
+                encoder.stdin.write(frame)
+            except BrokenPipeError:
+                encoder.wait()
+                raise FFmpegError(_stderr_tail(encode_errors, encoder.returncode))
+            counters['frames'] += 1
+            if on_progress and total_frames and counters['frames'] % 10 == 0:
+                on_progress(min(1.0, counters['frames'] / total_frames))
+
+        decoded = 0
+        try:
+            while True:
+                frame = _read_frame(decoder.stdout, frame_bytes)
+                if frame is None:
+                    break
+                decoded += 1
+                pixels = np.frombuffer(frame, dtype=np.uint8).reshape(height, width, 3)
+                results = []
+                for i, ((x0, y0, x1, y1), mask) in enumerate(regions):
+                    crop = pixels[y0:y1, x0:x1]
+                    if references[i] is not None and is_static(crop, references[i][0]):
+                        counters['reused'] += 1
+                    else:
+                        crop = crop.copy()
+                        references[i] = (crop, pool.submit(inpaint_crop, crop, mask, radius, flag))
+                        counters['inpainted'] += 1
+                    results.append(references[i][1])
+                pending.append((frame, results))
+                if len(pending) > FRAMES_AHEAD * max(1, workers):
+                    write_oldest()
+                if should_cancel and decoded % CANCEL_CHECK_FRAMES == 0 and should_cancel():
+                    return None
+            while pending:
+                write_oldest()
+            decoder.wait()
+            if decoder.returncode != 0:
+                raise FFmpegError(_stderr_tail(decode_errors, decoder.returncode))
+            encoder.stdin.close()
+            encoder.wait()
+            if encoder.returncode != 0:
+                raise FFmpegError(_stderr_tail(encode_errors, encoder.returncode))
+            return counters
+        finally:
+            for process in (decoder, encoder):
+                if process.poll() is None:
+                    process.kill()
+                    process.wait()
+            if encoder.stdin and not encoder.stdin.closed:
+                try:
+                    encoder.stdin.close()
+                except BrokenPipeError:
+                    pass
@@ -420,12 +420,57 @@ document.addEventListener('DOMContentLoaded', () => {
 
 
     // Download Function
+    // Live task updates: Server-Sent Events when the browser supports them, polling otherwise
+    const TASK_TERMINAL_STATES = ['completed', 'error', 'cancelled'];
+    const watchTask = (taskId, onUpdate, pollMs = 1000) => {
+        let source = null;
+        let timer = null;
+        let stopped = false;
+
+        const stop = () => {
+            stopped = true;
+            if (source) source.close();
+            if (timer) clearInterval(timer);
+        };
+        const handle = (data) => {
+            if (stopped) return;
+            if (TASK_TERMINAL_STATES.includes(data.status)) stop();
+            onUpdate(data);
+        };
+        const startPolling = () => {
+            if (stopped || timer) return;
+            timer = setInterval(async () => {
+                try {
+                    const res = await fetch(`/api/download/status/${taskId}`);
+                    handle(await res.json());
+                } catch (err) {
+                    // Don't stop on transient fetch errors
+                    console.error('Polling error:', err);
+                }
+            }, pollMs);
+        };
+
+        if (window.EventSource) {
+            source = new EventSource(`/api/tasks/${taskId}/events`);
+            source.addEventListener('task', (e) => handle(JSON.parse(e.data)));
+            source.onerror = () => {
+                // Stream refused or cut (proxy, old server...): fall back to polling
+                source.close();
+                source = null;
+                startPolling();
+            };
+        } else {
+            startPolling();
+        }
+        return { stop };
+    };
+
     let currentTaskId = null;
-    let pollInterval = null;
+    let taskWatcher = null;
 
 const resetDownloadState = () => {
-    if (pollInterval) clearInterval(pollInterval);
-    pollInterval = null;
+    if (taskWatcher) taskWatcher.stop();
+    taskWatcher = null;
     currentTaskId = null;
     downloadBtn.disabled = false;
     downloadBtn.style.opacity = '1';
@@ -524,13 +569,12 @@ const resetDownloadState = () => {
             
             currentTaskId = data.task_id;
 
-            // Start Polling
-            pollInterval = setInterval(async () => {
+            // Follow progress
+            taskWatcher = watchTask(currentTaskId, (statusData) => {
                 try {
-                    const statusRes = await fetch(`/api/download/status/${currentTaskId}`);
-                    const statusData = await statusRes.json();
-
-                    if (statusData.status === 'downloading') {
+                    if (statusData.status === 'pending' && statusData.queue_position > 0) {
+                        progressText.innerText = `En file d'attente (position ${statusData.queue_position})`;
+                    } else if (statusData.status === 'downloading') {
                         const progress = statusData.progress || 0;
                         progressBar.style.width = `${progress}%`;
                         progressText.innerText = `${Math.round(progress)}%`;
@@ -568,10 +612,10 @@ const resetDownloadState = () => {
                     }
                 } catch (err) {
                     resetDownloadState();
-                    console.error('Polling error:', err);
+                    console.error('Task update error:', err);
                     downloadStatus.innerHTML = `<p style="color: var(--secondary);">Erreur: ${err.message}</p>`;
                 }
-            }, 1000);
+            });
 
         } catch (error) {
             resetDownloadState();
@@ -581,17 +625,17 @@ const resetDownloadState = () => {
     });
 
 const pollToolStatus = (taskId, statusElement, buttonElement, originalButtonHtml) => {
-    let toolPollInterval = setInterval(async () => {
+    const toolWatcher = watchTask(taskId, (data) => {
         try {
-            const response = await fetch(`/api/download/status/${taskId}`);
-            const data = await response.json();
-
             if (data.status === 'processing' || data.status === 'pending' || data.status === 'downloading') {
                 const progress = data.progress || 0;
+                const label = (data.status === 'pending' && data.queue_position > 0)
+                    ? `En file d'attente (position ${data.queue_position})...`
+                    : `Traitement en cours... ${Math.round(progress)}%`;
                 statusElement.classList.remove('hidden');
                 statusElement.innerHTML = `
                     <div class="loader"></div>
-                    <p>Traitement en cours... ${Math.round(progress)}%</p>
+                    <p>${label}</p>
                     <div style="width: 100%; background: rgba(255,255,255,0.1); height: 4px; border-radius: 2px; margin-top: 5px;">
                         <div style="width: ${progress}%; background: var(--primary); height: 100%; border-radius: 2px; transition: width 0.3s;"></div>
                     </div>
@@ -614,29 +658,36 @@ const pollToolStatus = (taskId, statusElement, buttonElement, originalButtonHtml
                     });
                 }
             } else if (data.status === 'completed') {
-                clearInterval(toolPollInterval);
+                toolWatcher.stop();
                 buttonElement.disabled = false;
                 buttonElement.innerHTML = originalButtonHtml;
+                let details = '';
+                if (data.compression) {
+                    const c = data.compression;
+                    details = c.skipped
+                        ? '<p style="font-size: 0.85em; color: var(--text-muted);">Fichier déjà optimisé, aucune réduction possible.</p>'
+                        : `<p style="font-size: 0.85em; color: var(--text-muted);">${(c.before / 1e6).toFixed(2)} Mo → ${(c.after / 1e6).toFixed(2)} Mo (-${c.saved_percent}%)</p>`;
+                }
                 statusElement.innerHTML = `
                     <i class="fa-solid fa-check" style="color: var(--primary); font-size: 1.5rem;"></i>
                     <p>Terminé ! <a href="${data.result.download_url}" download target="_blank" style="color: var(--text-main); text-decoration: underline;">Télécharger</a></p>
+                    ${details}
                 `;
                 
                 // Optional: show success modal like download?
             } else if (data.status === 'error') {
-                clearInterval(toolPollInterval);
+                toolWatcher.stop();
                 buttonElement.disabled = false;
                 buttonElement.innerHTML = originalButtonHtml;
                 statusElement.innerHTML = `<i class="fa-solid fa-times" style="color: #ff5555;"></i><p>Erreur: ${data.error}</p>`;
             } else if (data.status === 'cancelled') {
-                clearInterval(toolPollInterval);
+                toolWatcher.stop();
                 buttonElement.disabled = false;
                 buttonElement.innerHTML = originalButtonHtml;
                 statusElement.innerHTML = `<p style="color: var(--secondary);"><i class="fa-solid fa-ban"></i> Action annulée.</p>`;
             }
         } catch (err) {
-            console.error('Tool Polling Error:', err);
-            // Don't clear interval on transient fetch errors
+            console.error('Tool Update Error:', err);
         }
     }, 2000);
 };
@@ -699,6 +750,7 @@ const pollToolStatus = (taskId, statusElement, buttonElement, originalButtonHtml
                 endpoint = '/api/convert-video';
                 const formData = new FormData();
                 formData.append('file', fileInput.files[0]);
+                formData.append('format', document.getElementById('format-select').value);
                 body = formData;
             } else {
                 const textInput = document.getElementById('text-input');
@@ -835,6 +887,11 @@ const pollToolStatus = (taskId, statusElement, buttonElement, originalButtonHtml
     const imageInput = document.getElementById('image-input');
     const convertImageBtn = document.getElementById('convert-image-btn');
     const imageFormatSelect = document.getElementById('image-format-select');
+    const imageMaxSizeSelect = document.getElementById('image-max-size-select');
+    const imageStripMetadata = document.getElementById('image-strip-metadata');
+    const imageStatus = document.createElement('div');
+    imageStatus.className = 'status-area hidden';
+    if (convertImageBtn) convertImageBtn.parentNode.appendChild(imageStatus);
 
     if (imageDropZone && imageInput) {
         imageDropZone.addEventListener('click', () => imageInput.click());
@@ -881,6 +938,10 @@ const pollToolStatus = (taskId, statusElement, buttonElement, originalButtonHtml
             const formData = new FormData();
             formData.append('file', file);
             formData.append('format', format);
+            if (imageMaxSizeSelect && imageMaxSizeSelect.value) formData.append('max_size', imageMaxSizeSelect.value);
+            if (imageStripMetadata && imageStripMetadata.checked) formData.append('strip_metadata', '1');
+            const originalHtml = '<span>Convertir l\'Image</span><i class="fa-solid fa-wand-magic"></i>';
+            let queued = false;
 
             convertImageBtn.disabled = true;
             convertImageBtn.innerHTML = '<div class="loader" style="width: 20px; height: 20px; border-width: 2px;"></div> Conversion...';
@@ -891,7 +952,18 @@ const pollToolStatus = (taskId, statusElement, buttonElement, originalButtonHtml
                     body: formData
                 });
 
-                if (!response.ok) throw new Error('Erreur de conversion');
+                const isJson = (response.headers.get('Content-Type') || '').includes('application/json');
+                if (!response.ok) {
+                    const data = isJson ? await response.json() : {};
+                    throw new Error(data.error || 'Erreur de conversion');
+                }
+                if (isJson) {
+                    // Large image: converted as a background task
+                    const data = await response.json();
+                    queued = true;
+                    pollToolStatus(data.task_id, imageStatus, convertImageBtn, originalHtml);
+                    return;
+                }
 
                 const blob = await response.blob();
                 const url = window.URL.createObjectURL(blob);
@@ -915,10 +987,12 @@ const pollToolStatus = (taskId, statusElement, buttonElement, originalButtonHtml
                 alert('Conversion réussie !');
             } catch (error) {
                 console.error(error);
-                alert('Une erreur est survenue lors de la conversion.');
+                alert(error.message || 'Une erreur est survenue lors de la conversion.');
             } finally {
-                convertImageBtn.disabled = false;
-                convertImageBtn.innerHTML = '<span>Convertir l\'Image</span><i class="fa-solid fa-wand-magic"></i>';
+                if (!queued) {
+                    convertImageBtn.disabled = false;
+                    convertImageBtn.innerHTML = originalHtml;
+                }
             }
         });
     }
@@ -1142,8 +1216,11 @@ const pollToolStatus = (taskId, statusElement, buttonElement, originalButtonHtml
             handleFiles(files);
         }
 
+        // Outils qui prennent plusieurs fichiers (dans l'ordre) en une seule requête
+        const multiFile = ['merge-pdf', 'img-to-pdf'].includes(toolKey);
+
         function handleFiles(files) {
-            if (toolKey === 'merge-pdf') {
+            if (multiFile) {
                 selectedFiles = [...selectedFiles, ...files];
                 updateFileList(selectedFiles);
             } else {
@@ -1188,7 +1265,7 @@ const pollToolStatus = (taskId, statusElement, buttonElement, originalButtonHtml
 
             const formData = new FormData();
             
-            if (toolKey === 'merge-pdf') {
+            if (multiFile) {
                 selectedFiles.forEach(file => formData.append('files[]', file));
             } else {
                 formData.append('file', selectedFiles[0]);
@@ -1206,6 +1283,12 @@ const pollToolStatus = (taskId, statusElement, buttonElement, originalButtonHtml
                 if (input.className.includes('annot-text')) formData.append('text', input.value);
                 if (input.className.includes('color-rgb')) formData.append('color', input.value);
             });
+            const renderFormat = toolContentArea.querySelector('.render-format');
+            if (renderFormat) formData.append('format', renderFormat.value);
+            const renderDpi = toolContentArea.querySelector('.render-dpi');
+            if (renderDpi) formData.append('dpi', renderDpi.value);
+            const compressLevel = toolContentArea.querySelector('.compress-level');
+            if (compressLevel) formData.append('level', compressLevel.value);
 
             // Cas spécial pour fichier signature/dessin
             if (toolKey === 'add-signature' || toolKey === 'draw-pdf') {
@@ -0,0 +1,146 @@
+"""ffprobe metadata and ffmpeg runs with machine-readable progress.
+
+`probe()` runs `ffprobe -print_format json` once per input and keeps a compact
+summary (container, duration, bitrate, streams and codecs) in a shared cache
+keyed by the SHA-256 of the file. `run_ffmpeg()` reads the key=value blocks
+ffmpeg writes with `-progress pipe:1` instead of parsing its human-readable
+stderr.
+"""
+import json
+import os
+import subprocess
+import tempfile
+
+PROBE_TTL = 24 * 3600
+BIN_DIR = os.path.join(os.getcwd(), 'bin')
+
+
+class ProbeError(Exception):
+    pass
+
+
+class FFmpegError(Exception):
+    pass
+
+
+def find_binary(name):
+    """Bundled binary from bin/ (see setup_ffmpeg.py) or the one on PATH."""
+    local = os.path.join(BIN_DIR, name + '.exe' if os.name == 'nt' else name)
+    return local if os.path.exists(local) else name
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _rate(value):
+    # r_frame_rate is a fraction such as "30000/1001"
+    num, _, den = (value or '').partition('/')
+    try:
+        return round(float(num) / float(den or 1), 3)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
+def _rotation(stream):
+    # Display matrix side data (recent ffmpeg) or the legacy `rotate` tag, in degrees
+    for data in stream.get('side_data_list') or []:
+        if 'rotation' in data:
+            return int(_float(data['rotation']) or 0)
+    return int(_float((stream.get('tags') or {}).get('rotate')) or 0)
+
+
+def _summarize(raw):
+    fmt = raw.get('format', {})
+    streams = []
+    for s in raw.get('streams', []):
+        streams.append({
+            'index': s.get('index'),
+            'type': s.get('codec_type'),
+            'codec': s.get('codec_name'),
+            'profile': s.get('profile'),
+            'bit_rate': _int(s.get('bit_rate')),
+            'duration': _float(s.get('duration')),
+            'width': s.get('width'),
+            'height': s.get('height'),
+            'fps': _rate(s.get('r_frame_rate')) if s.get('codec_type') == 'video' else None,
+            'rotation': _rotation(s) if s.get('codec_type') == 'video' else None,
+            'sample_rate': _int(s.get('sample_rate')),
+            'channels': s.get('channels'),
+            'language': (s.get('tags') or {}).get('language'),
+        })
+    duration = _float(fmt.get('duration'))
+    if not duration:
+        duration = max((s['duration'] or 0 for s in streams), default=0)
+    return {
+        'format': fmt.get('format_name'),
+        'duration': duration or 0,
+        'bit_rate': _int(fmt.get('bit_rate')),
+        'size': _int(fmt.get('size')),
+        'streams': streams,
+    }
+
+
+def probe(path, digest=None, cache=None, ttl=PROBE_TTL):
+    """Describe a media file. With `digest` and a `cache` (TaskStore) the result is shared."""
+    if digest and cache:
+        cached = cache.cache_get('ffprobe', digest)
+        if cached:
+            return cached
+    cmd = [find_binary('ffprobe'), '-v', 'error', '-print_format', 'json',
+           '-show_format', '-show_streams', path]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise ProbeError(result.stderr.strip() or 'ffprobe failed')
+    info = _summarize(json.loads(result.stdout or '{}'))
+    if digest and cache:
+        cache.cache_set('ffprobe', digest, info, ttl)
+    return info
+
+
+def first_stream(info, kind):
+    """First 'video' / 'audio' / 'subtitle' stream of a probe result, or None."""
+    return next((s for s in info['streams'] if s['type'] == kind), None)
+
+
+def run_ffmpeg(args, duration=0, on_progress=None, should_cancel=None):
+    """Run ffmpeg with `args` (inputs, filters, outputs).
+
+    `on_progress(fraction)` is called for every progress block when the
+    duration is known and `should_cancel()` is polled at the same rate.
+    Returns False if the run was cancelled, True once ffmpeg succeeded, and
+    raises FFmpegError with the end of stderr otherwise.
+    """
+    cmd = [find_binary('ffmpeg'), '-hide_banner', '-nostdin', '-nostats', '-loglevel', 'error',
+           '-progress', 'pipe:1', '-y'] + list(args)
+    # stderr goes to a file so a chatty ffmpeg can never block on a full pipe
+    with tempfile.TemporaryFile() as errors:
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errors, text=True)
+        out_time = 0.0
+        for line in process.stdout:
+            key, _, value = line.strip().partition('=')
+            if key == 'out_time_us':
+                out_time = (_int(value) or 0) / 1e6
+            elif key == 'progress':
+                if should_cancel and should_cancel():
+                    process.terminate()
+                    process.wait()
+                    return False
+                if on_progress and duration > 0:
+                    on_progress(min(1.0, max(0.0, out_time / duration)))
+        process.wait()
+        if process.returncode != 0:
+            errors.seek(0)
+            tail = errors.read().decode('utf-8', 'replace').strip().splitlines()[-5:]
+            raise FFmpegError('\n'.join(tail) or f'ffmpeg exited with {process.returncode}')
+    return True
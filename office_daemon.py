@@ -0,0 +1,129 @@
+"""One warm headless LibreOffice, driven over UNO and exposed on local XML-RPC.
+
+    /usr/bin/python3 office_daemon.py --profile DIR [--soffice soffice]
+
+Must run under a Python that has the `uno` module (Debian: python3-uno), which
+is usually the system Python rather than the app's. Starts soffice with its
+own user profile, prints `READY <port>` on stdout once documents can be
+loaded, then serves `convert(input, output)` and `ping()` one call at a time
+on 127.0.0.1. Exits when soffice dies or when stdin is closed (parent gone).
+"""
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from xmlrpc.server import SimpleXMLRPCServer
+
+import uno
+from com.sun.star.beans import PropertyValue
+from com.sun.star.connection import NoConnectException
+
+CONNECT_TIMEOUT = 60
+
+# Document service -> PDF export filter
+PDF_FILTERS = (
+    ('com.sun.star.presentation.PresentationDocument', 'impress_pdf_Export'),
+    ('com.sun.star.sheet.SpreadsheetDocument', 'calc_pdf_Export'),
+    ('com.sun.star.drawing.DrawingDocument', 'draw_pdf_Export'),
+    ('com.sun.star.text.GenericTextDocument', 'writer_pdf_Export'),
+)
+
+
+def prop(name, value):
+    p = PropertyValue()
+    p.Name = name
+    p.Value = value
+    return p
+
+
+class Office:
+    def __init__(self, soffice, profile):
+        self.pipe = f'mediamaster_{uuid.uuid4().hex}'
+        self.proc = subprocess.Popen([
+            soffice, '--headless', '--invisible', '--nologo', '--norestore', '--nodefault', '--nolockcheck',
+            f'-env:UserInstallation={uno.systemPathToFileUrl(os.path.abspath(profile))}',
+            f'--accept=pipe,name={self.pipe};urp;StarOffice.ComponentContext',
+        ], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.desktop = self._connect()
+
+    def _connect(self):
+        local = uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext('com.sun.star.bridge.UnoUrlResolver', local)
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while True:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f'soffice exited with code {self.proc.returncode}')
+            try:
+                ctx = resolver.resolve(f'uno:pipe,name={self.pipe};urp;StarOffice.ComponentContext')
+                return ctx.ServiceManager.createInstanceWithContext('com.sun.star.frame.Desktop', ctx)
+            except NoConnectException:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.25)
+
+    def convert(self, input_path, output_path):
+        doc = self.desktop.loadComponentFromURL(
+            uno.systemPathToFileUrl(os.path.abspath(input_path)), '_blank', 0,
+            (prop('Hidden', True), prop('ReadOnly', True), prop('UpdateDocMode', 0)))
+        if doc is None:
+            raise RuntimeError('Document could not be loaded')
+        try:
+            filter_name = next((f for service, f in PDF_FILTERS if doc.supportsService(service)), 'writer_pdf_Export')
+            doc.storeToURL(uno.systemPathToFileUrl(os.path.abspath(output_path)),
+                           (prop('FilterName', filter_name),))
+        finally:
+            doc.close(True)
+        return True
+
+    def ping(self):
+        if self.proc.poll() is not None:
+            raise RuntimeError('soffice is not running')
+        self.desktop.getCurrentFrame()
+        return True
+
+    def stop(self):
+        if self.proc.poll() is None:
+            try:
+                self.desktop.terminate()
+                self.proc.wait(5)
+            except Exception:
+                self.proc.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profile', required=True)
+    parser.add_argument('--soffice', default='soffice')
+    args = parser.parse_args()
+
+    office = Office(args.soffice, args.profile)
+    server = SimpleXMLRPCServer(('127.0.0.1', 0), logRequests=False, allow_none=True)
+    server.register_function(office.convert, 'convert')
+    server.register_function(office.ping, 'ping')
+
+    def shutdown():
+        office.stop()
+        os._exit(0)
+
+    def watch_parent():
+        sys.stdin.read()
+        shutdown()
+
+    def watch_office():
+        office.proc.wait()
+        os._exit(1)
+
+    threading.Thread(target=watch_parent, daemon=True).start()
+    threading.Thread(target=watch_office, daemon=True).start()
+    print(f'READY {server.server_address[1]}', flush=True)
+    try:
+        server.serve_forever()
+    finally:
+        shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""Warm LibreOffice instances for document -> PDF conversion.
+
+Each instance is an `office_daemon.py` process (run with a Python that has
+`uno`) owning one headless soffice with its own user profile, so conversions
+never share a profile and skip the multi-second soffice startup. Instances are
+started on first use, checked with `ping()` after being idle, and restarted
+after a timeout, a crash or a broken connection.
+
+When the daemon cannot be started (no `uno` module, no soffice), conversions
+fall back to one `soffice --convert-to pdf` per file with a throwaway profile.
+"""
+import http.client
+import os
+import queue
+import select
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import xmlrpc.client
+
+DAEMON_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'office_daemon.py')
+START_TIMEOUT = 90
+# Retry the daemon this long after it failed to start
+DAEMON_RETRY_AFTER = 300
+
+
+class OfficeError(Exception):
+    pass
+
+
+def find_soffice():
+    return shutil.which('soffice') or shutil.which('libreoffice') or 'soffice'
+
+
+def default_uno_python():
+    """The system Python usually carries `uno` (python3-uno); the app's venv does not."""
+    for candidate in ('/usr/bin/python3', '/usr/lib/libreoffice/program/python'):
+        if os.path.exists(candidate):
+            return candidate
+    return sys.executable
+
+
+class _TimeoutTransport(xmlrpc.client.Transport):
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def make_connection(self, host):
+        connection = super().make_connection(host)
+        connection.timeout = self.timeout
+        return connection
+
+
+class OfficeInstance:
+    """One daemon + soffice pair with its own profile directory."""
+
+    def __init__(self, index, base_dir, python, soffice):
+        self.index = index
+        self.profile = os.path.join(base_dir, f'profile_{index}')
+        self.python = python
+        self.soffice = soffice
+        self.proc = None
+        self.port = None
+        self.last_used = 0.0
+        self.conversions = 0
+        self.restarts = 0
+
+    def start(self):
+        os.makedirs(self.profile, exist_ok=True)
+        try:
+            self.proc = subprocess.Popen(
+                [self.python, DAEMON_SCRIPT, '--profile', self.profile, '--soffice', self.soffice],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                start_new_session=True, text=True)
+        except OSError as e:
+            raise OfficeError(f'LibreOffice instance {self.index} could not be launched: {e}')
+        ready, _, _ = select.select([self.proc.stdout], [], [], START_TIMEOUT)
+        line = self.proc.stdout.readline() if ready else ''
+        if not line.startswith('READY '):
+            self.stop()
+            raise OfficeError(f'LibreOffice instance {self.index} did not start')
+        self.port = int(line.split()[1])
+        self.last_used = time.monotonic()
+        print(f"LibreOffice instance {self.index} ready (pid {self.proc.pid}, port {self.port})")
+
+    def call(self, method, *args, timeout=30):
+        proxy = xmlrpc.client.ServerProxy(f'http://127.0.0.1:{self.port}/', transport=_TimeoutTransport(timeout),
+                                          allow_none=True)
+        return getattr(proxy, method)(*args)
+
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def stop(self):
+        if self.proc is None:
+            return
+        try:
+            # The daemon and its soffice share a session: take both down
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        self.proc.wait()
+        self.proc = None
+        self.port = None
+
+    def restart(self):
+        self.stop()
+        self.restarts += 1
+        self.start()
+
+
+def convert_cli(input_path, output_path, soffice=None, timeout=120):
+    """One-shot `soffice --convert-to pdf` with a private profile."""
+    workdir = tempfile.mkdtemp(prefix='lo_')
+    try:
+        profile = os.path.join(workdir, 'profile')
+        cmd = [soffice or find_soffice(), '--headless', '--norestore', '--nologo',
+               f'-env:UserInstallation=file://{profile}',
+               '--convert-to', 'pdf', '--outdir', workdir, input_path]
+        try:
+            subprocess.run(cmd, check=True, timeout=timeout, stdin=subprocess.DEVNULL,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except subprocess.TimeoutExpired:
+            raise OfficeError('La conversion LibreOffice a dépassé le délai autorisé')
+        except subprocess.CalledProcessError as e:
+            raise OfficeError(f"Échec de la conversion LibreOffice: {e.stderr.decode(errors='replace')[-500:]}")
+        except OSError as e:
+            raise OfficeError(f"LibreOffice est introuvable: {e}")
+        produced = os.path.join(workdir, os.path.splitext(os.path.basename(input_path))[0] + '.pdf')
+        if not os.path.exists(produced):
+            raise OfficeError("LibreOffice n'a produit aucun PDF")
+        shutil.move(produced, output_path)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+class OfficePool:
+    """Hands out idle instances; one conversion per instance at a time."""
+
+    def __init__(self, size, base_dir=None, python=None, soffice=None, timeout=120, health_interval=30):
+        self.size = max(1, size)
+        # Private per pool: several gunicorn workers each run their own instances
+        self.base_dir = base_dir or tempfile.mkdtemp(prefix='office_pool_')
+        self.python = python or default_uno_python()
+        self.soffice = soffice or find_soffice()
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.instances = [OfficeInstance(i, self.base_dir, self.python, self.soffice) for i in range(self.size)]
+        self.idle = queue.Queue()
+        for instance in self.instances:
+            self.idle.put(instance)
+        self.lock = threading.Lock()
+        self.daemon_failed_at = None
+        self.fallbacks = 0
+
+    def _daemon_usable(self):
+        with self.lock:
+            return self.daemon_failed_at is None or time.monotonic() - self.daemon_failed_at > DAEMON_RETRY_AFTER
+
+    def _ready(self, instance):
+        """Start, health-check or restart `instance`. Raises OfficeError if it cannot run."""
+        if not instance.alive():
+            if instance.proc is not None:
+                print(f"LibreOffice instance {instance.index} died, restarting")
+                instance.restart()
+            else:
+                instance.start()
+            return
+        if time.monotonic() - instance.last_used > self.health_interval:
+            try:
+                instance.call('ping', timeout=5)
+            except (OSError, http.client.HTTPException, xmlrpc.client.Error) as e:
+                print(f"LibreOffice instance {instance.index} failed its health check ({e}), restarting")
+                instance.restart()
+
+    def convert(self, input_path, output_path, timeout=None):
+        timeout = timeout or self.timeout
+        if not self._daemon_usable():
+            self.fallbacks += 1
+            return convert_cli(input_path, output_path, self.soffice, timeout)
+
+        instance = self.idle.get()
+        try:
+            try:
+                self._ready(instance)
+            except OfficeError as e:
+                with self.lock:
+                    self.daemon_failed_at = time.monotonic()
+                print(f"{e}; falling back to one soffice process per conversion")
+                self.fallbacks += 1
+                return convert_cli(input_path, output_path, self.soffice, timeout)
+            with self.lock:
+                self.daemon_failed_at = None
+
+            try:
+                instance.call('convert', os.path.abspath(input_path), os.path.abspath(output_path), timeout=timeout)
+            except xmlrpc.client.Fault as e:
+                raise OfficeError(f'Échec de la conversion LibreOffice: {e.faultString[-300:]}')
+            except (OSError, http.client.HTTPException, xmlrpc.client.ProtocolError) as e:
+                # Timeout or crash mid-conversion: the instance state is unknown
+                instance.stop()
+                instance.restarts += 1
+                raise OfficeError(f'La conversion LibreOffice a échoué ou dépassé le délai ({e})')
+            instance.conversions += 1
+            instance.last_used = time.monotonic()
+        finally:
+            self.idle.put(instance)
+
+    def stats(self):
+        return {
+            'instances': [{'index': i.index, 'running': i.alive(), 'pid': i.proc.pid if i.alive() else None,
+                           'conversions': i.conversions, 'restarts': i.restarts} for i in self.instances],
+            'idle': self.idle.qsize(),
+            'cli_fallbacks': self.fallbacks,
+            'daemon_available': self.daemon_failed_at is None,
+        }
+
+    def close(self):
+        for instance in self.instances:
+            instance.stop()
+        shutil.rmtree(self.base_dir, ignore_errors=True)
@@ -0,0 +1,195 @@
+"""PDF size reduction: image downsampling/recompression, font subsetting, metadata.
+
+`analyse()` looks at a document with PyMuPDF without rewriting anything: the
+effective resolution of every image (from its largest placement), its encoded
+size and filter, embedded fonts that are not subsets yet, and metadata. Only
+the objects worth touching become jobs; when there are none the input is
+already optimal and is returned as is.
+
+Image jobs run in the worker processes (`recompress_images`), which open the
+file lazily with pikepdf and decode only their own images. The encoded results
+are written back into the document with `apply_images()` and only kept when
+they are meaningfully smaller than the original stream. Every step holds the
+GIL for its whole run, so callers send each of them to a worker process;
+`rewrite()` bundles the write-back of one document.
+"""
+import io
+import re
+
+from pdf_pipeline import open_pdf, save_pdf
+
+COMPRESSION_LEVELS = {
+    'low': {'dpi': 200, 'quality': 85},
+    'medium': {'dpi': 150, 'quality': 72},
+    'high': {'dpi': 96, 'quality': 55},
+}
+IMAGE_CODECS = {'jpeg': '/DCTDecode', 'jpx': '/JPXDecode'}
+# Downsample only clearly over-resolved images, and ignore small ones
+DOWNSAMPLE_MARGIN = 1.25
+MIN_IMAGE_BYTES = 16 * 1024
+# A recompressed image must save at least this fraction to replace the original
+MIN_GAIN = 0.1
+# Bilevel scans are better served by their CCITT/JBIG2 encoding than by JPEG
+SKIP_FILTERS = {'/JBIG2Decode', '/CCITTFaxDecode'}
+# Document info entries strip_metadata() keeps by default
+KEEP_INFO = ('/Title', '/Author')
+
+
+def _filters(doc, xref):
+    kind, value = doc.xref_get_key(xref, 'Filter')
+    if kind == 'name':
+        return [value]
+    if kind == 'array':
+        return re.findall(r'/\w+', value)
+    return []
+
+
+def _int_key(doc, xref, key, default=0):
+    kind, value = doc.xref_get_key(xref, key)
+    try:
+        return int(value) if kind == 'int' else default
+    except ValueError:
+        return default
+
+
+def analyse(path, target_dpi):
+    """What is worth compressing in `path`.
+
+    Returns {'images': {xref: {...}}, 'fonts': {xref: name}, 'metadata': bool}
+    where only images over `target_dpi` or stored without lossy compression
+    are listed.
+    """
+    import fitz
+
+    placements = {}
+    fonts = {}
+    with fitz.open(path) as doc:
+        for page in doc:
+            for info in page.get_image_info(xrefs=True):
+                xref = info.get('xref')
+                bbox = fitz.Rect(info['bbox'])
+                if not xref or bbox.is_empty:
+                    continue
+                dpi = min(info['width'] / (bbox.width / 72), info['height'] / (bbox.height / 72))
+                # The largest placement decides how much resolution is needed
+                placements[xref] = min(dpi, placements.get(xref, dpi))
+            for xref, ext, _, basefont, _, _ in page.get_fonts():
+                if ext != 'n/a' and not (len(basefont) > 7 and basefont[6] == '+'):
+                    fonts[xref] = basefont
+
+        images = {}
+        for xref, dpi in placements.items():
+            filters = _filters(doc, xref)
+            size = _int_key(doc, xref, 'Length')
+            if size < MIN_IMAGE_BYTES or SKIP_FILTERS.intersection(filters):
+                continue
+            if doc.xref_get_key(xref, 'ImageMask')[1] == 'true' or _int_key(doc, xref, 'BitsPerComponent', 8) != 8:
+                continue
+            lossy = bool({'/DCTDecode', '/JPXDecode'}.intersection(filters))
+            if dpi > target_dpi * DOWNSAMPLE_MARGIN or not lossy:
+                images[xref] = {'dpi': round(dpi), 'bytes': size, 'filter': ' '.join(filters) or 'none'}
+        metadata = bool(doc.xref_xml_metadata()) or any(doc.metadata.get(k) for k in ('creator', 'producer',
+                                                                                        'subject', 'keywords'))
+    return {'images': images, 'fonts': fonts, 'metadata': metadata}
+
+
+def _encode(image, codec, quality):
+    buf = io.BytesIO()
+    if codec == 'jpx':
+        # Map the 1-100 quality knob onto a PSNR target
+        image.save(buf, 'JPEG2000', quality_mode='dB', quality_layers=[20 + quality * 0.2])
+    else:
+        image.save(buf, 'JPEG', quality=quality, optimize=True)
+    return buf.getvalue()
+
+
+def recompress_images(path, jobs, quality, codec='jpeg'):
+    """Re-encode images of `path`; `jobs` is [(xref, scale)] with scale <= 1.
+
+    Runs in a worker process. Returns [(xref, data, width, height, mode, before)]
+    for the images that got at least MIN_GAIN smaller.
+    """
+    import pikepdf
+    from PIL import Image
+    from pikepdf.models.image import PdfImage
+
+    out = []
+    with pikepdf.open(path, access_mode=pikepdf.AccessMode.mmap) as pdf:
+        for xref, scale in jobs:
+            try:
+                obj = pdf.get_object(xref, 0)
+                if '/Decode' in obj or '/Mask' in obj:
+                    continue
+                before = len(obj.read_raw_bytes())
+                image = PdfImage(obj).as_pil_image()
+                size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+                if scale < 1 and image.format == 'JPEG':
+                    # Let libjpeg decode at a reduced scale first
+                    image.draft(image.mode, size)
+                if image.mode not in ('L', 'RGB'):
+                    if image.mode == 'CMYK':
+                        continue
+                    image = image.convert('RGB')
+                if image.size != size:
+                    image = image.resize(size, Image.LANCZOS)
+                data = _encode(image, codec, quality)
+            except Exception as e:
+                print(f"Image {xref} left as is: {e}")
+                continue
+            if len(data) <= before * (1 - MIN_GAIN):
+                out.append((xref, data, image.width, image.height, image.mode, before))
+    return out
+
+
+def apply_images(pdf, results, codec='jpeg'):
+    """Write `recompress_images` results into the open pikepdf document `pdf`."""
+    import pikepdf
+    for xref, data, width, height, mode, _ in results:
+        obj = pdf.get_object(xref, 0)
+        colorspace = obj.get('/ColorSpace')
+        channels = 1 if mode == 'L' else 3
+        keep_icc = (isinstance(colorspace, pikepdf.Array) and colorspace[0] == '/ICCBased'
+                    and int(colorspace[1].get('/N', 0)) == channels)
+        obj.write(data, filter=pikepdf.Name(IMAGE_CODECS[codec]))
+        obj.Width, obj.Height, obj.BitsPerComponent = width, height, 8
+        if not keep_icc:
+            obj.ColorSpace = pikepdf.Name.DeviceGray if mode == 'L' else pikepdf.Name.DeviceRGB
+        for key in ('/DecodeParms', '/Interpolate'):
+            if key in obj:
+                del obj[key]
+
+
+def strip_metadata(pdf, keep=KEEP_INFO):
+    """Drop the XMP packet, per-page editor data and every Info entry but `keep`."""
+    import pikepdf
+    if '/Metadata' in pdf.Root:
+        del pdf.Root.Metadata
+    if '/Info' in pdf.trailer:
+        info = pdf.trailer.Info
+        kept = {key: info[key] for key in keep if key in info}
+        del pdf.trailer.Info
+        if kept:
+            pdf.trailer.Info = pdf.make_indirect(pikepdf.Dictionary(kept))
+    for page in pdf.pages:
+        for key in ('/PieceInfo', '/Thumb', '/Metadata'):
+            if key in page.obj:
+                del page.obj[key]
+
+
+def rewrite(input_path, output_path, results, codec='jpeg'):
+    """`input_path` saved to `output_path` with `recompress_images` results applied and metadata stripped.
+
+    Runs in a worker process.
+    """
+    with open_pdf(input_path) as pdf:
+        apply_images(pdf, results, codec)
+        strip_metadata(pdf)
+        save_pdf(pdf, output_path)
+
+
+def subset_fonts(input_path, output_path):
+    """Rewrite `input_path` with its embedded fonts reduced to the glyphs used."""
+    import fitz
+    with fitz.open(input_path) as doc:
+        doc.subset_fonts()
+        doc.save(output_path, garbage=3, deflate=True, use_objstms=1)
@@ -0,0 +1,219 @@
+"""PDF merging with pikepdf (qpdf).
+
+Inputs are opened lazily and appended one after the other. qpdf copies the
+object structure of each page but reads stream contents only while the output
+is written, so every source stays open until then. Once the open sources pass
+MERGE_STAGE_BYTES, the pages copied so far are saved to an intermediate file
+that becomes the new base, and those sources are closed. Images and embedded
+font programs that several inputs share byte for byte are written once (within
+a stage), and the outlines of every input are carried over to their new pages.
+"""
+import hashlib
+import os
+
+COPY_OUTLINE_DEPTH = 16
+FINGERPRINT_DEPTH = 8
+# Size of the source files kept open at once before the partial output is staged to disk
+MERGE_STAGE_BYTES = 128 * 1024 * 1024
+
+
+def _page_key(page):
+    return page.obj.objgen
+
+
+def _fingerprint(obj, memo, depth=0):
+    """Content hash of an object and everything it references (None if too deep)."""
+    import pikepdf
+    if depth > FINGERPRINT_DEPTH:
+        return None
+    key = obj.objgen if isinstance(obj, pikepdf.Object) and obj.is_indirect else None
+    if key in memo:
+        return memo[key]
+    if isinstance(obj, (pikepdf.Dictionary, pikepdf.Stream)):
+        parts = []
+        for name in sorted(obj.keys()):
+            if name in ('/Parent', '/P'):
+                return None
+            value = _fingerprint(obj[name], memo, depth + 1)
+            if value is None:
+                return None
+            parts.append(f'{name}={value}')
+        digest = hashlib.sha256('|'.join(parts).encode('utf-8'))
+        if isinstance(obj, pikepdf.Stream):
+            digest.update(obj.read_raw_bytes())
+        result = digest.hexdigest()
+    elif isinstance(obj, pikepdf.Array):
+        parts = [_fingerprint(item, memo, depth + 1) for item in obj]
+        if None in parts:
+            return None
+        result = hashlib.sha256(('[' + ','.join(parts) + ']').encode('utf-8')).hexdigest()
+    else:
+        result = repr(obj)
+    if key is not None:
+        memo[key] = result
+    return result
+
+
+class _Deduplicator:
+    """Points identical image and font-program streams at a single copy."""
+
+    FONT_FILES = ('/FontFile', '/FontFile2', '/FontFile3')
+
+    def __init__(self):
+        self.seen = {}
+        self.memo = {}
+        self.replaced = 0
+
+    def forget(self):
+        """Drop the streams seen so far, once the document holding them is closed."""
+        self.seen = {}
+        self.memo = {}
+
+    def _canonical(self, obj):
+        import pikepdf
+        if not isinstance(obj, pikepdf.Stream):
+            return obj
+        key = _fingerprint(obj, self.memo)
+        if key is None:
+            return obj
+        first = self.seen.setdefault(key, obj)
+        if first.objgen != obj.objgen:
+            self.replaced += 1
+        return first
+
+    def page(self, page):
+        import pikepdf
+        resources = page.obj.get('/Resources')
+        if not isinstance(resources, pikepdf.Dictionary):
+            return
+        xobjects = resources.get('/XObject')
+        if isinstance(xobjects, pikepdf.Dictionary):
+            for name in list(xobjects.keys()):
+                xobject = xobjects[name]
+                if isinstance(xobject, pikepdf.Stream) and xobject.get('/Subtype') == '/Image':
+                    xobjects[name] = self._canonical(xobject)
+        fonts = resources.get('/Font')
+        if isinstance(fonts, pikepdf.Dictionary):
+            for name in list(fonts.keys()):
+                font = fonts[name]
+                if not isinstance(font, pikepdf.Dictionary):
+                    continue
+                for descendant in [font] + list(font.get('/DescendantFonts', [])):
+                    descriptor = descendant.get('/FontDescriptor') if isinstance(descendant, pikepdf.Dictionary) else None
+                    if not isinstance(descriptor, pikepdf.Dictionary):
+                        continue
+                    for key in self.FONT_FILES:
+                        if key in descriptor:
+                            descriptor[key] = self._canonical(descriptor[key])
+
+
+def _destination_page(src, item):
+    """Page object an outline item of `src` jumps to, or None."""
+    import pikepdf
+    dest = item.destination
+    if dest is None and item.action is not None and item.action.get('/S') == '/GoTo':
+        dest = item.action.get('/D')
+    if isinstance(dest, (pikepdf.String, pikepdf.Name, str)):
+        name = str(dest).lstrip('/')
+        dest = None
+        names = src.Root.get('/Names')
+        if names is not None and '/Dests' in names:
+            try:
+                dest = pikepdf.NameTree(names.Dests).get(name)
+            except Exception:
+                dest = None
+        if dest is None and '/Dests' in src.Root:
+            dest = src.Root.Dests.get('/' + name)
+        if isinstance(dest, pikepdf.Dictionary):
+            dest = dest.get('/D')
+    if isinstance(dest, pikepdf.Array) and len(dest) and isinstance(dest[0], pikepdf.Dictionary):
+        return dest[0]
+    return None
+
+
+def _copy_outline(src, items, page_map, depth=0):
+    """Rebuild `items` against the output page numbers in `page_map`."""
+    import pikepdf
+    copied = []
+    if depth > COPY_OUTLINE_DEPTH:
+        return copied
+    for item in items:
+        children = _copy_outline(src, item.children, page_map, depth + 1)
+        page = _destination_page(src, item)
+        target = page_map.get(page.objgen) if page is not None else None
+        if target is None and not children:
+            continue
+        new = pikepdf.OutlineItem(item.title, target if target is not None else children[0].destination)
+        new.children.extend(children)
+        copied.append(new)
+    return copied
+
+
+def _save(pdf, path):
+    import pikepdf
+    pdf.save(path, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate)
+
+
+def merge_pdfs(inputs, output_path, on_progress=None, should_cancel=None):
+    """Concatenate `inputs` ([(path, page indices or None for all)]) into `output_path`.
+
+    `on_progress(done, total)` is called after every input. Returns None if
+    cancelled, otherwise a summary dict.
+    """
+    import pikepdf
+    out = pikepdf.new()
+    dedupe = _Deduplicator()
+    outline_items = []
+    sources = []
+    open_bytes = 0
+    stage = None  # intermediate file `out` was reopened from
+    stages = 0
+    try:
+        for done, (path, pages) in enumerate(inputs, 1):
+            if should_cancel and should_cancel():
+                return None
+            src = pikepdf.open(path)
+            sources.append(src)
+            open_bytes += os.path.getsize(path)
+            indices = range(len(src.pages)) if pages is None else [p for p in pages if p < len(src.pages)]
+            page_map = {}
+            for index in indices:
+                out.pages.append(src.pages[index])
+                new_page = out.pages[-1]
+                page_map[_page_key(src.pages[index])] = len(out.pages) - 1
+                dedupe.page(new_page)
+            try:
+                with src.open_outline() as outline:
+                    outline_items += _copy_outline(src, outline.root, page_map)
+            except Exception as e:
+                print(f"Outline of {path} skipped: {e}")
+
+            if open_bytes > MERGE_STAGE_BYTES and done < len(inputs):
+                # Write out what was copied so far and continue from that file, so its sources can be closed
+                stages += 1
+                staged = f'{output_path}.stage{stages % 2}'
+                _save(out, staged)
+                out.close()
+                for source in sources:
+                    source.close()
+                sources = []
+                open_bytes = 0
+                if stage:
+                    os.remove(stage)
+                stage = staged
+                out = pikepdf.open(stage)
+                dedupe.forget()
+            if on_progress:
+                on_progress(done, len(inputs))
+
+        if outline_items:
+            with out.open_outline() as outline:
+                outline.root.extend(outline_items)
+        _save(out, output_path)
+        return {'pages': len(out.pages), 'deduplicated': dedupe.replaced, 'stages': stages}
+    finally:
+        out.close()
+        for src in sources:
+            src.close()
+        if stage and os.path.exists(stage):
+            os.remove(stage)
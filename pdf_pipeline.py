@@ -0,0 +1,58 @@
+"""Open/modify/save layer shared by the page-level PDF tools.
+
+Documents are opened with pikepdf over a memory map, so only the objects a tool
+actually touches are parsed. Overlays (watermarks, signatures) are imported
+once as Form XObjects and drawn on pages by reference. Output is written with
+object streams (compact xref) and can be linearized for fast web view.
+"""
+import io
+
+
+def open_pdf(source, password=''):
+    """Open a path or PDF bytes lazily. Use as a context manager."""
+    import pikepdf
+    if isinstance(source, (bytes, bytearray)):
+        return pikepdf.open(io.BytesIO(source), password=password)
+    return pikepdf.open(source, password=password, access_mode=pikepdf.AccessMode.mmap)
+
+
+def save_pdf(pdf, output_path, linearize=False, password=None):
+    """Write `pdf` with object streams; `password` encrypts it with AES-256."""
+    import pikepdf
+    encryption = pikepdf.Encryption(user=password, owner=password, R=6) if password else False
+    pdf.save(
+        output_path,
+        linearize=linearize,
+        object_stream_mode=pikepdf.ObjectStreamMode.generate,
+        compress_streams=True,
+        encryption=encryption,
+    )
+
+
+def copy_pages(src, indices):
+    """New document holding only `indices` of `src`; other pages are never read."""
+    import pikepdf
+    out = pikepdf.new()
+    for index in indices:
+        out.pages.append(src.pages[index])
+    return out
+
+
+def import_form(target, overlay, page_index=0):
+    """Copy one page of `overlay` into `target` as a reusable Form XObject.
+
+    `overlay` must stay open until `target` is saved (stream data is copied lazily).
+    """
+    return target.copy_foreign(overlay.pages[page_index].as_form_xobject())
+
+
+def page_box(page):
+    """(x0, y0, x1, y1) of the page's MediaBox."""
+    x0, y0, x1, y1 = (float(v) for v in page.mediabox)
+    return min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)
+
+
+def stamp(page, form, rect):
+    """Draw `form` over `page` inside `rect` (x0, y0, x1, y1)."""
+    import pikepdf
+    page.add_overlay(form, pikepdf.Rectangle(*rect))
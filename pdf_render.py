@@ -0,0 +1,80 @@
+"""Page-streaming PDF rasterisation with PyMuPDF.
+
+Pages are rendered in small chunks by the worker processes; each chunk comes
+back as encoded image bytes and is written into the output archive right away,
+so memory holds a few pages at a time whatever the length of the document.
+"""
+import io
+
+IMAGE_FORMATS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp'}
+RENDER_MIN_DPI, RENDER_MAX_DPI = 36, 600
+
+
+def parse_page_ranges(spec, page_count=None):
+    """'1,3,5-7' -> sorted 0-based page indices. Empty means every page.
+
+    Open ranges ('5-') run to the last page. Raises ValueError on bad syntax.
+    """
+    spec = (spec or '').replace(' ', '')
+    if not spec:
+        if page_count is None:
+            return None
+        return list(range(page_count))
+    pages = set()
+    for part in spec.split(','):
+        if not part:
+            continue
+        if '-' in part:
+            start, _, end = part.partition('-')
+            start = int(start) if start else 1
+            end = int(end) if end else (page_count or start)
+            if start < 1 or end < start:
+                raise ValueError(f'Invalid page range: {part}')
+            pages.update(range(start - 1, end))
+        else:
+            number = int(part)
+            if number < 1:
+                raise ValueError(f'Invalid page number: {part}')
+            pages.add(number - 1)
+    if page_count is not None:
+        pages = {p for p in pages if p < page_count}
+    return sorted(pages)
+
+
+def pdf_page_count(path):
+    import fitz
+    with fitz.open(path) as doc:
+        return doc.page_count
+
+
+def render_pages(path, pages, dpi, fmt, quality=85):
+    """Render `pages` (0-based) of `path`. Returns [(page index, image bytes)].
+
+    Runs in a worker process: the document is opened lazily, so a chunk only
+    parses the pages it draws.
+    """
+    import fitz
+    out = []
+    with fitz.open(path) as doc:
+        for index in pages:
+            pix = doc.load_page(index).get_pixmap(dpi=dpi, alpha=False)
+            if fmt == 'png':
+                data = pix.tobytes('png')
+            else:
+                from PIL import Image
+                image = Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+                buf = io.BytesIO()
+                if fmt == 'jpeg':
+                    image.save(buf, 'JPEG', quality=quality, optimize=True)
+                else:
+                    image.save(buf, 'WEBP', quality=quality, method=4)
+                data = buf.getvalue()
+            out.append((index, data))
+            pix = None
+    return out
+
+
+def chunk_pages(pages, workers, max_chunk=4):
+    """Split the page list so every worker gets work and progress stays fine-grained."""
+    size = max(1, min(max_chunk, -(-len(pages) // max(1, workers))))
+    return [pages[i:i + size] for i in range(0, len(pages), size)]
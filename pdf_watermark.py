@@ -0,0 +1,137 @@
+"""Text watermarks stamped by reference.
+
+The watermark is drawn once with reportlab per page geometry (size and
+/Rotate), imported into the document as a Form XObject and referenced from
+every page of that geometry. Page content streams are never decoded: each page
+only gains a resource entry and two tiny content streams that wrap its
+existing content (`q` before, `Q ... Do` after), shared by all pages of the
+same geometry. Rendered overlays are cached per worker process by style and
+geometry, so repeated jobs with the same settings skip reportlab entirely.
+"""
+import collections
+import functools
+import io
+import math
+
+from pdf_pipeline import open_pdf, page_box
+
+WATERMARK_FONTS = {
+    'helvetica': 'Helvetica',
+    'arial': 'Helvetica',
+    'verdana': 'Helvetica',
+    'impact': 'Helvetica-Bold',
+    'helvetica-bold': 'Helvetica-Bold',
+    'times': 'Times-Roman',
+    'times new roman': 'Times-Roman',
+    'georgia': 'Times-Roman',
+    'courier': 'Courier',
+}
+WATERMARK_MAX_COUNT = 20
+OVERLAY_CACHE_SIZE = 64
+
+WatermarkStyle = collections.namedtuple(
+    'WatermarkStyle', 'text size opacity angle color font count')
+
+
+def watermark_style(text, size=40, opacity=0.5, angle=45, color='#808080', font='Helvetica', count=1):
+    """Validated, hashable style. Raises ValueError on out-of-range values."""
+    text = (text or '').strip()
+    size, opacity, angle, count = float(size), float(opacity), float(angle), int(count)
+    color = (color or '').lstrip('#')
+    if not text or len(text) > 200:
+        raise ValueError('text')
+    if not 4 <= size <= 300 or not 0 < opacity <= 1 or not -360 <= angle <= 360:
+        raise ValueError('size/opacity/angle')
+    if not 1 <= count <= WATERMARK_MAX_COUNT:
+        raise ValueError('count')
+    if len(color) != 6:
+        raise ValueError('color')
+    rgb = tuple(int(color[i:i + 2], 16) / 255 for i in (0, 2, 4))
+    font = WATERMARK_FONTS.get((font or '').lower(), 'Helvetica')
+    return WatermarkStyle(text, size, opacity, angle, rgb, font, count)
+
+
+# Maps displayed (upright) coordinates back to user space for each /Rotate
+_DISPLAY_TRANSFORMS = {
+    0: lambda w, h: (1, 0, 0, 1, 0, 0),
+    90: lambda w, h: (0, 1, -1, 0, w, 0),
+    180: lambda w, h: (-1, 0, 0, -1, w, h),
+    270: lambda w, h: (0, -1, 1, 0, 0, h),
+}
+
+
+@functools.lru_cache(maxsize=OVERLAY_CACHE_SIZE)
+def render_overlay(style, width, height, rotate=0):
+    """One-page PDF (bytes) of `style` for a `width` x `height` page shown at `rotate`."""
+    from reportlab.pdfgen import canvas
+
+    packet = io.BytesIO()
+    can = canvas.Canvas(packet, pagesize=(width, height))
+    can.transform(*_DISPLAY_TRANSFORMS[rotate](width, height))
+    shown_w, shown_h = (height, width) if rotate in (90, 270) else (width, height)
+    can.setFont(style.font, style.size)
+    can.setFillColorRGB(*style.color)
+    can.setFillAlpha(style.opacity)
+
+    rows = math.ceil(math.sqrt(style.count))
+    cols = math.ceil(style.count / rows)
+    for i in range(style.count):
+        col, row = i % cols, i // cols
+        can.saveState()
+        can.translate(shown_w * (col + 0.5) / cols, shown_h * (rows - row - 0.5) / rows)
+        can.rotate(style.angle)
+        # Centre the text vertically on its anchor as well
+        can.drawCentredString(0, -style.size * 0.35, style.text)
+        can.restoreState()
+    can.showPage()
+    can.save()
+    return packet.getvalue()
+
+
+def _rotation(page):
+    try:
+        return int(page.obj.get('/Rotate', 0)) % 360
+    except (TypeError, ValueError):
+        return 0
+
+
+def watermark_pdf(pdf, style, keep_open, on_progress=None):
+    """Stamp every page of the open pikepdf document `pdf` with `style`.
+
+    Overlay documents are entered on the `keep_open` ExitStack: their streams
+    are only copied when `pdf` is saved. Returns the number of distinct overlays.
+    """
+    import pikepdf
+
+    groups = {}
+    total = len(pdf.pages)
+    for index, page in enumerate(pdf.pages):
+        box = page_box(page)
+        rotate = _rotation(page)
+        key = (round(box[2] - box[0], 2), round(box[3] - box[1], 2), rotate if rotate in _DISPLAY_TRANSFORMS else 0)
+        group = groups.get(key)
+        if group is None:
+            overlay = keep_open.enter_context(open_pdf(render_overlay(style, *key)))
+            form = pdf.copy_foreign(overlay.pages[0].as_form_xobject())
+            name = pikepdf.Name(f'/MMWatermark{len(groups)}')
+            group = groups[key] = {'form': form, 'name': name, 'open': pdf.make_stream(b'q\n'), 'close': {}}
+
+        # A fixed name per overlay lets pages of the same geometry share one content stream
+        page.add_resource(group['form'], pikepdf.Name.XObject, name=group['name'])
+        close = group['close'].get(box)
+        if close is None:
+            placement = page.calc_form_xobject_placement(
+                group['form'], group['name'], pikepdf.Rectangle(*box), invert_transformations=False)
+            close = group['close'][box] = pdf.make_stream(b'\nQ\nq\n' + placement + b'\nQ\n')
+
+        contents = page.obj.get('/Contents')
+        if contents is None:
+            existing = []
+        elif isinstance(contents, pikepdf.Array):
+            existing = list(contents)
+        else:
+            existing = [contents]
+        page.obj.Contents = pikepdf.Array([group['open']] + existing + [close])
+        if on_progress and index % 50 == 0:
+            on_progress(index / total)
+    return len(groups)
@@ -0,0 +1,126 @@
+"""Content-addressed cache of tool outputs.
+
+Entries are keyed by the SHA-256 of the input bytes plus the tool name and its
+parameters, stored as files in one folder and evicted least-recently-used
+once their total size goes over a byte budget. The index is a small SQLite
+database so every gunicorn worker shares the same entries and counters.
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+
+HASH_CHUNK = 1024 * 1024
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def link_or_copy(src, dst):
+    """Hard-link `src` to `dst` (atomically replacing it), copying across filesystems."""
+    tmp = f'{dst}.{uuid.uuid4().hex[:8]}.tmp'
+    try:
+        os.link(src, tmp)
+    except OSError:
+        shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+class ResultCache:
+
+    def __init__(self, folder, max_bytes):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        os.makedirs(folder, exist_ok=True)
+        self.index_path = os.path.join(folder, 'index.db')
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, filename TEXT NOT NULL, '
+                'size INTEGER NOT NULL, last_used REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used)')
+            conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+
+    def _connect(self):
+        return sqlite3.connect(self.index_path, timeout=30)
+
+    @staticmethod
+    def make_key(tool, input_hashes, params=None):
+        blob = json.dumps([tool, list(input_hashes), params or {}], sort_keys=True)
+        return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+    def _count(self, conn, name):
+        conn.execute(
+            'INSERT INTO counters (name, value) VALUES (?, 1) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,)
+        )
+
+    def lookup(self, key, dest_path):
+        """Link the cached artifact for `key` to `dest_path`. Returns False on a miss."""
+        with self._connect() as conn:
+            row = conn.execute('SELECT filename FROM entries WHERE key = ?', (key,)).fetchone()
+            cached = os.path.join(self.folder, row[0]) if row else None
+            if cached and os.path.exists(cached):
+                link_or_copy(cached, dest_path)
+                conn.execute('UPDATE entries SET last_used = ? WHERE key = ?', (time.time(), key))
+                self._count(conn, 'hits')
+                return True
+            if row:
+                # File vanished behind our back
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self._count(conn, 'misses')
+            return False
+
+    def store(self, key, src_path):
+        size = os.path.getsize(src_path)
+        if size > self.max_bytes:
+            return
+        filename = key + os.path.splitext(src_path)[1].lower()
+        link_or_copy(src_path, os.path.join(self.folder, filename))
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO entries (key, filename, size, last_used) VALUES (?, ?, ?, ?)',
+                (key, filename, size, time.time())
+            )
+            self._evict(conn)
+
+    def _evict(self, conn):
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, filename, size in conn.execute(
+                'SELECT key, filename, size FROM entries ORDER BY last_used').fetchall():
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.folder, filename))
+            except FileNotFoundError:
+                pass
+            conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+            self._count(conn, 'evictions')
+            total -= size
+
+    def stats(self):
+        with self._connect() as conn:
+            counters = dict(conn.execute('SELECT name, value FROM counters').fetchall())
+            entries, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'evictions': counters.get('evictions', 0),
+            'hit_rate': round(hits / (hits + misses), 3) if hits + misses else 0.0,
+            'entries': entries,
+            'bytes': total,
+            'max_bytes': self.max_bytes,
+        }
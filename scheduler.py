@@ -0,0 +1,179 @@
+"""Bounded worker pools with FIFO queues, one pool per class of tool.
+
+Each gunicorn worker owns its own scheduler, so the effective limit of a pool
+is `workers x gunicorn workers`. Pool sizes can be overridden with
+POOL_<NAME>_WORKERS and POOL_<NAME>_QUEUE environment variables.
+"""
+import collections
+import importlib
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+
+class QueueFullError(Exception):
+    """Raised when a pool already holds as many waiting jobs as it allows."""
+
+    def __init__(self, pool, retry_after=30):
+        super().__init__(f"Queue '{pool}' is full")
+        self.pool = pool
+        self.retry_after = retry_after
+
+
+class WorkerPool:
+    """A fixed number of threads consuming a bounded FIFO queue of jobs."""
+
+    def __init__(self, name, workers, max_queue, on_queue_change=None):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self.on_queue_change = on_queue_change
+        self._queue = collections.deque()
+        self._cond = threading.Condition()
+        self._threads = []
+        self._active = 0
+
+    def is_full(self):
+        with self._cond:
+            return len(self._queue) >= self.max_queue
+
+    def submit(self, task_id, func, *args):
+        """Queue a job and return its 1-based position among the waiting jobs."""
+        with self._cond:
+            if len(self._queue) >= self.max_queue:
+                raise QueueFullError(self.name)
+            self._queue.append((task_id, func, args))
+            position = len(self._queue)
+            # Threads are started lazily so importing the app stays cheap
+            if len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f'pool-{self.name}-{len(self._threads)}', daemon=True)
+                self._threads.append(thread)
+                thread.start()
+            self._cond.notify()
+        return position
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue:
+                    self._cond.wait()
+                task_id, func, args = self._queue.popleft()
+                waiting = [job[0] for job in self._queue]
+                self._active += 1
+            if self.on_queue_change:
+                try:
+                    self.on_queue_change(task_id, waiting)
+                except Exception as e:
+                    print(f"Queue position update failed ({self.name}): {e}")
+            try:
+                func(*args)
+            except Exception as e:
+                print(f"Pool '{self.name}' job {task_id} crashed: {e}")
+            finally:
+                with self._cond:
+                    self._active -= 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                'workers': self.workers,
+                'active': self._active,
+                'queued': len(self._queue),
+                'max_queue': self.max_queue,
+            }
+
+
+class Scheduler:
+    """Routes jobs to named pools."""
+
+    def __init__(self, pools, on_queue_change=None):
+        self.pools = {}
+        for name, (workers, max_queue) in pools.items():
+            prefix = f'POOL_{name.upper()}_'
+            workers = int(os.environ.get(prefix + 'WORKERS', workers))
+            max_queue = int(os.environ.get(prefix + 'QUEUE', max_queue))
+            self.pools[name] = WorkerPool(name, workers, max_queue, on_queue_change)
+
+    def submit(self, pool, task_id, func, *args):
+        return self.pools[pool].submit(task_id, func, *args)
+
+    def is_full(self, pool):
+        return self.pools[pool].is_full()
+
+    def queued(self, pool):
+        """Number of jobs waiting in `pool`."""
+        return self.pools[pool].stats()['queued']
+
+    def stats(self):
+        return {name: pool.stats() for name, pool in self.pools.items()}
+
+
+def _warm_up(modules):
+    # Pay the heavy imports once per worker process instead of once per task
+    for name in modules:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+
+
+class ProcessPool:
+    """Lazily started pool of warm worker processes for CPU-bound Python work.
+
+    Jobs must be module-level functions with picklable arguments. Workers are
+    spawned (not forked) so they never inherit the threads, locks or database
+    connections of the gunicorn worker.
+    """
+
+    def __init__(self, workers, warm_modules=(), max_tasks_per_child=100):
+        self.workers = max(1, workers)
+        self.warm_modules = tuple(warm_modules)
+        self.max_tasks_per_child = max_tasks_per_child
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_warm_up,
+                    initargs=(self.warm_modules,),
+                    max_tasks_per_child=self.max_tasks_per_child,
+                )
+            return self._executor
+
+    def _discard(self, executor):
+        # A worker died (OOM, segfault in a native lib...): start a fresh pool next time
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise Exception("Le processus de traitement s'est arrêté de manière inattendue")
+
+    def run(self, func, *args, **kwargs):
+        """Run `func` in a worker process and wait for its result."""
+        executor = self.executor()
+        try:
+            return executor.submit(func, *args, **kwargs).result()
+        except BrokenProcessPool:
+            self._discard(executor)
+
+    def imap_unordered(self, func, jobs):
+        """Run `func(*args)` for every tuple in `jobs` and yield results as they complete.
+
+        Jobs not started yet are cancelled when the caller stops iterating.
+        """
+        executor = self.executor()
+        futures = [executor.submit(func, *args) for args in jobs]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        except BrokenProcessPool:
+            self._discard(executor)
+        finally:
+            for future in futures:
+                future.cancel()
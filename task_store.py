@@ -0,0 +1,377 @@
+"""Shared task registry so every gunicorn worker sees the same task state.
+
+The default backend is a SQLite database in WAL mode that lives next to the
+downloads. Setting TASK_STORE_URL=redis://host:port/db switches to any server
+that speaks the Redis protocol (redis, valkey, keydb, a local stand-in, ...).
+"""
+import abc
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import urlparse, unquote
+
+TERMINAL_STATES = ('completed', 'error', 'cancelled')
+
+# Finished tasks are forgotten after a day
+DEFAULT_TASK_TTL = 24 * 3600
+
+
+class TaskStore(abc.ABC):
+    """Common interface of the task backends.
+
+    Records are plain JSON-serialisable dicts. Anything that only makes sense
+    inside one process (Popen handles, threads...) must not be stored here.
+    Every update bumps a per-task version number that watchers compare against.
+    """
+
+    def __init__(self):
+        # Wakes local watchers as soon as this process updates a task
+        self._changed = threading.Condition()
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    @abc.abstractmethod
+    def create(self, task_id, record):
+        pass
+
+    @abc.abstractmethod
+    def get(self, task_id):
+        pass
+
+    @abc.abstractmethod
+    def update(self, task_id, **fields):
+        """Merge `fields` into the record. Returns False if the task does not exist."""
+
+    @abc.abstractmethod
+    def delete(self, task_id):
+        pass
+
+    @abc.abstractmethod
+    def get_versions(self, task_ids):
+        """Return {task_id: version} for the tasks that exist."""
+
+    def wait_for_changes(self, task_ids, versions, timeout=15.0, poll_interval=0.25):
+        """Block until one of `task_ids` moves past the version recorded in `versions`.
+
+        Returns {task_id: record} for changed tasks and {task_id: None} for
+        unknown ones, or {} on timeout. `versions` is updated in place.
+        Updates made by other workers are picked up by polling.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            current = self.get_versions(task_ids)
+            changes = {}
+            for task_id in task_ids:
+                if task_id not in current:
+                    changes[task_id] = None
+                elif current[task_id] != versions.get(task_id):
+                    record = self.get(task_id)
+                    versions[task_id] = current[task_id]
+                    changes[task_id] = record
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                return changes
+            with self._changed:
+                self._changed.wait(min(poll_interval, remaining))
+
+    @abc.abstractmethod
+    def cache_get(self, namespace, key):
+        """Small shared TTL cache next to the tasks (extractor results, probes...)."""
+
+    @abc.abstractmethod
+    def cache_set(self, namespace, key, value, ttl):
+        pass
+
+    def request_cancel(self, task_id):
+        """Flag a running task for cancellation. Returns False if it already finished."""
+        task = self.get(task_id)
+        if not task or task.get('status') in TERMINAL_STATES:
+            return False
+        self.update(task_id, cancel_event=True)
+        return True
+
+    def is_cancelled(self, task_id):
+        task = self.get(task_id)
+        return bool(task and task.get('cancel_event'))
+
+
+class SQLiteTaskStore(TaskStore):
+    """Task records stored as JSON rows in a WAL-mode SQLite file shared by all workers."""
+
+    def __init__(self, path, ttl=DEFAULT_TASK_TTL):
+        super().__init__()
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._creates = 0
+        conn = self._conn()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS tasks ('
+            'id TEXT PRIMARY KEY, data TEXT NOT NULL, '
+            'version INTEGER NOT NULL DEFAULT 0, updated REAL NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS tasks_updated ON tasks(updated)')
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS cache ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)'
+        )
+
+    def _conn(self):
+        # One connection per thread, reopened after a fork (gunicorn --preload)
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def create(self, task_id, record):
+        conn = self._conn()
+        conn.execute(
+            'INSERT OR REPLACE INTO tasks (id, data, version, updated) VALUES (?, ?, 0, ?)',
+            (task_id, json.dumps(record), time.time())
+        )
+        self._notify()
+        self._creates += 1
+        if self._creates % 100 == 1:
+            self.purge()
+
+    def get(self, task_id):
+        row = self._conn().execute('SELECT data FROM tasks WHERE id = ?', (task_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def update(self, task_id, **fields):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT data FROM tasks WHERE id = ?', (task_id,)).fetchone()
+            if row is None:
+                conn.execute('ROLLBACK')
+                return False
+            data = json.loads(row[0])
+            data.update(fields)
+            conn.execute(
+                'UPDATE tasks SET data = ?, version = version + 1, updated = ? WHERE id = ?',
+                (json.dumps(data), time.time(), task_id)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        self._notify()
+        return True
+
+    def delete(self, task_id):
+        self._conn().execute('DELETE FROM tasks WHERE id = ?', (task_id,))
+
+    def get_versions(self, task_ids):
+        task_ids = list(task_ids)
+        if not task_ids:
+            return {}
+        placeholders = ','.join('?' * len(task_ids))
+        rows = self._conn().execute(
+            f'SELECT id, version FROM tasks WHERE id IN ({placeholders})', task_ids
+        ).fetchall()
+        return dict(rows)
+
+    def cache_get(self, namespace, key):
+        row = self._conn().execute(
+            'SELECT value FROM cache WHERE key = ? AND expires > ?', (f'{namespace}:{key}', time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def cache_set(self, namespace, key, value, ttl):
+        self._conn().execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+            (f'{namespace}:{key}', json.dumps(value), time.time() + ttl)
+        )
+
+    def purge(self):
+        try:
+            now = time.time()
+            self._conn().execute('DELETE FROM tasks WHERE updated < ?', (now - self.ttl,))
+            self._conn().execute('DELETE FROM cache WHERE expires < ?', (now,))
+        except sqlite3.OperationalError as e:
+            print(f"Task store purge skipped: {e}")
+
+
+class RedisError(Exception):
+    pass
+
+
+class RedisTaskStore(TaskStore):
+    """Task records stored as Redis hashes, one JSON-encoded value per field.
+
+    Only a handful of commands are used (HSET, HGETALL, HGET, HINCRBY, EXISTS,
+    EXPIRE, DEL, GET, SET, WATCH, MULTI/EXEC) so the bundled RESP client works against any compatible server
+    without extra dependencies.
+    """
+
+    def __init__(self, url, ttl=DEFAULT_TASK_TTL):
+        super().__init__()
+        parsed = urlparse(url)
+        self.host = parsed.hostname or '127.0.0.1'
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip('/') or 0)
+        self.ttl = ttl
+        self._local = threading.local()
+
+    # --- minimal RESP client ---
+    def _sock(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None or self._local.pid != os.getpid():
+            sock = socket.create_connection((self.host, self.port), timeout=10)
+            self._local.sock = sock
+            self._local.reader = sock.makefile('rb')
+            self._local.pid = os.getpid()
+            if self.password:
+                self._send(('AUTH', self.password))
+            if self.db:
+                self._send(('SELECT', self.db))
+        return sock
+
+    @staticmethod
+    def _encode(args):
+        out = [b'*%d\r\n' % len(args)]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+            out.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+        return b''.join(out)
+
+    def _read_reply(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError('Connection closed by server')
+        kind, payload = line[:1], line[1:-2]
+        if kind == b'+':
+            return payload.decode()
+        if kind == b'-':
+            # Returned, not raised, so the rest of a pipeline is still consumed
+            return RedisError(payload.decode())
+        if kind == b':':
+            return int(payload)
+        if kind == b'$':
+            size = int(payload)
+            if size < 0:
+                return None
+            data = self._local.reader.read(size + 2)
+            return data[:-2]
+        if kind == b'*':
+            size = int(payload)
+            if size < 0:
+                return None
+            return [self._read_reply() for _ in range(size)]
+        raise RedisError(f'Unexpected reply: {line!r}')
+
+    def _send(self, *commands):
+        self._local.sock.sendall(b''.join(self._encode(c) for c in commands))
+        replies = [self._read_reply() for _ in commands]
+        for reply in replies:
+            for item in (reply if isinstance(reply, list) else [reply]):
+                if isinstance(item, RedisError):
+                    raise item
+        return replies
+
+    def _execute(self, *commands):
+        try:
+            self._sock()
+            return self._send(*commands)
+        except OSError:
+            # Drop the broken connection and retry once
+            self._local.sock = None
+            self._sock()
+            return self._send(*commands)
+
+    def _key(self, task_id):
+        return f'mediamaster:task:{task_id}'
+
+    def _hset_args(self, key, fields):
+        args = ['HSET', key]
+        for name, value in fields.items():
+            args += [name, json.dumps(value)]
+        return args
+
+    def create(self, task_id, record):
+        key = self._key(task_id)
+        self._execute(
+            ('MULTI',), ('DEL', key),
+            self._hset_args(key, record),
+            ('EXPIRE', key, self.ttl), ('EXEC',)
+        )
+        self._notify()
+
+    def get(self, task_id):
+        raw = self._execute(('HGETALL', self._key(task_id)))[0]
+        if not raw:
+            return None
+        record = {}
+        for name, value in zip(raw[::2], raw[1::2]):
+            name = name.decode()
+            if name.startswith('_'):
+                continue
+            record[name] = json.loads(value)
+        return record
+
+    def update(self, task_id, **fields):
+        key = self._key(task_id)
+        commands = [('MULTI',)]
+        if fields:
+            commands.append(self._hset_args(key, fields))
+        commands += [('HINCRBY', key, '_version', 1), ('EXPIRE', key, self.ttl), ('EXEC',)]
+        while True:
+            # EXEC is aborted if the task is written, deleted or expires after the WATCH,
+            # so a vanished task is never recreated as a partial hash
+            if not self._execute(('WATCH', key), ('EXISTS', key))[1]:
+                self._execute(('UNWATCH',))
+                return False
+            if self._execute(*commands)[-1] is not None:
+                break
+        self._notify()
+        return True
+
+    def delete(self, task_id):
+        self._execute(('DEL', self._key(task_id)))
+
+    def cache_get(self, namespace, key):
+        value = self._execute(('GET', f'mediamaster:cache:{namespace}:{key}'))[0]
+        return json.loads(value) if value is not None else None
+
+    def cache_set(self, namespace, key, value, ttl):
+        self._execute(('SET', f'mediamaster:cache:{namespace}:{key}', json.dumps(value), 'EX', max(1, int(ttl))))
+
+    def get_versions(self, task_ids):
+        task_ids = list(task_ids)
+        commands = []
+        for task_id in task_ids:
+            key = self._key(task_id)
+            commands += [('EXISTS', key), ('HGET', key, '_version')]
+        if not commands:
+            return {}
+        replies = self._execute(*commands)
+        versions = {}
+        for task_id, exists, version in zip(task_ids, replies[::2], replies[1::2]):
+            if exists:
+                versions[task_id] = int(version or 0)
+        return versions
+
+
+def create_task_store(folder):
+    """Build the store selected by TASK_STORE_URL (defaults to SQLite inside `folder`)."""
+    url = os.environ.get('TASK_STORE_URL', '').strip()
+    ttl = int(os.environ.get('TASK_TTL', DEFAULT_TASK_TTL))
+    if url.startswith('redis://'):
+        return RedisTaskStore(url, ttl=ttl)
+    if url.startswith('sqlite:///'):
+        return SQLiteTaskStore(url[len('sqlite:///'):], ttl=ttl)
+    if url:
+        raise ValueError(f'Unsupported TASK_STORE_URL: {url}')
+    return SQLiteTaskStore(os.path.join(folder, 'tasks.db'), ttl=ttl)
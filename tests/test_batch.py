@@ -0,0 +1,139 @@
+import io
+import os
+import time
+import zipfile
+
+import pytest
+
+pikepdf = pytest.importorskip('pikepdf')
+from PIL import Image
+
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    for name in ('flask', 'flask_cors', 'numpy', 'yt_dlp', 'gtts'):
+        pytest.importorskip(name)
+    # Downloads and task state go next to the working directory
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('app'))
+    try:
+        import app
+    finally:
+        os.chdir(cwd)
+    app.app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+def pdf_bytes(pages):
+    pdf = pikepdf.new()
+    for _ in range(pages):
+        pdf.add_blank_page()
+    buffer = io.BytesIO()
+    pdf.save(buffer)
+    return buffer.getvalue()
+
+
+def png_bytes(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def run_batch(client, tool, files, **fields):
+    response = client.post(f'/api/batch/{tool}', content_type='multipart/form-data',
+                           data=dict(fields, **{'files[]': [(io.BytesIO(data), name) for name, data in files]}))
+    assert response.status_code == 200, response.get_json()
+    task_id = response.get_json()['task_id']
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        task = client.get(f'/api/download/status/{task_id}').get_json()
+        if task['status'] in ('completed', 'error', 'cancelled'):
+            return task
+        time.sleep(0.1)
+    pytest.fail(f'batch {tool} did not finish')
+
+
+def download_zip(client, task):
+    response = client.get(task['result']['download_url'])
+    assert response.status_code == 200
+    return zipfile.ZipFile(io.BytesIO(response.get_data()))
+
+
+def test_batch_lock_pdf(client):
+    task = run_batch(client, 'lock-pdf', [('a.pdf', pdf_bytes(1)), ('b.pdf', pdf_bytes(3)), ('a.pdf', pdf_bytes(2))],
+                     password='secret')
+    assert task['status'] == 'completed', task
+    assert (task['children_done'], task['children_failed']) == (3, 0)
+    assert [child['status'] for child in task['children']] == ['completed'] * 3
+
+    archive = download_zip(client, task)
+    assert archive.namelist() == ['a.pdf', 'b.pdf', 'a (2).pdf']
+    for name, pages in zip(archive.namelist(), (1, 3, 2)):
+        with pytest.raises(pikepdf.PasswordError):
+            pikepdf.open(io.BytesIO(archive.read(name)))
+        with pikepdf.open(io.BytesIO(archive.read(name)), password='secret') as pdf:
+            assert len(pdf.pages) == pages
+
+
+def test_batch_convert_image(client):
+    task = run_batch(client, 'convert-image', [('red.png', png_bytes('red')), ('blue.png', png_bytes('blue'))],
+                     format='jpg')
+    assert task['status'] == 'completed', task
+    archive = download_zip(client, task)
+    assert archive.namelist() == ['red.jpg', 'blue.jpg']
+    with Image.open(io.BytesIO(archive.read('blue.jpg'))) as image:
+        assert image.format == 'JPEG' and image.size == (64, 48)
+
+
+def test_batch_extract_pages(client):
+    task = run_batch(client, 'extract-pages', [('a.pdf', pdf_bytes(4)), ('b.pdf', pdf_bytes(3))], pages='1,3')
+    assert task['status'] == 'completed', task
+    archive = download_zip(client, task)
+    assert archive.namelist() == ['a.pdf', 'b.pdf']
+    for name in archive.namelist():
+        with pikepdf.open(io.BytesIO(archive.read(name))) as pdf:
+            assert len(pdf.pages) == 2
+
+
+@pytest.mark.parametrize('tool, fields', [
+    ('extract-pages', {'pages': '3-1'}),
+    ('pdf-to-images', {'format': 'svg'}),
+    ('convert-video', {'format': 'xyz'}),
+    ('remove-background', {'model': 'nope'}),
+    ('remove-watermark', {}),
+])
+def test_batch_rejects_bad_params(client, tool, fields):
+    response = client.post(f'/api/batch/{tool}', content_type='multipart/form-data',
+                           data=dict(fields, **{'files[]': [(io.BytesIO(b'x'), 'a.bin')]}))
+    assert response.status_code == 400
+
+
+def test_pdf_to_images_failure_removes_files(app_module, monkeypatch):
+    class FailingResults:
+        def __iter__(self):
+            yield [(0, b'page')]
+            raise RuntimeError('render failed')
+
+        def close(self):
+            pass
+
+    monkeypatch.setattr(app_module.cpu_pool, 'imap_unordered', lambda func, jobs: FailingResults())
+    input_path = os.path.join(app_module.DOWNLOAD_FOLDER, 'render_in.pdf')
+    with open(input_path, 'wb') as f:
+        f.write(pdf_bytes(2))
+    app_module.task_store.create('render-task', {'status': 'processing', 'progress': 0})
+    with pytest.raises(RuntimeError):
+        app_module.pdf_to_images_task('render-task', input_path, 'render_images.zip')
+    assert not os.path.exists(input_path)
+    assert not os.path.exists(os.path.join(app_module.DOWNLOAD_FOLDER, 'render_images.zip'))
+
+
+@pytest.mark.parametrize('values', [['nan', 0, 10, 10], [0, 0, 'inf', 10], [0, '-inf', 10, 10]])
+def test_watermark_box_rejects_non_finite(app_module, values):
+    with pytest.raises(ValueError):
+        app_module.watermark_box(values)
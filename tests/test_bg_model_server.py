@@ -0,0 +1,127 @@
+import io
+import struct
+import threading
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+import bg_model_server
+from bg_model_server import MODEL_SIZE, Model, Server, read_message, write_message
+
+
+def test_message_round_trip():
+    buffer = io.BytesIO()
+    write_message(buffer, {'op': 'remove', 'model': 'u2net'}, b'\x00\x01\x02')
+    write_message(buffer, {'ok': True})
+    buffer.seek(0)
+    assert read_message(buffer) == ({'op': 'remove', 'model': 'u2net', 'length': 3}, b'\x00\x01\x02')
+    assert read_message(buffer) == ({'ok': True, 'length': 0}, b'')
+    # End of stream, then a truncated length prefix
+    assert read_message(buffer) == (None, None)
+    assert read_message(io.BytesIO(b'\x00\x00')) == (None, None)
+
+
+def test_message_layout():
+    buffer = io.BytesIO()
+    write_message(buffer, {'ok': False, 'error': 'é'})
+    raw = buffer.getvalue()
+    size = struct.unpack('>I', raw[:4])[0]
+    assert size == len(raw) - 4
+    assert raw[4:].decode('utf-8').startswith('{')
+
+
+class StubSession:
+    """Returns each image's mean channel as the prediction, keeping what it was given."""
+
+    def __init__(self):
+        self.inputs = []
+
+    def run(self, outputs, feeds):
+        x = feeds['input']
+        self.inputs.append(x)
+        return [x.mean(axis=1, keepdims=True)]
+
+
+def stub_model():
+    model = Model.__new__(Model)
+    model.session = StubSession()
+    model.input_name = 'input'
+    return model
+
+
+def test_predict_normalises_each_image():
+    model = stub_model()
+    dark = np.full((MODEL_SIZE, MODEL_SIZE, 3), 50, dtype=np.uint8)
+    dark[0, 0] = 100
+    bright = np.zeros((MODEL_SIZE, MODEL_SIZE, 3), dtype=np.uint8)
+    bright[:, :MODEL_SIZE // 2] = 255
+    masks = model.predict([dark, bright])
+
+    (x,) = model.session.inputs
+    assert x.shape == (2, 3, MODEL_SIZE, MODEL_SIZE) and x.dtype == np.float32
+    assert x.flags['C_CONTIGUOUS']
+    # Scaled by each image's own brightest pixel before mean/std
+    expected = (np.array([1.0, 1.0, 1.0]) - bg_model_server.MEAN) / bg_model_server.STD
+    assert np.allclose(x[0, :, 0, 0], expected, atol=1e-5)
+    assert np.allclose(x[1, :, 0, 0], expected, atol=1e-5)
+    assert np.allclose(x[0, :, 1, 1], (0.5 - bg_model_server.MEAN) / bg_model_server.STD, atol=1e-5)
+
+    # Predictions are stretched to 0..255 per image
+    assert masks.shape == (2, MODEL_SIZE, MODEL_SIZE) and masks.dtype == np.uint8
+    assert masks[0, 0, 0] == 255 and masks[0, 1, 1] == 0
+    assert masks[1, 0, 0] == 255 and masks[1, 0, -1] == 0
+
+
+def stub_server(monkeypatch, load):
+    monkeypatch.setattr(bg_model_server, 'Model', load)
+    server = Server.__new__(Server)
+    server.threads, server.max_batch, server.window = 1, 8, 0
+    server.models = {}
+    server.models_lock = threading.Lock()
+    return server
+
+
+def test_model_loads_outside_the_lock(monkeypatch):
+    release = threading.Event()
+    loads = []
+
+    def load(name, *args):
+        loads.append(name)
+        if name == 'u2net':
+            release.wait(5)
+        return name
+
+    server = stub_server(monkeypatch, load)
+    assert server.model('u2netp') == 'u2netp'
+    waiting = [threading.Thread(target=server.model, args=('u2net',)) for _ in range(3)]
+    for thread in waiting:
+        thread.start()
+    time.sleep(0.1)
+    # A slow load does not hold up models that are ready
+    started = time.monotonic()
+    assert server.model('u2netp') == 'u2netp'
+    assert time.monotonic() - started < 1
+    release.set()
+    for thread in waiting:
+        thread.join(5)
+    assert server.model('u2net') == 'u2net'
+    assert sorted(loads) == ['u2net', 'u2netp']
+
+
+def test_failed_load_is_retried(monkeypatch):
+    attempts = []
+
+    def load(name, *args):
+        attempts.append(name)
+        if len(attempts) == 1:
+            raise RuntimeError('download failed')
+        return name
+
+    server = stub_server(monkeypatch, load)
+    with pytest.raises(RuntimeError):
+        server.model('silueta')
+    assert server.model('silueta') == 'silueta'
+    with pytest.raises(ValueError):
+        server.model('unknown')
@@ -0,0 +1,73 @@
+import pytest
+
+flask = pytest.importorskip('flask')
+
+from file_serving import send_result_file
+
+CONTENT = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def client(tmp_path):
+    (tmp_path / 'result.pdf').write_bytes(CONTENT)
+    app = flask.Flask(__name__)
+
+    @app.route('/download/<path:filename>')
+    def download(filename):
+        return send_result_file(str(tmp_path), filename) or ('Not found', 404)
+
+    return app.test_client()
+
+
+def test_full_download(client):
+    response = client.get('/download/result.pdf')
+    assert response.status_code == 200
+    assert response.data == CONTENT
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Content-Length'] == str(len(CONTENT))
+    assert 'attachment; filename="result.pdf"' == response.headers['Content-Disposition']
+
+
+def test_missing_and_unsafe_paths(client):
+    assert client.get('/download/nothing.pdf').status_code == 404
+    assert client.get('/download/../result.pdf').status_code == 404
+
+
+def test_etag_revalidation(client):
+    etag = client.get('/download/result.pdf').headers['ETag']
+    response = client.get('/download/result.pdf', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert client.get('/download/result.pdf', headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+def test_single_range(client):
+    response = client.get('/download/result.pdf', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.data == CONTENT[100:200]
+    assert response.headers['Content-Range'] == f'bytes 100-199/{len(CONTENT)}'
+    assert response.headers['Content-Length'] == '100'
+
+    suffix = client.get('/download/result.pdf', headers={'Range': 'bytes=-24'})
+    assert suffix.status_code == 206
+    assert suffix.data == CONTENT[-24:]
+
+
+def test_unsatisfiable_range(client):
+    response = client.get('/download/result.pdf', headers={'Range': f'bytes={len(CONTENT) + 10}-'})
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(CONTENT)}'
+
+
+def test_multiple_ranges_get_the_whole_file(client):
+    response = client.get('/download/result.pdf', headers={'Range': 'bytes=0-9,20-29'})
+    assert response.status_code == 200
+    assert response.data == CONTENT
+
+
+def test_if_range(client):
+    etag = client.get('/download/result.pdf').headers['ETag']
+    fresh = client.get('/download/result.pdf', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert fresh.status_code == 206 and fresh.data == CONTENT[:10]
+    stale = client.get('/download/result.pdf', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert stale.status_code == 200 and stale.data == CONTENT
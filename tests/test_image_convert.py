@@ -0,0 +1,67 @@
+import io
+
+import pytest
+from PIL import Image
+
+from image_convert import convert_image, convert_options
+
+
+def gradient(mode, size=(300, 200), high=65535):
+    im = Image.new(mode, size)
+    im.putdata([x * high / (size[0] - 1) for x in range(size[0])] * size[1])
+    return im
+
+
+def save(im, fmt):
+    buffer = io.BytesIO()
+    im.save(buffer, format=fmt)
+    buffer.seek(0)
+    return buffer
+
+
+def convert(source, target_format, **kwargs):
+    out = io.BytesIO()
+    convert_image(source, out, convert_options(target_format, **kwargs))
+    out.seek(0)
+    return Image.open(out)
+
+
+@pytest.mark.parametrize('target_format', ['png', 'jpg', 'webp', 'tiff'])
+def test_16bit_png_resized(target_format):
+    source = save(gradient('I;16'), 'PNG')
+    with convert(source, target_format, max_size=150) as result:
+        assert result.size == (150, 100)
+        # Scaled down to 8 bits, not clipped to white
+        low, high = result.convert('L').getextrema()
+        assert low < 10 and high > 245
+
+
+def test_16bit_png_kept_deep():
+    source = save(gradient('I;16'), 'PNG')
+    with convert(source, 'png') as result:
+        assert result.mode in ('I', 'I;16')
+        assert result.getextrema()[1] > 255
+
+
+@pytest.mark.parametrize('mode', ['I;16', 'I'])
+def test_deep_to_ico(mode):
+    source = save(gradient(mode, size=(512, 512)), 'PNG' if mode == 'I;16' else 'TIFF')
+    with convert(source, 'ico') as result:
+        assert result.format == 'ICO'
+        assert max(result.size) == 256
+
+
+@pytest.mark.parametrize('high', [1.0, 1000.0])
+def test_float_tiff_to_png(high):
+    source = save(gradient('F', high=high), 'TIFF')
+    with convert(source, 'png') as result:
+        assert result.mode == 'L'
+        low, top = result.getextrema()
+        assert low == 0 and top == 255
+
+
+def test_float_tiff_resized_to_jpeg():
+    source = save(gradient('F', high=1.0), 'TIFF')
+    with convert(source, 'jpg', max_size=100) as result:
+        assert result.size == (100, 67)
+        assert result.mode == 'L'
@@ -0,0 +1,43 @@
+import pytest
+
+pikepdf = pytest.importorskip('pikepdf')
+
+from pdf_compress import KEEP_INFO, rewrite, strip_metadata
+
+
+def make_pdf(path):
+    pdf = pikepdf.new()
+    pdf.add_blank_page()
+    pdf.pages[0].obj.PieceInfo = pikepdf.Dictionary()
+    with pdf.open_metadata() as meta:
+        meta['dc:title'] = 'Rapport'
+    pdf.docinfo['/Title'] = 'Rapport'
+    pdf.docinfo['/Author'] = 'Marie'
+    pdf.docinfo['/Producer'] = 'Editor 1.0'
+    pdf.docinfo['/Creator'] = 'Editor'
+    pdf.save(path)
+    return str(path)
+
+
+def test_strip_metadata_keeps_title_and_author(tmp_path):
+    with pikepdf.open(make_pdf(tmp_path / 'in.pdf')) as pdf:
+        strip_metadata(pdf)
+        assert '/Metadata' not in pdf.Root
+        assert '/PieceInfo' not in pdf.pages[0].obj
+        assert sorted(pdf.trailer.Info.keys()) == sorted(KEEP_INFO)
+        assert str(pdf.trailer.Info.Title) == 'Rapport'
+
+
+def test_strip_metadata_everything(tmp_path):
+    with pikepdf.open(make_pdf(tmp_path / 'in.pdf')) as pdf:
+        strip_metadata(pdf, keep=())
+        assert '/Info' not in pdf.trailer
+
+
+def test_rewrite_without_images(tmp_path):
+    output = tmp_path / 'out.pdf'
+    rewrite(make_pdf(tmp_path / 'in.pdf'), str(output), [])
+    with pikepdf.open(output) as pdf:
+        assert len(pdf.pages) == 1
+        assert str(pdf.docinfo['/Author']) == 'Marie'
+        assert '/Producer' not in pdf.docinfo
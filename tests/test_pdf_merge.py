@@ -0,0 +1,41 @@
+import os
+
+import pytest
+
+pikepdf = pytest.importorskip('pikepdf')
+
+import pdf_merge
+from pdf_merge import merge_pdfs
+
+
+def make_pdf(path, pages, title):
+    pdf = pikepdf.new()
+    for _ in range(pages):
+        pdf.add_blank_page()
+    with pdf.open_outline() as outline:
+        outline.root.append(pikepdf.OutlineItem(title, pages - 1))
+    pdf.save(path)
+    return str(path)
+
+
+@pytest.mark.parametrize('stage_bytes', [pdf_merge.MERGE_STAGE_BYTES, 0])
+def test_merge_pages_and_outline(tmp_path, monkeypatch, stage_bytes):
+    monkeypatch.setattr(pdf_merge, 'MERGE_STAGE_BYTES', stage_bytes)
+    inputs = [(make_pdf(tmp_path / f'{i}.pdf', 3, f'doc {i}'), None) for i in range(4)]
+    output = tmp_path / 'out.pdf'
+    summary = merge_pdfs(inputs, str(output))
+    assert summary['pages'] == 12
+    assert summary['stages'] == (3 if stage_bytes == 0 else 0)
+    assert sorted(os.listdir(tmp_path)) == ['0.pdf', '1.pdf', '2.pdf', '3.pdf', 'out.pdf']
+    with pikepdf.open(output) as pdf, pdf.open_outline() as outline:
+        assert len(pdf.pages) == 12
+        pages = [pikepdf.Page(item.destination[0]).index for item in outline.root]
+        assert [item.title for item in outline.root] == [f'doc {i}' for i in range(4)]
+        assert pages == [2, 5, 8, 11]
+
+
+def test_merge_page_selection_and_cancel(tmp_path):
+    inputs = [(make_pdf(tmp_path / 'a.pdf', 5, 'a'), [0, 4, 9])]
+    summary = merge_pdfs(inputs, str(tmp_path / 'out.pdf'))
+    assert summary['pages'] == 2
+    assert merge_pdfs(inputs, str(tmp_path / 'cancelled.pdf'), should_cancel=lambda: True) is None
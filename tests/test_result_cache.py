@@ -0,0 +1,71 @@
+import itertools
+import os
+import types
+
+import pytest
+
+import result_cache
+from result_cache import ResultCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Distinct, increasing last_used stamps
+    ticks = itertools.count(1000)
+    monkeypatch.setattr(result_cache, 'time', types.SimpleNamespace(time=lambda: next(ticks)))
+
+
+def artifact(folder, name, size):
+    path = os.path.join(folder, name)
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return path
+
+
+def test_make_key():
+    key = ResultCache.make_key('compress_pdf', ['abc'], {'level': 'high', 'codec': 'jpeg'})
+    assert key == ResultCache.make_key('compress_pdf', ['abc'], {'codec': 'jpeg', 'level': 'high'})
+    assert key != ResultCache.make_key('compress_pdf', ['abc'], {'level': 'low', 'codec': 'jpeg'})
+    assert key != ResultCache.make_key('compress_pdf', ['abd'], {'level': 'high', 'codec': 'jpeg'})
+
+
+def test_lookup_hit_and_miss(tmp_path, clock):
+    cache = ResultCache(str(tmp_path / 'cache'), max_bytes=100)
+    cache.store('k1', artifact(tmp_path, 'a.pdf', 10))
+    assert cache.lookup('k1', str(tmp_path / 'copy.pdf'))
+    assert (tmp_path / 'copy.pdf').read_bytes() == b'x' * 10
+    assert not cache.lookup('k2', str(tmp_path / 'other.pdf'))
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries'], stats['bytes']) == (1, 1, 1, 10)
+
+
+def test_least_recently_used_are_evicted(tmp_path, clock):
+    folder = str(tmp_path / 'cache')
+    cache = ResultCache(folder, max_bytes=25)
+    for key in ('k1', 'k2'):
+        cache.store(key, artifact(tmp_path, f'{key}.pdf', 10))
+    # k1 is used again, so k2 is now the oldest
+    assert cache.lookup('k1', str(tmp_path / 'out.pdf'))
+    cache.store('k3', artifact(tmp_path, 'k3.pdf', 10))
+
+    assert not cache.lookup('k2', str(tmp_path / 'out2.pdf'))
+    assert cache.lookup('k1', str(tmp_path / 'out1.pdf'))
+    assert cache.lookup('k3', str(tmp_path / 'out3.pdf'))
+    assert not os.path.exists(os.path.join(folder, 'k2.pdf'))
+    stats = cache.stats()
+    assert (stats['evictions'], stats['entries'], stats['bytes']) == (1, 2, 20)
+
+
+def test_oversized_results_are_not_stored(tmp_path, clock):
+    cache = ResultCache(str(tmp_path / 'cache'), max_bytes=5)
+    cache.store('big', artifact(tmp_path, 'big.pdf', 10))
+    assert cache.stats()['entries'] == 0
+
+
+def test_vanished_file_is_a_miss(tmp_path, clock):
+    folder = str(tmp_path / 'cache')
+    cache = ResultCache(folder, max_bytes=100)
+    cache.store('k1', artifact(tmp_path, 'a.pdf', 10))
+    os.remove(os.path.join(folder, 'k1.pdf'))
+    assert not cache.lookup('k1', str(tmp_path / 'out.pdf'))
+    assert cache.stats()['entries'] == 0
@@ -0,0 +1,64 @@
+import threading
+
+import pytest
+
+from scheduler import QueueFullError, Scheduler, WorkerPool
+
+
+def blocked_pool(workers, max_queue, on_queue_change=None):
+    """Pool whose workers are all busy until the returned event is set."""
+    release = threading.Event()
+    started = threading.Semaphore(0)
+    pool = WorkerPool('test', workers, max_queue, on_queue_change)
+
+    def hold():
+        started.release()
+        release.wait(5)
+
+    for i in range(workers):
+        pool.submit(f'busy{i}', hold)
+        assert started.acquire(timeout=5)
+    return pool, release
+
+
+def test_queue_limit():
+    pool, release = blocked_pool(workers=2, max_queue=3)
+    try:
+        assert [pool.submit(f'job{i}', lambda: None) for i in range(3)] == [1, 2, 3]
+        assert pool.is_full()
+        with pytest.raises(QueueFullError) as error:
+            pool.submit('job3', lambda: None)
+        assert error.value.pool == 'test'
+        assert pool.stats() == {'workers': 2, 'active': 2, 'queued': 3, 'max_queue': 3}
+    finally:
+        release.set()
+
+
+def test_zero_queue_rejects_everything():
+    pool = WorkerPool('none', 1, 0)
+    assert pool.is_full()
+    with pytest.raises(QueueFullError):
+        pool.submit('job', lambda: None)
+
+
+def test_queue_positions_are_published():
+    seen = []
+    done = threading.Event()
+    pool, release = blocked_pool(workers=1, max_queue=5, on_queue_change=lambda started, waiting: seen.append(
+        (started, waiting)))
+    pool.submit('a', lambda: None)
+    pool.submit('b', done.set)
+    release.set()
+    assert done.wait(5)
+    assert seen[-2:] == [('a', ['b']), ('b', [])]
+
+
+def test_environment_overrides(monkeypatch):
+    monkeypatch.setenv('POOL_PDF_WORKERS', '3')
+    monkeypatch.setenv('POOL_PDF_QUEUE', '7')
+    scheduler = Scheduler({'pdf': (1, 2), 'image': (4, 5)})
+    assert scheduler.stats()['pdf']['workers'] == 3
+    assert scheduler.stats()['pdf']['max_queue'] == 7
+    assert scheduler.stats()['image']['max_queue'] == 5
+    assert not scheduler.is_full('image')
+    assert scheduler.queued('image') == 0
@@ -0,0 +1,181 @@
+import threading
+import time
+
+import pytest
+
+from task_store import RedisTaskStore, SQLiteTaskStore, TaskStore
+
+
+class FakeRedis:
+    """In-memory stand-in for the few commands RedisTaskStore sends, including WATCH/MULTI/EXEC."""
+
+    def __init__(self):
+        self.data = {}
+        self.dirty = set()
+        self.watching = None
+        self.queued = None
+        self.before_exec = None  # runs as if another client wrote between WATCH and EXEC
+
+    def execute(self, *commands):
+        return [self.command(*command) for command in commands]
+
+    def command(self, name, *args):
+        if self.queued is not None and name != 'EXEC':
+            self.queued.append((name, args))
+            return 'QUEUED'
+        if name == 'MULTI':
+            self.queued = []
+            return 'OK'
+        if name == 'EXEC':
+            queued, self.queued = self.queued, None
+            if self.before_exec:
+                hook, self.before_exec = self.before_exec, None
+                hook()
+            aborted = self.watching in self.dirty
+            self.watching = None
+            return None if aborted else [self.command(n, *a) for n, a in queued]
+        if name == 'WATCH':
+            self.watching = args[0]
+            self.dirty.discard(args[0])
+            return 'OK'
+        if name == 'UNWATCH':
+            self.watching = None
+            return 'OK'
+        return getattr(self, 'cmd_' + name.lower())(*args)
+
+    @staticmethod
+    def _bytes(value):
+        return value if isinstance(value, bytes) else str(value).encode('utf-8')
+
+    def cmd_exists(self, key):
+        return int(key in self.data)
+
+    def cmd_del(self, key):
+        self.dirty.add(key)
+        return int(self.data.pop(key, None) is not None)
+
+    def cmd_hset(self, key, *pairs):
+        self.dirty.add(key)
+        fields = self.data.setdefault(key, {})
+        for name, value in zip(pairs[::2], pairs[1::2]):
+            fields[name] = self._bytes(value)
+        return len(pairs) // 2
+
+    def cmd_hgetall(self, key):
+        return [item for name, value in self.data.get(key, {}).items() for item in (self._bytes(name), value)]
+
+    def cmd_hget(self, key, name):
+        return self.data.get(key, {}).get(name)
+
+    def cmd_hincrby(self, key, name, amount):
+        self.dirty.add(key)
+        fields = self.data.setdefault(key, {})
+        fields[name] = self._bytes(int(fields.get(name, 0)) + int(amount))
+        return int(fields[name])
+
+    def cmd_expire(self, key, ttl):
+        return int(key in self.data)
+
+    def cmd_get(self, key):
+        return self.data.get(key)
+
+    def cmd_set(self, key, value, *options):
+        self.data[key] = self._bytes(value)
+        return 'OK'
+
+
+def redis_store():
+    store = RedisTaskStore('redis://127.0.0.1:6379/0')
+    store.fake = FakeRedis()
+    store._execute = store.fake.execute
+    return store
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def store(request, tmp_path):
+    if request.param == 'sqlite':
+        return SQLiteTaskStore(str(tmp_path / 'tasks.db'))
+    return redis_store()
+
+
+def test_interface_is_abstract():
+    with pytest.raises(TypeError):
+        TaskStore()
+
+
+def test_create_get_update(store):
+    assert store.get('missing') is None
+    store.create('t1', {'status': 'pending', 'progress': 0})
+    assert store.get('t1') == {'status': 'pending', 'progress': 0}
+    assert store.update('t1', status='processing', progress=10, files=['a.pdf'])
+    assert store.get('t1') == {'status': 'processing', 'progress': 10, 'files': ['a.pdf']}
+    assert store.update('missing', status='error') is False
+    assert store.get('missing') is None
+    store.delete('t1')
+    assert store.get('t1') is None
+
+
+def test_versions(store):
+    store.create('t1', {'status': 'pending'})
+    store.create('t2', {'status': 'pending'})
+    before = store.get_versions(['t1', 't2', 'missing'])
+    assert set(before) == {'t1', 't2'}
+    store.update('t1', progress=50)
+    store.update('t1', progress=60)
+    after = store.get_versions(['t1', 't2'])
+    assert after['t1'] == before['t1'] + 2
+    assert after['t2'] == before['t2']
+    assert store.get_versions([]) == {}
+
+
+def test_wait_for_changes(store):
+    store.create('t1', {'status': 'pending'})
+    versions = store.get_versions(['t1'])
+    # Nothing changes: empty result on timeout
+    assert store.wait_for_changes(['t1'], versions, timeout=0.1, poll_interval=0.02) == {}
+    # An unknown id is reported at once as None
+    started = time.monotonic()
+    assert store.wait_for_changes(['t1', 'gone'], versions, timeout=5) == {'gone': None}
+    assert time.monotonic() - started < 1
+
+    threading.Timer(0.1, store.update, args=('t1',), kwargs={'status': 'completed'}).start()
+    changes = store.wait_for_changes(['t1'], versions, timeout=5, poll_interval=0.02)
+    assert changes == {'t1': {'status': 'completed'}}
+    assert versions['t1'] == store.get_versions(['t1'])['t1']
+
+
+def test_cancel(store):
+    store.create('t1', {'status': 'processing'})
+    assert not store.is_cancelled('t1')
+    assert store.request_cancel('t1')
+    assert store.is_cancelled('t1')
+    store.update('t1', status='cancelled')
+    assert store.request_cancel('t1') is False
+    assert store.request_cancel('missing') is False
+
+
+def test_cache(store):
+    assert store.cache_get('probe', 'k') is None
+    store.cache_set('probe', 'k', {'duration': 1.5}, ttl=60)
+    assert store.cache_get('probe', 'k') == {'duration': 1.5}
+
+
+def test_redis_update_does_not_recreate_a_deleted_task():
+    store = redis_store()
+    store.create('t1', {'status': 'processing'})
+    key = store._key('t1')
+    store.fake.before_exec = lambda: store.fake.cmd_del(key)
+    assert store.update('t1', progress=90) is False
+    assert key not in store.fake.data
+    assert store.fake.watching is None
+
+
+def test_redis_update_retries_after_a_concurrent_write():
+    store = redis_store()
+    store.create('t1', {'status': 'processing'})
+    version = store.get_versions(['t1'])['t1']
+    key = store._key('t1')
+    store.fake.before_exec = lambda: store.fake.cmd_hset(key, 'files_done', '3')
+    assert store.update('t1', progress=90)
+    assert store.get('t1') == {'status': 'processing', 'files_done': 3, 'progress': 90}
+    assert store.get_versions(['t1'])['t1'] == version + 1
@@ -0,0 +1,114 @@
+import shutil
+import subprocess
+import time
+
+import pytest
+
+import video_encoder
+from media_probe import FFmpegError, find_binary, first_stream, probe, run_ffmpeg
+from video_encoder import encode_segmented, keyframe_times, plan_segments, target_video_bitrate
+
+FPS = 30
+DURATION = 6
+
+needs_ffmpeg = pytest.mark.skipif(
+    not (shutil.which(find_binary('ffmpeg')) and shutil.which(find_binary('ffprobe'))),
+    reason='ffmpeg/ffprobe not installed')
+
+
+def test_target_video_bitrate():
+    assert target_video_bitrate(10 * 1024 * 1024, 0, 128_000) is None
+    assert target_video_bitrate(1024, 600, 128_000) is None
+    assert 2_000_000 < target_video_bitrate(50 * 1024 * 1024, 120, 128_000) < 3_500_000
+
+
+def test_plan_segments():
+    assert plan_segments([0.0, 2.0, 4.1, 6.0, 8.0], 10.0, 3) == [(0.0, 4.1), (4.1, 6.0), (6.0, 10.0)]
+    # Without usable keyframes the whole input is one segment
+    assert plan_segments([], 10.0, 4) == [(0.0, 10.0)]
+    assert plan_segments([0.0], 10.0, 4) == [(0.0, 10.0)]
+
+
+def fake_ffmpeg(outcomes, stopped):
+    """run_ffmpeg stand-in: the job writing to a key of `outcomes` ends with that outcome, the others
+    run until cancelled and are recorded in `stopped`."""
+    def run(args, duration=0, on_progress=None, should_cancel=None):
+        output = args[-1]
+        for key, outcome in outcomes.items():
+            if key in output:
+                time.sleep(0.05)
+                if isinstance(outcome, Exception):
+                    raise outcome
+                return outcome
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            if should_cancel and should_cancel():
+                stopped.append(output)
+                return False
+            time.sleep(0.01)
+        return True
+    return run
+
+
+@pytest.mark.parametrize('outcome', [FFmpegError('broken'), False])
+def test_segment_failure_stops_the_others(monkeypatch, tmp_path, outcome):
+    stopped = []
+    # The last segment fails while the earlier ones are still encoding
+    monkeypatch.setattr(video_encoder, 'run_ffmpeg', fake_ffmpeg({'seg002': outcome}, stopped))
+    started = time.monotonic()
+    segments = [(0, 10), (10, 20), (20, 30)]
+    if isinstance(outcome, Exception):
+        with pytest.raises(FFmpegError):
+            encode_segmented('in.mp4', 'out.mp4', segments, [], ['-c:a', 'aac'], str(tmp_path))
+    else:
+        assert encode_segmented('in.mp4', 'out.mp4', segments, [], ['-c:a', 'aac'], str(tmp_path)) is False
+    assert time.monotonic() - started < 5
+    assert sorted(path.rsplit('/', 1)[-1] for path in stopped) == ['audio.m4a', 'seg000.ts', 'seg001.ts']
+
+
+@pytest.fixture(scope='module')
+def sample(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('video') / 'sample.mp4')
+    run_ffmpeg(['-f', 'lavfi', '-i', f'testsrc2=size=320x240:rate={FPS}:duration={DURATION}',
+                '-f', 'lavfi', '-i', f'sine=frequency=440:duration={DURATION}',
+                '-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(FPS), '-keyint_min', str(FPS),
+                '-sc_threshold', '0', '-c:a', 'aac', '-shortest', path])
+    return path
+
+
+def packet_times(path, stream):
+    cmd = [find_binary('ffprobe'), '-v', 'error', '-select_streams', stream,
+           '-show_entries', 'packet=pts_time', '-of', 'csv=p=0', path]
+    output = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout
+    return sorted(float(line.strip(',')) for line in output.split() if line.strip(','))
+
+
+@needs_ffmpeg
+def test_keyframe_times(sample):
+    keyframes = keyframe_times(sample)
+    assert keyframes == pytest.approx([float(s) for s in range(DURATION)], abs=0.05)
+
+
+@needs_ffmpeg
+def test_segments_join_without_gaps_or_drift(sample, tmp_path):
+    segments = plan_segments(keyframe_times(sample), probe(sample)['duration'], 3)
+    assert len(segments) == 3
+    output = str(tmp_path / 'joined.mp4')
+    video_args = ['-c:v', 'libx264', '-preset', 'ultrafast', '-g', str(FPS), '-threads', '1']
+    assert encode_segmented(sample, output, segments, video_args, ['-c:a', 'aac', '-b:a', '96k'], str(tmp_path))
+
+    info = probe(output)
+    video, audio = first_stream(info, 'video'), first_stream(info, 'audio')
+    # No frames lost or duplicated at the cuts
+    times = packet_times(output, 'v:0')
+    assert abs(len(times) - FPS * DURATION) <= 1
+    # Timestamps keep increasing by one frame, without a jump or a step back at the joins
+    steps = [b - a for a, b in zip(times, times[1:])]
+    assert min(steps) > 0
+    assert max(steps) < 1.5 / FPS
+    assert times[0] == pytest.approx(0, abs=1.5 / FPS)
+    # Audio and video stay in sync: same start and same length
+    audio_times = packet_times(output, 'a:0')
+    assert audio_times[0] == pytest.approx(times[0], abs=0.05)
+    assert audio['duration'] == pytest.approx(video['duration'], abs=0.1)
+    assert video['duration'] == pytest.approx(DURATION, abs=0.1)
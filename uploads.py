@@ -0,0 +1,95 @@
+"""Streaming uploads: multipart file parts are written straight to disk.
+
+Werkzeug normally spools each uploaded file to a temporary file which the
+route then copies with `FileStorage.save()`. Here the form parser writes every
+chunk directly into a hidden `.part` file inside the upload folder, hashing it
+on the way and enforcing a per-endpoint size limit. `save_upload()` then only
+renames the part file into place.
+"""
+import hashlib
+import os
+import uuid
+
+from flask import Request, current_app, g, has_app_context
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from result_cache import hash_file
+
+
+class UploadFile:
+    """Write-through file object handed to Werkzeug's form parser."""
+
+    def __init__(self, folder, limit=None):
+        self.path = os.path.join(folder, f'.upload_{uuid.uuid4().hex}.part')
+        self.limit = limit
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = open(self.path, 'w+b')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.limit and self.size > self.limit:
+            raise RequestEntityTooLarge()
+        self._hash.update(data)
+        return self._file.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def claim(self, dest_path):
+        """Move the received bytes to `dest_path` and return their SHA-256."""
+        self._file.close()
+        os.replace(self.path, dest_path)
+        self.path = None
+        return self.hexdigest()
+
+    def close(self):
+        self._file.close()
+        # Parts that no route claimed are dropped with the request
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class StreamingUploadRequest(Request):
+    """Request class whose file uploads go through UploadFile.
+
+    Limits come from app.config: UPLOAD_LIMITS maps endpoint names to a byte
+    count per request and MAX_CONTENT_LENGTH is the default.
+    """
+
+    def upload_limit(self):
+        limits = current_app.config.get('UPLOAD_LIMITS', {})
+        return limits.get(self.endpoint, current_app.config.get('MAX_CONTENT_LENGTH'))
+
+    @property
+    def max_content_length(self):
+        # Checked by Werkzeug against Content-Length before the body is read
+        return self.upload_limit()
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return UploadFile(current_app.config['UPLOAD_FOLDER'], self.upload_limit())
+
+
+def save_upload(file, dest_path):
+    """Put an uploaded file at `dest_path` and return the SHA-256 of its bytes.
+
+    The hash is remembered for the current request so the result cache does
+    not have to read the file again.
+    """
+    stream = file.stream
+    if isinstance(stream, UploadFile):
+        digest = stream.claim(dest_path)
+    else:
+        file.save(dest_path)
+        digest = hash_file(dest_path)
+    g.setdefault('upload_hashes', {})[dest_path] = digest
+    return digest
+
+
+def known_hash(path):
+    """SHA-256 of `path`, reusing the one computed while it was uploaded (within that request)."""
+    known = g.get('upload_hashes', {}).get(path) if has_app_context() else None
+    return known or hash_file(path)
@@ -0,0 +1,241 @@
+"""Admission control for x264 encodes.
+
+The scheduler caps how many encodes run at once in this process, splits the
+cores between them through `-threads`, and trades compression efficiency for
+speed when jobs pile up: every waiting job moves new encodes one x264 preset
+faster. Finished jobs feed throughput statistics used to size instances.
+
+Long inputs can be encoded in segments: the video is cut at keyframes, each
+range is encoded by its own ffmpeg process, and the pieces are joined with the
+concat demuxer next to a separately encoded audio track.
+"""
+import collections
+import concurrent.futures
+import contextlib
+import json
+import os
+import subprocess
+import threading
+import time
+
+from media_probe import find_binary, run_ffmpeg
+
+# Fastest first
+X264_PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow']
+
+# Below this the picture falls apart whatever the encoder does
+MIN_VIDEO_BITRATE = 100_000
+
+
+def target_video_bitrate(target_bytes, duration, audio_bitrate):
+    """Video bitrate (bit/s) that lands the output near `target_bytes`, or None if unreachable."""
+    if duration <= 0:
+        return None
+    # Keep ~3% for the MP4 container and rate-control overshoot
+    total = target_bytes * 8 * 0.97 / duration
+    video = int(total - audio_bitrate)
+    return video if video >= MIN_VIDEO_BITRATE else None
+
+
+class EncodeJob:
+    """Resources granted to one encode: its thread count, preset and the load it started under."""
+
+    def __init__(self, task_id, threads, preset, load):
+        self.task_id = task_id
+        self.threads = threads
+        self.preset = preset
+        self.load = load
+        self.started = time.monotonic()
+        self.summary = None
+
+    def finish(self, media_seconds, input_bytes, output_bytes, mode):
+        wall = max(time.monotonic() - self.started, 1e-6)
+        self.summary = {
+            'task_id': self.task_id,
+            'mode': mode,
+            'preset': self.preset,
+            'threads': self.threads,
+            'load': self.load,
+            'media_seconds': round(media_seconds, 2),
+            'encode_seconds': round(wall, 2),
+            'speed': round(media_seconds / wall, 2),  # x realtime
+            'input_bytes': input_bytes,
+            'output_bytes': output_bytes,
+        }
+        return self.summary
+
+
+class EncoderScheduler:
+
+    def __init__(self, cores, max_jobs=None, queue_depth=None, history=100):
+        self.cores = max(1, cores)
+        self.max_jobs = max(1, max_jobs or self.cores // 4)
+        # Cores not yet handed out to a running encode
+        self._free_threads = self.cores
+        # Jobs still waiting upstream (e.g. in the worker pool queue)
+        self.queue_depth = queue_depth or (lambda: 0)
+        self._cond = threading.Condition()
+        self._running = {}
+        self._waiting = 0
+        self._history = collections.deque(maxlen=history)
+        self._totals = {'completed': 0, 'failed': 0, 'media_seconds': 0.0, 'encode_seconds': 0.0, 'output_bytes': 0}
+
+    def choose_preset(self, base_preset, load):
+        index = X264_PRESETS.index(base_preset)
+        return X264_PRESETS[max(0, index - load)]
+
+    @contextlib.contextmanager
+    def slot(self, task_id, base_preset):
+        """Wait for a free encode slot and yield the EncodeJob to run under it."""
+        with self._cond:
+            self._waiting += 1
+            while len(self._running) >= self.max_jobs:
+                self._cond.wait()
+            self._waiting -= 1
+            load = self._waiting + self.queue_depth()
+            # Unassigned cores shared between the slots still open: the total never exceeds the cores
+            threads = max(1, self._free_threads // (self.max_jobs - len(self._running)))
+            self._free_threads -= threads
+            job = EncodeJob(task_id, threads, self.choose_preset(base_preset, load), load)
+            self._running[task_id] = job
+        try:
+            yield job
+        except Exception:
+            with self._cond:
+                self._totals['failed'] += 1
+            raise
+        finally:
+            with self._cond:
+                self._running.pop(task_id, None)
+                self._free_threads += job.threads
+                if job.summary:
+                    self._history.append(job.summary)
+                    self._totals['completed'] += 1
+                    self._totals['media_seconds'] += job.summary['media_seconds']
+                    self._totals['encode_seconds'] += job.summary['encode_seconds']
+                    self._totals['output_bytes'] += job.summary['output_bytes']
+                self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            totals = dict(self._totals)
+            encode_seconds = totals['encode_seconds']
+            return {
+                'cores': self.cores,
+                'max_jobs': self.max_jobs,
+                'running': [{'task_id': j.task_id, 'preset': j.preset, 'threads': j.threads,
+                             'elapsed': round(time.monotonic() - j.started, 1)} for j in self._running.values()],
+                'waiting': self._waiting,
+                **totals,
+                'avg_encode_seconds': round(encode_seconds / totals['completed'], 2) if totals['completed'] else 0.0,
+                # Seconds of video produced per second of encoding, summed over jobs
+                'avg_speed': round(totals['media_seconds'] / encode_seconds, 2) if encode_seconds else 0.0,
+                'recent': list(self._history)[-20:],
+            }
+
+
+def keyframe_times(path):
+    """Keyframe timestamps of the first video stream, relative to its start.
+
+    Only keyframes are looked at (-skip_frame nokey), instead of listing every
+    packet of the file.
+    """
+    cmd = [find_binary('ffprobe'), '-v', 'error', '-select_streams', 'v:0', '-skip_frame', 'nokey',
+           '-show_entries', 'frame=pts_time:stream=start_time', '-of', 'json', path]
+    result = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
+    try:
+        info = json.loads(result.stdout or '{}')
+    except ValueError:
+        return []
+    times = []
+    for frame in info.get('frames', []):
+        try:
+            times.append(float(frame['pts_time']))
+        except (KeyError, ValueError):
+            continue
+    if not times:
+        return []
+    try:
+        start = float((info.get('streams') or [{}])[0]['start_time'])
+    except (KeyError, ValueError):
+        start = min(times)
+    return sorted(t - start for t in times)
+
+
+def plan_segments(keyframes, duration, count):
+    """Split [0, duration] into up to `count` (start, end) ranges starting on keyframes."""
+    cuts = [0.0]
+    for i in range(1, count):
+        ideal = duration * i / count
+        nearest = min(keyframes, key=lambda t: abs(t - ideal), default=None)
+        if nearest is not None and cuts[-1] < nearest < duration:
+            cuts.append(nearest)
+    return list(zip(cuts, cuts[1:] + [duration]))
+
+
+def _concat_line(path):
+    return "file '" + path.replace("'", "'\\''") + "'\n"
+
+
+def encode_segmented(input_path, output_path, segments, video_args, audio_args, workdir,
+                     on_progress=None, should_cancel=None):
+    """Encode `segments` of the video in parallel, then mux them with the audio into `output_path`.
+
+    `video_args` are the encoder options of one segment (its -threads share
+    included) and `audio_args` those of the audio track, or None to drop it.
+    Returns False if cancelled; raises FFmpegError like run_ffmpeg.
+    """
+    total = sum(end - start for start, end in segments) or 1.0
+    done = [0.0] * len(segments)
+    lock = threading.Lock()
+    abort = threading.Event()
+    seg_paths = [os.path.join(workdir, f'seg{i:03d}.ts') for i in range(len(segments))]
+    audio_path = os.path.join(workdir, 'audio.m4a')
+
+    def cancelled():
+        return abort.is_set() or bool(should_cancel and should_cancel())
+
+    def encode(i):
+        start, end = segments[i]
+        args = ['-ss', f'{start:.3f}', '-i', input_path]
+        if i < len(segments) - 1:
+            args += ['-t', f'{end - start:.3f}']
+        args += ['-map', '0:v:0', '-an', '-sn', '-dn'] + list(video_args) + ['-f', 'mpegts', seg_paths[i]]
+
+        def progress(fraction):
+            with lock:
+                done[i] = fraction * (end - start)
+                overall = sum(done) / total
+            if on_progress:
+                on_progress(overall)
+        return run_ffmpeg(args, end - start, progress, cancelled)
+
+    def encode_audio():
+        return run_ffmpeg(['-i', input_path, '-map', '0:a:0', '-vn', '-sn', '-dn'] + list(audio_args) + [audio_path],
+                          should_cancel=cancelled)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(segments) + 1) as pool:
+        futures = [pool.submit(encode, i) for i in range(len(segments))]
+        if audio_args:
+            futures.append(pool.submit(encode_audio))
+        finished = True
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                if not future.result():
+                    finished = False
+                    break
+        finally:
+            # Stop the other encodes as soon as one fails or is cancelled
+            abort.set()
+
+    if not finished:
+        return False
+
+    list_path = os.path.join(workdir, 'segments.txt')
+    with open(list_path, 'w', encoding='utf-8') as f:
+        f.writelines(_concat_line(p) for p in seg_paths)
+    args = ['-f', 'concat', '-safe', '0', '-i', list_path]
+    if audio_args:
+        args += ['-i', audio_path, '-map', '0:v:0', '-map', '1:a:0']
+    args += ['-c', 'copy', '-movflags', '+faststart', output_path]
+    return run_ffmpeg(args, should_cancel=should_cancel)
@@ -0,0 +1,149 @@
+"""Zip bundles with a compression method chosen per member.
+
+Media and other already-compressed formats are STORED (deflating an mp4 or a
+jpg burns CPU for a fraction of a percent), everything else is DEFLATEd. Zip64
+is always allowed so bundles over 4 GB or 65535 members stay valid.
+
+Bundles can also be virtual: only a manifest of member files is written, and
+`iter_zip()` produces the archive on the fly while it is being downloaded, so
+the members are never copied into a second file on disk.
+"""
+import io
+import json
+import os
+import zipfile
+
+COPY_CHUNK = 1024 * 1024
+
+STORED_EXTENSIONS = {
+    # images
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.avif', '.heic', '.heif', '.jxl',
+    # audio / video
+    '.mp3', '.m4a', '.aac', '.opus', '.ogg', '.oga', '.flac', '.wma',
+    '.mp4', '.m4v', '.mkv', '.webm', '.mov', '.avi', '.3gp', '.ts',
+    # archives and zip-based documents
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.zst',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.epub', '.apk', '.jar',
+}
+
+
+def compression_for(name):
+    ext = os.path.splitext(name)[1].lower()
+    return zipfile.ZIP_STORED if ext in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+
+
+def _zip_info(path, arcname):
+    info = zipfile.ZipInfo.from_file(path, arcname)
+    info.compress_type = compression_for(arcname)
+    return info
+
+
+def _copy_member(zf, path, arcname, on_chunk=None):
+    with open(path, 'rb') as src, zf.open(_zip_info(path, arcname), 'w') as dst:
+        for chunk in iter(lambda: src.read(COPY_CHUNK), b''):
+            dst.write(chunk)
+            if on_chunk:
+                on_chunk(len(chunk))
+
+
+def write_zip(zip_path, members, on_progress=None, should_cancel=None):
+    """Write `members` ([(path, arcname)]) to `zip_path`. Returns False if cancelled.
+
+    The archive appears under its final name only once it is complete.
+    """
+    total = sum(os.path.getsize(path) for path, _ in members) or 1
+    written = [0]
+
+    def on_chunk(size):
+        written[0] += size
+        if on_progress:
+            on_progress(written[0] / total)
+
+    part = zip_path + '.part'
+    try:
+        with zipfile.ZipFile(part, 'w', allowZip64=True, compresslevel=6) as zf:
+            for path, arcname in members:
+                if should_cancel and should_cancel():
+                    return False
+                _copy_member(zf, path, arcname, on_chunk)
+        os.replace(part, zip_path)
+        return True
+    finally:
+        if os.path.exists(part):
+            os.remove(part)
+
+
+class _Sink(io.RawIOBase):
+    """Unseekable output: zipfile then writes data descriptors and never goes back."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def iter_zip(members):
+    """Yield the bytes of a zip of `members` ([(path, arcname)]) as it is built."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True, compresslevel=6) as zf:
+        for path, arcname in members:
+            with open(path, 'rb') as src, zf.open(_zip_info(path, arcname), 'w') as dst:
+                for chunk in iter(lambda: src.read(COPY_CHUNK), b''):
+                    dst.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+    # Central directory
+    yield sink.drain()
+
+
+class VirtualZips:
+    """Manifests of zips that are streamed from their member files on download."""
+
+    def __init__(self, folder):
+        self.folder = os.path.realpath(folder)
+        self.manifest_dir = os.path.join(self.folder, '.manifests')
+        os.makedirs(self.manifest_dir, exist_ok=True)
+
+    def _manifest_path(self, zip_name):
+        return os.path.join(self.manifest_dir, os.path.basename(zip_name) + '.json')
+
+    def create(self, zip_name, members):
+        entries = []
+        for path, arcname in members:
+            path = os.path.realpath(path)
+            if os.path.dirname(path) != self.folder and not path.startswith(self.folder + os.sep):
+                raise ValueError(f'Member outside the download folder: {path}')
+            entries.append([os.path.relpath(path, self.folder), arcname])
+        tmp = self._manifest_path(zip_name) + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(entries, f)
+        os.replace(tmp, self._manifest_path(zip_name))
+
+    def members(self, zip_name):
+        """[(path, arcname)] of a virtual zip, or None if unknown or a member is gone."""
+        if zip_name != os.path.basename(zip_name):
+            return None
+        try:
+            with open(self._manifest_path(zip_name), encoding='utf-8') as f:
+                entries = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        members = [(os.path.join(self.folder, rel), arcname) for rel, arcname in entries]
+        if not all(os.path.isfile(path) for path, _ in members):
+            return None
+        return members
+
+    def exists(self, zip_name):
+        return self.members(zip_name) is not None